@@ -34,7 +34,7 @@ import ftplib
 import datetime
 import shutil
 import homewatcher
-from homewatcher import sensor, configuration, contexthandlers
+from homewatcher import sensor, configuration, contexthandlers, timer, objectcache, executor, outbox, mailer, uploader, processpump, shellexecutor
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
 from email.mime.text import MIMEText
@@ -42,6 +42,7 @@ from email.utils import COMMASPACE, formatdate
 import email.header
 from email import encoders
 import xml.dom.minidom
+import xml.sax.saxutils
 
 class AlertStatusBlocker(object):
     """ RAII wrapper for blocking/releasing the immediate status update of alerts.
@@ -60,18 +61,106 @@ class AlertStatusBlocker(object):
         for alert in self.daemon.alerts:
             alert.updateStatus()
 
+class ActionTarget:
+    """ Recipients of the XML of actions. """
+    LINKNX = 'linknx'
+    EMAIL = 'email'
+    SHELL = 'shell'
+
+def deliverAction(daemon, target, actionXml):
+    """ Delivers the XML of an action to its target. actionXml may contain several consecutive <action> elements for linknx, which are then sent in a single request. """
+    if target == ActionTarget.EMAIL:
+        daemon.sendEmail(actionXml)
+    elif target == ActionTarget.SHELL and daemon.shellExecutor != None:
+        daemon.shellExecutor.runAction(actionXml)
+    else:
+        daemon.linknx.executeAction(actionXml)
+
+class ActionTemplate(object):
+    """
+    Precompiled XML of an action, as sent to linknx.
+
+    The static parts of the action XML are serialized once. Parameterizable child elements are compiled and turned into slots, so that firing the action only has to render them and splice the resulting text into the prebuilt XML.
+    """
+    class _Slot(object):
+        def __init__(self, name, escape):
+            self.name = name
+            self.escape = escape
+
+    # Characters that XML parsers would normalize in attribute values.
+    _ATTRIBUTE_ENTITIES = {'"' : '&quot;', '\n' : '&#10;', '\r' : '&#13;', '\t' : '&#9;'}
+
+    def __init__(self, actionXml, attributeSlots=(), contentSlot=None, trailingContentSlot=None):
+        """
+        actionXml -- The <action> element from Homewatcher's configuration.
+        attributeSlots -- Names of the child elements whose interpreted text becomes the attribute of the same name.
+        contentSlot -- Name of the child element whose interpreted text replaces the whole inner content of the action, if that element is defined.
+        trailingContentSlot -- Name of a slot that is appended to the inner content of the action. Its value is not read from the configuration.
+        """
+        self.parameterizedStrings = {} # contexthandlers.ParameterizableString objects indexed by slot name.
+        slotNames = set(attributeSlots)
+        if contentSlot != None: slotNames.add(contentSlot)
+        for childNode in actionXml.childNodes:
+            if childNode.nodeType == xml.dom.minidom.Node.ELEMENT_NODE and childNode.tagName in slotNames and not childNode.tagName in self.parameterizedStrings:
+                self.parameterizedStrings[childNode.tagName] = contexthandlers.ParameterizableString(childNode)
+
+        # Opening tag. Parameterized attributes take precedence over static
+        # ones.
+        parts = ['<', actionXml.tagName]
+        for name, value in actionXml.attributes.items():
+            if name in self.parameterizedStrings: continue
+            parts += [' ', name, '="', ActionTemplate.escapeAttribute(value), '"']
+        for name in attributeSlots:
+            if name in self.parameterizedStrings:
+                parts += [' ', name, '="', ActionTemplate._Slot(name, ActionTemplate.escapeAttribute), '"']
+
+        # Inner content.
+        content = []
+        if contentSlot in self.parameterizedStrings:
+            content.append(ActionTemplate._Slot(contentSlot, xml.sax.saxutils.escape))
+        else:
+            for childNode in actionXml.childNodes:
+                if childNode.nodeType == xml.dom.minidom.Node.ELEMENT_NODE and childNode.tagName in self.parameterizedStrings: continue
+                content.append(childNode.toxml())
+        if trailingContentSlot != None:
+            content.append(ActionTemplate._Slot(trailingContentSlot, xml.sax.saxutils.escape))
+
+        if content:
+            parts += ['>'] + content + ['</', actionXml.tagName, '>']
+        else:
+            parts.append('/>')
+
+        # Merge consecutive static parts.
+        self._parts = []
+        for part in parts:
+            if isinstance(part, str) and self._parts and isinstance(self._parts[-1], str):
+                self._parts[-1] += part
+            else:
+                self._parts.append(part)
+
+    @staticmethod
+    def escapeAttribute(value):
+        return xml.sax.saxutils.escape(value, ActionTemplate._ATTRIBUTE_ENTITIES)
+
+    def render(self, slotValues):
+        """ Returns the XML string of the action, given the text of each slot. """
+        return ''.join([part if isinstance(part, str) else part.escape(slotValues[part.name]) for part in self._parts])
+
 class Action(object):
     """
     Base class for actions to be performed when an event is raised.
 
-    Action classes must implement their job in the execute() method.
+    Actions are built once, when the daemon starts. Action classes must implement their job in the render() method. It interprets the context and returns the XML to deliver to the target of the action, which may be deferred to a worker thread or to the outbox.
     """
+    TARGET = ActionTarget.LINKNX
 
     def __init__(self, daemon, config):
         self.daemon = daemon
         self._config = config
-        self.actionXml = xml.dom.minidom.Document()
-        self.actionXml.appendChild(self.actionXml.importNode(config.linknxActionXml, True))
+
+    @property
+    def config(self):
+        return self._config
 
     @property
     def description(self):
@@ -82,233 +171,77 @@ class Action(object):
         return self._config.type
 
     def parseParameterizableString(self, parameterizedStringXml, context):
-        text = ''
-        for childNode in parameterizedStringXml.childNodes:
-            if childNode.nodeType == xml.dom.minidom.Element.ELEMENT_NODE:
-                tagName = childNode.tagName
-                if tagName == 'br':
-                    text += '\n'
-                elif tagName == 'context':
-                    text += contexthandlers.ContextHandlerFactory.getInstance().makeHandler(childNode).analyzeContext(context)
-            elif childNode.nodeType == xml.dom.minidom.Element.TEXT_NODE:
-                text += childNode.data
-        return text
+        return contexthandlers.ParameterizableString(parameterizedStringXml).render(context)
 
-    def execute(self, context):
-        """ Implements the concrete job of the action. """
+    def renderTemplate(self, template, context, renderContext, **extraSlotValues):
+        """ Renders the parameterizable strings of template in the given context and returns the resulting action XML. """
+        slotValues = {name : string.render(context, renderContext) for name, string in template.parameterizedStrings.items()}
+        slotValues.update(extraSlotValues)
+        return template.render(slotValues)
+
+    def render(self, context, renderContext=None):
+        """ Implements the concrete job of the action. Returns the XML of the action to deliver to the target of the action. The optional contexthandlers.RenderContext memoizes the results of context handlers. """
         raise Exception('Action\'s job is not implemented.')
 
+    def prepare(self, context, renderContext=None):
+        """ Interprets the context immediately and returns a callable that takes no argument and delivers the action. """
+        actionXml = self.render(context, renderContext)
+        return lambda: deliverAction(self.daemon, self.TARGET, actionXml)
+
+    def execute(self, context):
+        """ Executes the action immediately. """
+        self.prepare(context)()
+
     def __repr__(self):
         return self.description
 
 class SendEmailAction(Action):
     """ Action that notifies of the alert by email. """
+    FOOTER = """
+
+--------------------------------------------------------
+This email was sent by Homewatcher v{0} on {1}"""
+    TARGET = ActionTarget.EMAIL
+
     def __init__(self, daemon, config):
         Action.__init__(self, daemon, config)
 
-    def execute(self, context):
-        # Initialize the XML to send to linknx with the XML from homewatcher
-        # configuration. That will duplicate the static subject and body, if
-        # defined.
-        linknxActionXml = xml.dom.minidom.Document()
-        linknxActionXml.appendChild(linknxActionXml.importNode(self.actionXml.childNodes[0], True))
-
-        # As a second step, interpret any parameterizable block.
-        actionXmlNode = linknxActionXml.getElementsByTagName('action')[0]
-        parameterizedBody = None
-        for childNode in actionXmlNode.childNodes:
-            if childNode.nodeType == xml.dom.minidom.Element.ELEMENT_NODE:
-                tagName = childNode.tagName
-                if tagName == 'subject':
-                    actionXmlNode.setAttribute('subject', self.parseParameterizableString(childNode, context))
-                    actionXmlNode.removeChild(childNode)
-                elif tagName == 'body':
-                    parameterizedBody = self.parseParameterizableString(childNode, context)
-                    actionXmlNode.removeChild(childNode)
-
         # If parameterizable body is used, allow for adding carriage returns and
-        # tabulations inside the <action> element to enhance XML text layout. To
-        # do so, we have to delete inner text nodes of the initial XML data.
-        if parameterizedBody != None:
-            while actionXmlNode.childNodes:
-                actionXmlNode.removeChild(actionXmlNode.childNodes[0])
-
-            textNode = linknxActionXml.createTextNode(parameterizedBody)
-            actionXmlNode.appendChild(textNode)
+        # tabulations inside the <action> element to enhance XML text layout:
+        # the body replaces the whole inner text of the initial XML data.
+        self.template = ActionTemplate(config.linknxActionXml, attributeSlots=('subject',), contentSlot='body', trailingContentSlot='footer')
 
-        # Append footer.
-        footer = """
-
---------------------------------------------------------
-This email was sent by Homewatcher v{0} on {1}""".format(homewatcher.__version__, datetime.datetime.now())
-        footerNode = linknxActionXml.createTextNode(footer)
-        actionXmlNode.appendChild(footerNode)
-
-        self.daemon.sendEmail(linknxActionXml)
+    def render(self, context, renderContext=None):
+        return self.renderTemplate(self.template, context, renderContext, footer=SendEmailAction.FOOTER.format(homewatcher.__version__, datetime.datetime.now()))
 
 class SendSMSAction(Action):
     """ Action that notifies of the alert by SMS. """
     def __init__(self, daemon, config):
         Action.__init__(self, daemon, config)
+        self.template = ActionTemplate(config.linknxActionXml, attributeSlots=('value',))
 
-    def execute(self, context):
-        # Initialize the XML to send to linknx with the XML from homewatcher
-        # configuration. That will duplicate the static subject and body, if
-        # defined.
-        linknxActionXml = xml.dom.minidom.Document()
-        linknxActionXml.appendChild(linknxActionXml.importNode(self.actionXml.childNodes[0], True))
-
-        # As a second step, interpret any parameterizable block.
-        actionXmlNode = linknxActionXml.getElementsByTagName('action')[0]
-        for childNode in actionXmlNode.childNodes:
-            if childNode.nodeType == xml.dom.minidom.Element.ELEMENT_NODE:
-                if childNode.tagName == 'value':
-                    actionXmlNode.setAttribute('value', self.parseParameterizableString(childNode, context))
-                    actionXmlNode.removeChild(childNode)
-
-        self.daemon.linknx.executeAction(linknxActionXml)
+    def render(self, context, renderContext=None):
+        return self.renderTemplate(self.template, context, renderContext)
 
 class ShellCommandAction(Action):
+    """ Action that runs a shell command, either natively or through linknx. """
+    TARGET = ActionTarget.SHELL
+
     def __init__(self, daemon, config):
         Action.__init__(self, daemon, config)
+        self.template = ActionTemplate(config.linknxActionXml, attributeSlots=('cmd',))
 
-    def execute(self, context):
-        # Initialize the XML to send to linknx with the XML from homewatcher
-        # configuration.
-        linknxActionXml = xml.dom.minidom.Document()
-        linknxActionXml.appendChild(linknxActionXml.importNode(self.actionXml.childNodes[0], True))
-
-        # As a second step, interpret any parameterizable block.
-        actionXmlNode = linknxActionXml.getElementsByTagName('action')[0]
-        for childNode in actionXmlNode.childNodes:
-            if childNode.nodeType == xml.dom.minidom.Element.ELEMENT_NODE:
-                if childNode.tagName == 'cmd':
-                    actionXmlNode.setAttribute('cmd', self.parseParameterizableString(childNode, context))
-                    actionXmlNode.removeChild(childNode)
-
-        self.daemon.linknx.executeAction(linknxActionXml)
+    def render(self, context, renderContext=None):
+        return self.renderTemplate(self.template, context, renderContext)
 
 class LinknxAction(Action):
     """ Action that sets the value of an object. """
     def __init__(self, daemon, config):
         Action.__init__(self, daemon, config)
+        self.actionXml = ActionTemplate(config.linknxActionXml).render({})
 
-    def execute(self, context):
-        self.daemon.linknx.executeAction(self.actionXml)
-# 
-# class FTPSender(threading.Thread):
-    # def __init__(self, daemon, url):
-        # threading.Thread.__init__(self, name='FTP backup thread')
-        # self.url = url
-        # self._daemon = daemon
-        # self.loginInfoFile = os.path.join(daemon.motionConfigDir, '.ftpcredentials')
-        # self.isTerminated = False
-        # self._connection = None
-        # # self._rootDirOnServer = '/motion.alert'
-# 
-    # def stop(self):
-        # if not self.isTerminated:
-            # logger.reportInfo('Terminating FTP backup thread...')
-        # self.isTerminated = True
-# 
-    # def getConnection(self):
-        # if not self._connection:
-            # self._openConnection()
-        # return self._connection
-# 
-    # def _openConnection(self):
-        # if self._connection:
-            # raise Exception('Connection already open.')
-# 
-        # loginInfoFile = open(self.loginInfoFile, 'r')
-        # try:
-            # [login, passwd] = [l.rstrip('\n') for l in loginInfoFile.readlines()]
-        # finally:
-            # loginInfoFile.close()
-            # loginInfoFile = None
-# 
-        # self._connection = ftplib.FTP(user=login, passwd=passwd, timeout=20)
-        # self._connection.connect(host=self.url.netloc, port=self.url.port)
-# 
-        # logger.reportInfo('FTP backup thread connection is open.')
-# 
-    # def _closeConnection(self):
-        # if not self._connection: return
-# 
-        # try:
-            # self._connection.quit()
-        # except Exception as e:
-            # logger.reportException()
-        # self._connection = None
-        # logger.reportInfo('FTP backup thread connection is closed.')
-# 
-    # def _getErrorCodeFromException(self):
-        # excep = sys.exc_info()[1]
-        # logger.reportDebug('FTP exception: {0}.'.format(excep))
-        # return int(excep.message[:3])
-# 
-    # def _cwd(self, directoryOnServer, createsIfNotFound):
-        # """ Performs a current directory change relative to the motion root on server. """
-        # directory = os.path.join(self.url.path, directoryOnServer)
-        # try:
-            # self.getConnection().cwd(directory)
-        # except ftplib.all_errors:
-            # errorCode = self._getErrorCodeFromException()
-            # currentDir = ''
-            # if errorCode == 550 and createsIfNotFound:
-                # # Create.
-                # for level in directory.split('/'):
-                    # if level == '': continue # Happens if directoryOnServer has a leading '/'
-                    # self._mkdOneLevel(level, True)
-                # logger.reportInfo('{0} created on FTP server.'.format(directory))
-            # else:
-                # raise
-# 
-            # # Try cwd'ing again.
-            # self._cwd(directoryOnServer, False)
-# 
-    # def _mkdOneLevel(self, level, createsIfNotFound):
-        # try:
-            # self.getConnection().cwd(level)
-        # except ftplib.all_errors as e:
-            # if createsIfNotFound:
-                # self.getConnection().mkd(level)
-                # self._mkdOneLevel(level, False)
-            # else:
-                # raise e
-# 
-    # def run(self):
-        # logger.reportInfo('FTP backup thread is ready. Configured for {0}'.format(self.url.geturl()))
-# 
-        # while not self.isTerminated:
-            # try:
-                # # Search for pictures to backup.
-                # for camera in self._daemon.cameras:
-                    # while camera.picturesToBackup:
-                        # picture = camera.picturesToBackup.pop(0)
-                        # if self.isTerminated:
-                            # return
-                        # pathOnServer, filename = os.path.split(os.path.relpath(picture, self._daemon.motionOutputDir))
-                        # # Change directory on server.
-                        # self._cwd(pathOnServer, True)
-# 
-                        # try:
-                            # # Push file.
-                            # pictureFile = None
-                            # pictureFile = open(picture, 'rb')
-                            # logger.reportDebug('Sending {0} to FTP server...'.format(filename))
-                            # self.getConnection().storbinary('STOR {0}'.format(filename), pictureFile)
-                            # logger.reportInfo(filename + ' has been sent to remote FTP server.')
-                        # finally:
-                            # if pictureFile: pictureFile.close()
-                            # pictureFile = None
-            # except Exception as e:
-                # logger.reportException()
-                # self.stop()
-            # finally:
-                # self._closeConnection()
-                # time.sleep(2)
-        # logger.reportInfo('FTP backup thread is now stopped.')
+    def render(self, context, renderContext=None):
+        return self.actionXml
 
 class EmailDescriptor(object):
     def __init__(self):
@@ -346,12 +279,16 @@ class Alert(object):
         self._sensorsInPrealert = set()
         self._sensorsInAlert = set()
         self._sensorsInAlertOnLastUpdateStatus = set()
+        self._joinedSensors = set() # Sensors that joined the alert since the last "sensor joined" event, including those of a coalesced event.
+        self._leftSensors = set() # Sensors that left the alert since the last "sensor left" event, including those of a coalesced event.
         self.status = Alert.Status.STOPPED
+        self._sensors = () # Filled by the daemon once all sensors are instanciated.
         self._sensorTimers = {} # Timers indexed by sensors. Each timer represents the prealert or alert timer for its associated sensor, depending on alert's current state.
-        self.persistenceObject = daemon.linknx.getObject(config.persistenceObjectId) if config.persistenceObjectId != None else None
-        self.inhibitionObject = daemon.linknx.getObject(config.inhibitionObjectId) if config.inhibitionObjectId != None else None
-        self.eventManager = EventManager(daemon)
+        self.persistenceObject = daemon.objectCache.getObject(config.persistenceObjectId)
+        self.inhibitionObject = daemon.objectCache.getObject(config.inhibitionObjectId)
+        self.eventManager = EventManager(daemon, 'Alert {0}'.format(config.name), self._lock)
         self.isStatusDirty = False
+        self._renderContext = None # Render context shared by the events fired during an update of the status.
         for eventConfig in self.daemon.configuration.alerts.events + self._config.events:
             self.eventManager.addEvent(eventConfig)
 
@@ -389,9 +326,11 @@ class Alert(object):
 
     @property
     def sensors(self):
-        for sensor in self.daemon.sensors:
-            if sensor.alert == self:
-                yield sensor
+        return self._sensors
+
+    def setSensors(self, sensors):
+        """ Sets the sensors that belong to this alert. They are stored in an immutable sequence that keeps the order of the configuration. """
+        self._sensors = tuple(sensors)
 
     @property
     def sensorsInPrealert(self):
@@ -401,6 +340,14 @@ class Alert(object):
     def sensorsInAlert(self):
         return self._sensorsInAlert
 
+    @property
+    def joinedSensors(self):
+        return self._joinedSensors
+
+    @property
+    def leftSensors(self):
+        return self._leftSensors
+
     @property
     def pausedSensors(self):
         def isSensorPaused(sensor):
@@ -444,15 +391,21 @@ class Alert(object):
     def notifyAlertStopped(self):
         self.fireEvent(configuration.AlertEvent.Type.ALERT_STOPPED)
 
-    def notifySensorJoined(self):
+    def notifySensorJoined(self, sensors):
+        # Sensors accumulate while the event is being coalesced, so that the
+        # single notification lists all of them.
+        if not self.eventManager.isCoalescing(configuration.AlertEvent.Type.SENSOR_JOINED): self._joinedSensors = set()
+        self._joinedSensors.update(sensors)
         self.fireEvent(configuration.AlertEvent.Type.SENSOR_JOINED)
 
-    def notifySensorLeft(self):
+    def notifySensorLeft(self, sensors):
+        if not self.eventManager.isCoalescing(configuration.AlertEvent.Type.SENSOR_LEFT): self._leftSensors = set()
+        self._leftSensors.update(sensors)
         self.fireEvent(configuration.AlertEvent.Type.SENSOR_LEFT)
 
     def fireEvent(self, eventType):
         logger.reportInfo('Firing event {0} for {1}'.format(eventType, self))
-        self.eventManager.fireEvent(eventType, 'Alert {0}: {1}'.format(self.name, eventType), self)
+        self.eventManager.fireEvent(eventType, 'Alert {0}: {1}'.format(self.name, eventType), self, self._renderContext)
 
     def updateStatus(self):
         """
@@ -466,6 +419,17 @@ class Alert(object):
         if not self.isStatusDirty:
             logger.reportDebug('Status of {0} is already up-to-date, nothing to change.'.format(self))
             return
+
+        # The events fired by a single update may use the same context
+        # handlers. The state they analyze does not change until the update
+        # is over.
+        self._renderContext = contexthandlers.RenderContext()
+        try:
+            self._applyStatus()
+        finally:
+            self._renderContext = None
+
+    def _applyStatus(self):
         logger.reportDebug('Updating status of {0}'.format(self))
 
         # Compute current status.
@@ -515,14 +479,14 @@ class Alert(object):
             if newStatus == Alert.Status.ACTIVE:
                 # Check if a sensor joined or left.
                 if joiningSensors:
-                    self.notifySensorJoined()
+                    self.notifySensorJoined(joiningSensors)
                 if leavingSensors:
-                    self.notifySensorLeft()
+                    self.notifySensorLeft(leavingSensors)
             elif newStatus in (Alert.Status.PAUSED, Alert.Status.STOPPED):
                 if not leavingSensors:
                     logger.reportError('A sensor should have left the alert.')
                 else:
-                    self.notifySensorLeft()
+                    self.notifySensorLeft(leavingSensors)
 
                 self.notifyAlertDeactivated()
 
@@ -549,7 +513,7 @@ class Alert(object):
                 if not joiningSensors:
                     logger.reportError('A sensor should have joined the alert.')
                 else:
-                    self.notifySensorJoined()
+                    self.notifySensorJoined(joiningSensors)
                 self.notifyAlertActivated()
         elif self.status == Alert.Status.INITIALIZING:
             if newStatus == Alert.Status.INITIALIZING:
@@ -560,7 +524,7 @@ class Alert(object):
                 if not joiningSensors:
                     logger.reportError('A sensor should have joined the alert.')
                 else:
-                    self.notifySensorJoined()
+                    self.notifySensorJoined(joiningSensors)
                 self.notifyAlertActivated()
             elif newStatus == Alert.Status.STOPPED:
                 self.notifyAlertAborted()
@@ -737,40 +701,133 @@ class Alert(object):
         # self.daemon.sendEmail(toAddr=self.daemon.alertAddresses, subject=subject, text=text, attachments=allAttachments)
 
 class EventManager(object):
-    def __init__(self, daemon):
+    def __init__(self, daemon, queueName, lock=None):
+        """
+        queueName -- Name of the executor queue in which actions are executed in order.
+        lock -- Lock that protects the context of events. Coalesced events are rendered with it held, since they are rendered by the timer thread.
+        """
         self.daemon = daemon
+        self.queueName = queueName
         self.eventConfigs = [] # configuration.Event objects (subclasses of it, actually)
+        self._eventsByType = {} # Key is event type, value is the list of tuples (event config, Action objects) in the order events were added.
+        self._lock = lock if lock != None else threading.RLock()
+        self._coalescingEvents = {} # Events whose coalescing window is open. Key is event config, value is a list [timer, description, context, number of merged firings].
 
     def addEvent(self, eventConfig):
         self.eventConfigs.append(eventConfig)
+        self._eventsByType.setdefault(eventConfig.type, []).append((eventConfig, [self._makeAction(actionConfig) for actionConfig in eventConfig.actions]))
+
+    def _makeAction(self, actionConfig):
+        if actionConfig.type == 'send-email':
+            return SendEmailAction(self.daemon, actionConfig)
+        elif actionConfig.type == 'send-sms':
+            return SendSMSAction(self.daemon, actionConfig)
+        elif actionConfig.type == 'shell-cmd':
+            return ShellCommandAction(self.daemon, actionConfig)
+        else:
+            # Delegate execution to linknx.
+            return LinknxAction(self.daemon, actionConfig)
 
-    def fireEvent(self, eventType, description, context):
-        """ Raises event (i.e executes every action related to this event). """
-        logger.reportDebug('Firing event {0}'.format(description))
-        for event in self.eventConfigs:
-            if event.type != eventType: continue
-
-            # Set up the various actions for that event type.
-            logger.reportDebug('Executing actions {0}'.format(event.actions))
-            for actionConfig in event.actions:
-                if actionConfig.type == 'send-email':
-                    action = SendEmailAction(self.daemon, actionConfig)
-                elif actionConfig.type == 'send-sms':
-                    action = SendSMSAction(self.daemon, actionConfig)
-                elif actionConfig.type == 'shell-cmd':
-                    action = ShellCommandAction(self.daemon, actionConfig)
-                else:
-                    # Delegate execution to linknx.
-                    action = LinknxAction(self.daemon, actionConfig)
+    def isCoalescing(self, eventType):
+        """ Tells whether an event of the given type is waiting for the end of its coalescing window. """
+        with self._lock:
+            return any(event.type == eventType for event in self._coalescingEvents)
+
+    def fireEvent(self, eventType, description, context, renderContext=None):
+        """
+        Raises event (i.e executes every action related to this event).
 
-                action.execute(context)
+        Actions interpret the context immediately but are executed by the daemon's action executor, after the actions of the events previously fired by this manager. Unless the event is configured as synchronous, this method does not wait for their execution.
+        Firing an event type that has no event configured is a mere dictionary lookup.
+        Events that define a coalescing delay are not executed immediately. The firings that occur during that delay are merged into a single execution, at the end of the delay, which interprets the context as it is at that time.
+        renderContext -- Optional contexthandlers.RenderContext to share among several events fired while the context does not change. Otherwise, results of context handlers are only shared among the actions of this event.
+        """
+        events = self._eventsByType.get(eventType)
+        if events == None: return
+        if renderContext == None: renderContext = contexthandlers.RenderContext()
+
+        logger.reportDebug('Firing event {0}'.format(description))
+        for event, actions in events:
+            if event.coalescingDelay:
+                self._coalesceEvent(event, actions, description, context)
+            else:
+                self._executeEvent(event, actions, description, context, renderContext)
         logger.reportDebug('Event {0} is now finished.'.format(description))
 
+    def _coalesceEvent(self, event, actions, description, context):
+        with self._lock:
+            coalescingEvent = self._coalescingEvents.get(event)
+            if coalescingEvent != None:
+                coalescingEvent[3] += 1
+                logger.reportDebug('Event {0} is merged into the one waiting for the end of its coalescing window.'.format(description))
+                return
+
+            def onCoalescingWindowEnded(t):
+                with self._lock:
+                    self._executeCoalescedEvent(event, actions)
+            coalescingTimer = timer.Timer(None, event.coalescingDelay, 'Coalescing timer for {0}'.format(description), onTimeoutReached=onCoalescingWindowEnded, scheduler=self.daemon.timerScheduler)
+            self._coalescingEvents[event] = [coalescingTimer, description, context, 1]
+            logger.reportDebug('Event {0} will be executed in {1} seconds, along with the events of the same type fired in the meantime.'.format(description, event.coalescingDelay))
+            coalescingTimer.start()
+
+    def _executeCoalescedEvent(self, event, actions):
+        coalescingEvent = self._coalescingEvents.pop(event, None)
+        if coalescingEvent == None: return # Already flushed.
+
+        coalescingTimer, description, context, firingCount = coalescingEvent
+        if firingCount > 1: description = '{0} (coalesced {1} times)'.format(description, firingCount)
+        self._executeEvent(event, actions, description, context, contexthandlers.RenderContext())
+
+    def _executeEvent(self, event, actions, description, context, renderContext):
+        logger.reportDebug('Executing actions {0}'.format(event.actions))
+        deliveries = [(action.TARGET, action.render(context, renderContext), '{0} of {1}'.format(action.config, description)) for action in actions]
+        if self.daemon.batchesLinknxActions: deliveries = self._batchDeliveries(deliveries, description)
+        if self.daemon.outbox != None:
+            # All actions of the event are made durable at once.
+            jobs = self.daemon.outbox.post(self.queueName, deliveries)
+        else:
+            jobs = [self.daemon.actionExecutor.submit(self.queueName, lambda target=target, actionXml=actionXml: deliverAction(self.daemon, target, actionXml), deliveryDescription) for target, actionXml, deliveryDescription in deliveries]
+
+        if event.isSynchronous:
+            for job in jobs:
+                job.wait()
+
+    def _isDelegatedToLinknx(self, target):
+        return target == ActionTarget.LINKNX or (target == ActionTarget.SHELL and self.daemon.shellExecutor == None)
+
+    def _batchDeliveries(self, deliveries, description):
+        """
+        Merges the consecutive rendered actions that are delegated to linknx into a single delivery.
+
+        linknx runs all the <action> elements of an <execute> request in sequence, so that a single round trip is needed for them. This is only done when enabled in the linknx service, since pyknx does not wait for linknx to answer and would not notice dropped actions. Actions delivered by Homewatcher itself (emails, native shell commands) split batches, to preserve the order of execution.
+        deliveries -- Tuples (target, action XML, description) in execution order.
+        """
+        batchedDeliveries = []
+        batch = []
+        for delivery in deliveries + [None]:
+            if delivery != None and self._isDelegatedToLinknx(delivery[0]):
+                batch.append(delivery)
+                continue
+            if len(batch) == 1:
+                batchedDeliveries.append(batch[0])
+            elif batch:
+                batchedDeliveries.append((ActionTarget.LINKNX, ''.join([actionXml for target, actionXml, actionDescription in batch]), '{0} linknx actions of {1}'.format(len(batch), description)))
+            batch = []
+            if delivery != None: batchedDeliveries.append(delivery)
+        return batchedDeliveries
+
+    def flush(self):
+        """ Executes the events that are waiting for the end of their coalescing window without further delay. """
+        with self._lock:
+            for event, actions in [(event, actions) for events in self._eventsByType.values() for event, actions in events if event in self._coalescingEvents]:
+                self._coalescingEvents[event][0].stop()
+                self._executeCoalescedEvent(event, actions)
+
 class Mode(object):
     def __init__(self, daemon, config):
         self._config = config
         self.daemon = daemon
-        self.eventManager = EventManager(daemon)
+        self.eventManager = EventManager(daemon, 'Modes') # Actions of all modes share the same queue so that mode changes are notified in order.
 
         for eventConfig in daemon._config.modesRepository.events + config.events:
             self.eventManager.addEvent(eventConfig)
@@ -801,12 +858,25 @@ class Mode(object):
 
 class Daemon(object):
     def __init__(self, communicator, configuration):
+        startTime = time.monotonic()
         configuration.resolve() # Does check integrity too.
         self._lock = threading.RLock()
         self.linknx = communicator.linknx
+        self.batchesLinknxActions = configuration.servicesRepository.linknx.batchActions
         self._config = configuration
         self.communicator = communicator
-        self._modeValueObject = self.linknx.getObject(self._config.modesRepository.objectId)
+        self.timerScheduler = self._makeTimerScheduler(configuration.servicesRepository.timers)
+        self.actionExecutor = self._makeActionExecutor(configuration.servicesRepository.actions)
+        self.mailer = self._makeMailer(configuration.servicesRepository.smtp)
+        self.outbox = self._makeOutbox(configuration.servicesRepository.outbox)
+        self.uploader = self._makeUploader(configuration.servicesRepository.upload)
+        self.processPump = processpump.ProcessPump()
+        self.shellExecutor = self._makeShellExecutor(configuration.servicesRepository.shell)
+        if self.uploader != None: self.uploader.start()
+        if self.outbox != None: self.outbox.open() # Delivers the actions left by the previous run.
+        self.objectCache = objectcache.ObjectCache(self.linknx, configuration.getNotifiedObjectIds())
+        self._prefetchObjectValues()
+        self._modeValueObject = self.objectCache.getObject(self._config.modesRepository.objectId)
         self._modes = {} # Key is mode's numeral value, value is mode object.
         for modeConfig in configuration.modesRepository.modes:
             self._modes[modeConfig.value] = Mode(self, modeConfig)
@@ -815,13 +885,20 @@ class Daemon(object):
         for alertConfig in configuration.alerts:
             self._alerts[alertConfig.name] = Alert(self, alertConfig)
         self._sensors = {} # Key is sensor name, value is sensor object.
+        self._pendingActivationsByWatchedSensor = {} # Key is a sensor, value is the set of sensors whose pending activation depends on its trigger state.
         for sensorConfig in configuration.sensors:
             self._sensors[sensorConfig.name] = self._makeSensor(sensorConfig, configuration)
+        for sensor in self.sensors:
+            # Bind criteria to the sensors they depend on, now that all of them
+            # exist.
+            if sensor.activationCriterion != None: sensor.activationCriterion.compile()
+        self._indexObjects()
         self._isTerminated = False
 
         self._currentMode = None
 
         self._updateModeFromLinknx()
+        logger.reportInfo('Daemon with {0} sensors started in {1:.3f}s ({2}).'.format(len(self._sensors), time.monotonic() - startTime, self.objectCache))
 
     def suspendAlertStatusUpdates(self):
         return AlertStatusBlocker(self)
@@ -855,6 +932,59 @@ class Daemon(object):
         else:
             raise Exception('Unable to instanciate sensor of type {0}'.format(sensorConfiguration.type))
 
+    def _prefetchObjectValues(self):
+        """ Reads the values of the cached objects in a few batched requests, so that alerts and sensors are built with fewer round trips to linknx. """
+        self.objectCache.prefetch(self._config.getReferencedObjectIds())
+
+    def _makeTimerScheduler(self, timersConfig):
+        if timersConfig == None: timersConfig = configuration.TimersService()
+        if timersConfig.scheduler == configuration.TimersService.Scheduler.HEAP:
+            return timer.TimerScheduler(timer.HeapTimerQueue(), timersConfig.callbackThreadCount)
+        elif timersConfig.scheduler == configuration.TimersService.Scheduler.WHEEL:
+            return timer.TimerScheduler(timer.TimerWheelQueue(timersConfig.resolution), timersConfig.callbackThreadCount)
+        else:
+            raise Exception('Unsupported timer scheduler {0}'.format(timersConfig.scheduler))
+
+    def _indexObjects(self):
+        """ (Re)builds the indices that map linknx object ids to the sensors and alerts that depend on them, as well as the sensors of each alert. Must be called whenever sensors or alerts change. """
+        sensorsByWatchedObjectId = {}
+        for sensor in self.sensors:
+            sensorsByWatchedObjectId.setdefault(sensor.watchedObjectId, []).append(sensor)
+        self._sensorsByWatchedObjectId = {objectId : tuple(sensors) for objectId, sensors in sensorsByWatchedObjectId.items()}
+
+        # In case of duplicates, the first alert wins as was the case when
+        # alerts were searched sequentially.
+        sensorsByAlert = {alert : [] for alert in self.alerts}
+        for sensor in self.sensors:
+            sensorsByAlert[sensor.alert].append(sensor)
+
+        self._alertsByPersistenceObjectId = {}
+        self._alertsByInhibitionObjectId = {}
+        for alert in self.alerts:
+            alert.setSensors(sensorsByAlert[alert])
+            if alert.persistenceObjectId != None: self._alertsByPersistenceObjectId.setdefault(alert.persistenceObjectId, alert)
+            if alert.inhibitionObjectId != None: self._alertsByInhibitionObjectId.setdefault(alert.inhibitionObjectId, alert)
+
+    def _makeMailer(self, smtpConfig):
+        if smtpConfig == None: return None
+        return mailer.SMTPMailer(smtpConfig.host, smtpConfig.port, smtpConfig.fromAddress, smtpConfig.username, smtpConfig.password, smtpConfig.startTLS, smtpConfig.sessionCount, smtpConfig.timeout, smtpConfig.idleTimeout)
+
+    def _makeOutbox(self, outboxConfig):
+        if outboxConfig == None: return None
+        return outbox.Outbox(outboxConfig.path, lambda target, actionXml: deliverAction(self, target, actionXml), self.actionExecutor, self.timerScheduler, outboxConfig.retryDelay, outboxConfig.maxRetryDelay, outboxConfig.maxAttemptCount)
+
+    def _makeUploader(self, uploadConfig):
+        if uploadConfig == None: return None
+        return uploader.FTPUploader(uploadConfig.host, uploadConfig.port, uploadConfig.username, uploadConfig.password, uploadConfig.remoteDirectory, uploadConfig.workerCount, uploadConfig.queueSize, uploadConfig.blockSize, uploadConfig.timeout, uploadConfig.watchedDirectory, uploadConfig.pollInterval, uploadConfig.maxAttemptCount, uploadConfig.deleteUploadedFiles)
+
+    def _makeShellExecutor(self, shellConfig):
+        if shellConfig == None: return None
+        return shellexecutor.ShellCommandExecutor(self.processPump, self.timerScheduler, shellConfig.maxRunningCount, shellConfig.queueSize, shellConfig.timeout, shellConfig.killDelay)
+
+    def _makeActionExecutor(self, actionsConfig):
+        if actionsConfig == None: actionsConfig = configuration.ActionsService()
+        return executor.ActionExecutor(actionsConfig.workerCount, actionsConfig.queueSize)
+
     @property
     def modeValue(self):
         return self._modeValueObject.value
@@ -902,22 +1032,24 @@ class Daemon(object):
         # self._sensors[sensorId] = sensor
 
     def getAlertByPersistenceObjectId(self, objectId):
-        for alert in self.alerts:
-            if alert.persistenceObjectId == objectId: return alert
-
-        raise Exception('No alert whose persistent object is {0}.'.format(objectId))
+        alert = self._alertsByPersistenceObjectId.get(objectId)
+        if alert is None:
+            raise Exception('No alert whose persistent object is {0}.'.format(objectId))
+        return alert
 
     def getAlertByInhibitionObjectId(self, objectId):
-        for alert in self.alerts:
-            if alert.inhibitionObjectId == objectId: return alert
-
-        raise Exception('No alert whose inhibition object is {0}.'.format(objectId))
+        alert = self._alertsByInhibitionObjectId.get(objectId)
+        if alert is None:
+            raise Exception('No alert whose inhibition object is {0}.'.format(objectId))
+        return alert
 
     def onPersistentAlertChanged(self, persistentObject):
-        logger.reportDebug('onPersistentAlertChanged {0}={1}'.format(persistentObject.id, persistentObject.value))
+        value = persistentObject.value
+        self.objectCache.notifyObjectChanged(persistentObject.id, value)
+        logger.reportDebug('onPersistentAlertChanged {0}={1}'.format(persistentObject.id, value))
 
         # Do nothing when persistent alert becomes true.
-        if persistentObject.value: return
+        if value: return
 
         # Reset persistence of sensors that belong to this alert type.
         deactivatedAlert = self.getAlertByPersistenceObjectId(persistentObject.id)
@@ -929,7 +1061,7 @@ class Daemon(object):
         deactivatedAlert.stop()
 
         # Reset persistent alert for all sensors.
-        for sensor in [s for s in self.sensors if s.alert == deactivatedAlert]:
+        for sensor in deactivatedAlert.sensors:
             if sensor.persistenceObject != None: sensor.persistenceObject.value = False
 
     @property
@@ -950,13 +1082,35 @@ class Daemon(object):
     def getSensorByName(self, sensorName):
         return self._sensors[sensorName]
 
+    def registerPendingActivation(self, sensor):
+        """ Registers a sensor whose activation timer has to be notified when one of the sensors its activation criterion depends on changes its trigger state. """
+        with self._lock:
+            for watchedSensor in sensor.activationCriterion.getWatchedSensors():
+                self._pendingActivationsByWatchedSensor.setdefault(watchedSensor, set()).add(sensor)
+
+    def unregisterPendingActivation(self, sensor):
+        with self._lock:
+            if sensor.activationCriterion is None: return
+            for watchedSensor in sensor.activationCriterion.getWatchedSensors():
+                dependentSensors = self._pendingActivationsByWatchedSensor.get(watchedSensor)
+                if dependentSensors is None: continue
+                dependentSensors.discard(sensor)
+                if not dependentSensors: del self._pendingActivationsByWatchedSensor[watchedSensor]
+
+    def notifySensorTriggerChanged(self, sensor):
+        """ Notifies the daemon that a sensor's trigger state has just changed, so that pending activations that depend on it can be paused or restarted. """
+        with self._lock:
+            dependentSensors = tuple(self._pendingActivationsByWatchedSensor.get(sensor, ()))
+
+        for dependentSensor in dependentSensors:
+            dependentSensor.notifyActivationCriterionChanged()
+
     def notifyWatchedObjectChanged(self, objectId):
         """ Notifies the daemon that one of its sensors' watched objects has just changed. """
+        self.objectCache.notifyObjectChanged(objectId)
+
         # Search for related sensors.
-        relatedSensors = []
-        for sensor in self.sensors:
-            if sensor.watchedObjectId == objectId:
-                relatedSensors.append(sensor)
+        relatedSensors = self._sensorsByWatchedObjectId.get(objectId)
 
         if not relatedSensors:
             raise Exception('No sensor watches the object {0}.'.format(objectId))
@@ -976,7 +1130,24 @@ class Daemon(object):
         logger.reportInfo('Terminating homewatcher daemon...')
         self._isTerminated = True
         self.disableAllSensors()
-        # if self._ftpBackupThread != None: self._ftpBackupThread.stop()
+        for eventManager in [mode.eventManager for mode in self._modes.values()] + [alert.eventManager for alert in self.alerts]:
+            eventManager.flush()
+        self.actionExecutor.stop(timeout=10)
+        if self.outbox != None:
+            self.outbox.close()
+            logger.reportInfo('{0}'.format(self.outbox))
+        if self.shellExecutor != None:
+            self.shellExecutor.stop(timeout=10)
+            logger.reportInfo('{0}'.format(self.shellExecutor))
+        self.processPump.stop(timeout=1)
+        if self.mailer != None:
+            self.mailer.close()
+            logger.reportInfo('{0}'.format(self.mailer))
+        logger.reportInfo('{0}'.format(self.objectCache))
+        logger.reportInfo('{0}'.format(self.actionExecutor))
+        if self.uploader != None:
+            self.uploader.stop(timeout=10)
+            logger.reportInfo('{0}'.format(self.uploader))
 
     def disableAllSensors(self):
         for sensor in self.sensors:
@@ -1004,7 +1175,7 @@ class Daemon(object):
             # logger.reportDebug('Lock released.')
 
     def onAlertInhibited(self, inhibitionObjectId):
-        pass
+        self.objectCache.notifyObjectChanged(inhibitionObjectId)
         # # Identify alert that got inhibited.
         # alert = self.getAlertByInhibitionObjectId(inhibitionObjectId)
 # 
@@ -1019,39 +1190,22 @@ class Daemon(object):
 
     def onModeValueChanged(self, value):
         logger.reportDebug('onModeValueChanged value={0}'.format(value))
+        self.objectCache.notifyObjectChanged(self._modeValueObject.id, value)
         self._updateModeFromLinknx()
 
+    def onCachedObjectChanged(self, objectId, value):
+        """ Notifies the daemon that an object whose value is only cached has changed. """
+        self.objectCache.notifyObjectChanged(objectId, value)
+
     def sendEmail(self, actionXml):
         if self.configuration.servicesRepository.linknx.ignoreEmail:
             return
 
-        self.linknx.executeAction(actionXml)
-        # smtpConfig = self.linknx.emailServerInfo
-        # if smtpConfig is None:
-            # logger.reportError('No emailing capability has been set up for the linknx daemon.')
-            # return
-# 
-        # host, port, fromAddress = smtpConfig
-# 
-        # msg = MIMEMultipart()
-        # msg['From'] = fromAddress
-        # msg['To'] = COMMASPACE.join(toAddr)
-        # msg['Date'] = formatdate(localtime=True)
-        # msg['Subject'] = '{0}'.format(email.header.Header(subject, 'utf-8'))
-        # msg.attach( MIMEText(_text=text, _charset='utf-8') )
-# 
-        # for file in attachments:
-            # part = MIMEBase('application', "octet-stream")
-            # part.set_payload( open(file,"rb").read() )
-            # Encoders.encode_base64(part)
-            # part.add_header('Content-Disposition', 'attachment; filename="{0}"'.format(os.path.basename(file)))
-            # msg.attach(part)
-# 
-        # smtp = smtplib.SMTP(host=host, port=port)
-        # smtp.sendmail(fromAddress, toAddr, msg.as_string())
-        # logger.reportInfo('Email sent to {0} with subject {1} and {2} attachments.'.format(','.join(toAddr), subject, len(attachments)))
-        # smtp.close()
-# 
+        if self.mailer != None:
+            self.mailer.sendAction(actionXml)
+        else:
+            self.linknx.executeAction(actionXml)
+
     # def _sendModeChangedEmail(self):
         # ignoredSensors = []
         # text = '{0}\nLa maison est maintenant en mode {1}'.format(time.asctime(), self._currentMode)
@@ -24,11 +24,82 @@ from homewatcher import ensurepyknx
 
 from pyknx import logger
 import xml.dom.minidom
+from xml.etree import ElementTree
+import xml.parsers.expat
+import copy
 import os.path
 import itertools
 import re
 from functools import cmp_to_key
 
+class XmlDocument(object):
+    """
+    XML document a configuration has been parsed from.
+
+    Only the name of a file is kept: the file is read again if some of its XML has to be rendered.
+    """
+    def __init__(self, name, text=None):
+        self.name = name
+        self.text = text # Content of the document if it does not come from a file.
+        self.encoding = 'utf-8' if isinstance(text, str) else None # Encoding of byte offsets in the document. Set from the XML declaration if any.
+
+    def read(self):
+        """ Returns the content of the document, as bytes. """
+        if self.text == None:
+            with open(self.name, 'rb') as xmlFile:
+                return xmlFile.read()
+        elif isinstance(self.text, str):
+            return self.text.encode('utf-8')
+        else:
+            return self.text
+
+    def __repr__(self):
+        return self.name
+
+class XmlSource(object):
+    """
+    Location of the XML element an object of the configuration has been read from.
+
+    Only byte offsets are stored. The XML and its line are only rendered when the location is formatted, which happens when an integrity problem is reported.
+    """
+    __slots__ = ('document', 'startIndex', 'endIndex') # Configurations may have tens of thousands of sources.
+
+    def __init__(self, document, startIndex, endIndex):
+        self.document = document
+        self.startIndex = startIndex # Byte offset of the start tag in the document.
+        self.endIndex = endIndex # Byte offset of the end tag, or of the start tag if the element is empty.
+
+    def __str__(self):
+        data = self.document.read()
+        if data.startswith(b'</', self.endIndex):
+            stopIndex = data.index(b'>', self.endIndex) + 1
+        else:
+            # Empty element: stop at the end of the start tag, ignoring the
+            # '>' that may appear in attribute values.
+            quote = None
+            for stopIndex in range(self.startIndex, len(data)):
+                c = data[stopIndex:stopIndex + 1]
+                if quote != None:
+                    if c == quote: quote = None
+                elif c in (b'"', b"'"):
+                    quote = c
+                elif c == b'>':
+                    break
+            stopIndex += 1
+        line = data.count(b'\n', 0, self.startIndex) + 1
+        column = self.startIndex - data.rfind(b'\n', 0, self.startIndex)
+        xmlText = data[self.startIndex:stopIndex].decode(self.document.encoding or 'utf-8', 'replace')
+        return '{0} (line {1}, column {2} of {3})'.format(xmlText, line, column, self.document)
+
+class _LocatedElement(ElementTree.Element):
+    """ ElementTree element that knows where it is in its document. Configuration.parseXml derives a class per document. """
+    __slots__ = ('startIndex', 'endIndex')
+    document = None
+
+    @property
+    def xmlSource(self):
+        return XmlSource(self.document, self.startIndex, self.endIndex)
+
 class Property(object):
     """
     Represents a property of an object which is part of the configuration.
@@ -40,7 +111,7 @@ class Property(object):
         CHILD_ELEMENT = 1 << 1
         INNER_TEXT = 1 << 2
 
-    def __init__(self, name, type, xmlEntityType, namesInXML=None, groupNameInXML = None, isCollection=False, isUnique=False, values=None, getter=None):
+    def __init__(self, name, type, xmlEntityType, namesInXML=None, groupNameInXML = None, isCollection=False, isUnique=False, values=None, getter=None, valuesKey=None):
         # Use property's name as name in XML by default.
         if namesInXML == None: namesInXML = name
 
@@ -56,6 +127,7 @@ class Property(object):
         self.isUnique = isUnique
         self.values = values # Collection of possible values. May be a callable (configuration object and property's owner object are passed as arguments). If None, no restriction on values.
         self.getter = getter # Optional method to call to retrieve property value. If set to None, the owner object's field named the same as this property is used.
+        self.valuesKey = valuesKey # Optional callable that tells what callable values depend on for a given owner (same arguments as values). Values are computed once per integrity check for each distinct key. If None, they are computed for each owner.
 
     def isOfPrimitiveType(self):
         return self.type in (str, int, float, bool)
@@ -66,7 +138,7 @@ class Property(object):
     def isDefinedOn(self, object):
         return self.name in vars(object) and vars(object)[self.name] != None
 
-    def checkValue(self, configuration, object, value, collectedValues):
+    def checkValue(self, checker, object, value, collectedValues):
         if self.isCollection:
             if not isinstance(value, list):
                 raise Configuration.IntegrityException('A list is expected.')
@@ -74,7 +146,7 @@ class Property(object):
         else:
             values = [value]
 
-        acceptableValues = self.getAcceptablesValues(configuration, object)
+        acceptableValues = checker.getAcceptableValues(self, object)
         if self.type == str:
             acceptableTypes = (str,)
         elif self.type == float:
@@ -87,16 +159,15 @@ class Property(object):
             if not isinstance(v, acceptableTypes):
                 raise Configuration.IntegrityException('A value of type {0} was expected, \"{1}\" of type {2} found.'.format(acceptableTypes, v, type(v)))
             if acceptableValues != None and not v in acceptableValues:
-                raise Configuration.IntegrityException('A value in {0} is expected, {1} found.'.format(acceptableValues, v))
+                # Report values in their natural order.
+                raise Configuration.IntegrityException('A value in {0} is expected, {1} found.'.format(self.getAcceptablesValues(checker.configuration, object), v))
 
             # Is this value unique?
-            if self.isUnique and self.name in collectedValues and v in collectedValues[self.name]:
-                raise Configuration.IntegrityException('Value {0} is already assigned to another object.'.format(v))
-
-            # Collect this value.
-            if not self.name in  collectedValues:
-                collectedValues[self.name] = []
-            collectedValues[self.name].append(v)
+            if self.isUnique:
+                uniqueValues = collectedValues.setdefault(self.name, set())
+                if v in uniqueValues:
+                    raise Configuration.IntegrityException('Value {0} is already assigned to another object.'.format(v))
+                uniqueValues.add(v)
 
     def getAcceptablesValues(self, configuration, object):
         if self.values == None: return None
@@ -112,16 +183,16 @@ class Property(object):
         else:
             return self.getter(object, config)
 
-    def checkObjectIntegrity(self, configuration, object, collectedValues):
+    def checkObjectIntegrity(self, checker, object, collectedValues):
         if not self.isDefinedOn(object): return
-        value = self.getValueFor(object, configuration)
+        value = self.getValueFor(object, checker.configuration)
         try:
-            self.checkValue(configuration, object, value, collectedValues)
+            self.checkValue(checker, object, value, collectedValues)
         except Configuration.IntegrityException as e:
             raise Configuration.IntegrityException('Property {0} is invalid: {1}'.format(self, e), problematicObject=object)
         if self.isOfClassType():
             if hasattr(self.type, 'PROPERTY_DEFINITIONS'):
-                self.type.PROPERTY_DEFINITIONS.checkIntegrity(configuration, value)
+                self.type.PROPERTY_DEFINITIONS.checkIntegrity(checker.configuration, value, checker=checker)
 
     def clone(self, source, destination):
         if self.name in vars(source):
@@ -137,7 +208,14 @@ class Property(object):
             else:
                 vars(destination)[self.name] = copyProperty(vars(source)[self.name])
 
-    def fromXML(self, xmlElement):
+    def fromXML(self, xmlElement, childrenByTag=None):
+        """
+        Reads the value of this property from an ElementTree element.
+
+        childrenByTag -- Child elements of xmlElement indexed by tag, as returned by Configuration.indexChildElements. Computed if None.
+        """
+        if childrenByTag == None: childrenByTag = Configuration.indexChildElements(xmlElement)
+
         # Scan sources for this property.
         sources = []
         for nameInXML in self.namesInXML:
@@ -146,7 +224,11 @@ class Property(object):
                 if attributeValue != None:
                     sources.append(attributeValue)
             if self.xmlEntityType & Property.XMLEntityTypes.CHILD_ELEMENT != 0:
-                sources += Configuration.getElementsInConfig(xmlElement, nameInXML, self.groupNameInXML)
+                if self.groupNameInXML == None:
+                    sources += childrenByTag.get(nameInXML, ())
+                else:
+                    for group in childrenByTag.get(self.groupNameInXML, ()):
+                        sources += [child for child in group if child.tag == nameInXML]
             if self.xmlEntityType & Property.XMLEntityTypes.INNER_TEXT != 0:
                 sources.append(Configuration.getTextInElement(xmlElement, mustFind=False))
 
@@ -175,7 +257,7 @@ class Property(object):
                 elif sourceStr.lower() == 'false':
                     values.append(False)
                 else:
-                    raise Configuration.IntegrityException('Property {0}={1} is not a boolean constant. Expecting {{true, false}}, case insensitive.'.format(self, sourceStr), xmlContext=xmlElement.toxml())
+                    raise Configuration.IntegrityException('Property {0}={1} is not a boolean constant. Expecting {{true, false}}, case insensitive.'.format(self, sourceStr), xmlContext=Configuration.renderXml(xmlElement))
             else:
                 # Type corresponds to a class.
                 if isinstance(source, str):
@@ -197,7 +279,7 @@ class Property(object):
 
                     # Assign attributes from XML.
                     if hasattr(newPropertyValue, 'attributes'):
-                        for k, v in source.attributes.items():
+                        for k, v in source.attrib.items():
                             newPropertyValue.attributes[k] = v
                     values.append(newPropertyValue)
 
@@ -209,7 +291,7 @@ class Property(object):
             return values
         else:
             if len(values) > 1:
-                raise Configuration.IntegrityException('Property {0} is not a collection, it must have a single value.'.format(self), xmlContext=xmlElement.toxml())
+                raise Configuration.IntegrityException('Property {0} is not a collection, it must have a single value.'.format(self), xmlContext=Configuration.renderXml(xmlElement))
             return values[0]
 
     def toXml(self, config, propertyOwner, xmlDoc, xmlElement):
@@ -284,13 +366,13 @@ class PropertyGroup(object):
     def isMandatory(self, object):
         return self.isMandatoryCallable(object)
 
-    def checkObjectIntegrity(self, configuration, object, collectedValues):
+    def checkObjectIntegrity(self, checker, object, collectedValues):
         isDefined = False
         for prop in self.properties:
-            prop.checkObjectIntegrity(configuration, object, collectedValues)
+            prop.checkObjectIntegrity(checker, object, collectedValues)
             isDefined |= prop.isDefinedOn(object)
 
-        if self.isMandatory(PropertyGroup.GroupUseContext(configuration, object)) and not isDefined:
+        if self.isMandatory(PropertyGroup.GroupUseContext(checker.configuration, object)) and not isDefined:
             if len(self.properties) == 1:
                 raise Configuration.IntegrityException('"{0}" should define the property {1}.'.format(object, self.properties[0]), problematicObject=object)
             else:
@@ -301,13 +383,16 @@ class PropertyCollection(object):
     def __init__(self):
         self.propertyGroups = []
         self.ignoreCheckIntegrityCallable = lambda object: False
+        self._xmlDispatchTable = None # Built on first read, cf. _getXmlDispatchTable.
 
-    def addProperty(self, propertyName, isMandatory, type, xmlEntityType, namesInXML=None, groupNameInXML = None, isCollection=False, isUnique=False, values=None, getter=None):
-        self.propertyGroups.append(PropertyGroup([Property(name=propertyName, type=type, xmlEntityType = xmlEntityType, namesInXML=namesInXML, groupNameInXML=groupNameInXML, isCollection=isCollection, isUnique=isUnique, values=values, getter=getter)], isMandatory))
+    def addProperty(self, propertyName, isMandatory, type, xmlEntityType, namesInXML=None, groupNameInXML = None, isCollection=False, isUnique=False, values=None, getter=None, valuesKey=None):
+        self.propertyGroups.append(PropertyGroup([Property(name=propertyName, type=type, xmlEntityType = xmlEntityType, namesInXML=namesInXML, groupNameInXML=groupNameInXML, isCollection=isCollection, isUnique=isUnique, values=values, getter=getter, valuesKey=valuesKey)], isMandatory))
+        self._xmlDispatchTable = None
 
     def addPropertyGroup(self, properties, isGroupMandatory = True):
         group = PropertyGroup(properties[:], isGroupMandatory)
         self.propertyGroups.append(group)
+        self._xmlDispatchTable = None
 
     def cloneProperties(self, source, destination):
         for propDef in self.properties:
@@ -325,42 +410,89 @@ class PropertyCollection(object):
         raise Exception('No property {0} found in group {1}.'.format(propertyName, self))
 
     def readObjectFromXML(self, object, xmlElement):
-        object.xmlSource = xmlElement.toxml()
-        for prop in self.properties:
-            if prop.namesInXML != None:
-                value = prop.fromXML(xmlElement)
-
-                if value is None:
-                    if prop.isDefinedOn(object):
-                        # We are better off keeping the current value than
-                        # overriding it with the never explicitly-defined (hence rather meaningless) None value.
-                        continue
-                    else:
-                        # Assigning the None value guarantees that all properties are always defined on the
-                        # destination object even if the XML configuration is not complete.
-                        vars(object)[prop.name] = value
+        """ Assigns the properties of an object from an ElementTree element. A DOM element is also accepted, at the expense of a conversion. """
+        if not ElementTree.iselement(xmlElement): xmlElement = Configuration.convertDOMElement(xmlElement)
+        if isinstance(xmlElement, _LocatedElement):
+            object.xmlSource = xmlElement.xmlSource
+        else:
+            # Element has not been parsed by Configuration.parseXml, keep its
+            # XML right away.
+            object.xmlSource = Configuration.renderXml(xmlElement)
+
+        # Index children once, so that each property only looks up the
+        # elements named after it. Properties that have no attribute, child or
+        # text to read from are not even scanned.
+        childrenByTag = Configuration.indexChildElements(xmlElement)
+        properties, propertiesByXmlName = self._getXmlDispatchTable()
+        readableProperties = set(propertiesByXmlName.get(None, ()))
+        for name in itertools.chain(xmlElement.keys(), childrenByTag):
+            readableProperties.update(propertiesByXmlName.get(name, ()))
+        objectVars = vars(object)
+        for prop in properties:
+            value = prop.fromXML(xmlElement, childrenByTag) if prop in readableProperties else None
+
+            if value is None:
+                if objectVars.get(prop.name) is not None:
+                    # We are better off keeping the current value than
+                    # overriding it with the never explicitly-defined (hence rather meaningless) None value.
+                    continue
                 else:
-                    if prop.isCollection and prop.isDefinedOn(object):
-                        # Do not override current items!
-                        vars(object)[prop.name].extend(value)
-                    else:
-                        # First definition of collection or assignment of a simple field.
-                        vars(object)[prop.name] = value
+                    # Assigning the None value guarantees that all properties are always defined on the
+                    # destination object even if the XML configuration is not complete.
+                    objectVars[prop.name] = value
+            else:
+                if prop.isCollection and prop.isDefinedOn(object):
+                    # Do not override current items!
+                    objectVars[prop.name].extend(value)
+                else:
+                    # First definition of collection or assignment of a simple field.
+                    objectVars[prop.name] = value
+
+    def _getXmlDispatchTable(self):
+        """
+        Returns the properties that are read from XML, along with a dictionary that indexes them by the names of the attributes or child elements they may be read from.
 
-    def checkIntegrity(self, configuration, obj, collectedValues=None):
+        Properties read from inner text are indexed by None.
+        """
+        if self._xmlDispatchTable == None:
+            properties = [prop for prop in self.properties if prop.namesInXML != None]
+            propertiesByXmlName = {}
+            for prop in properties:
+                names = []
+                if prop.xmlEntityType & Property.XMLEntityTypes.ATTRIBUTE != 0 or (prop.xmlEntityType & Property.XMLEntityTypes.CHILD_ELEMENT != 0 and prop.groupNameInXML == None):
+                    names += prop.namesInXML
+                if prop.xmlEntityType & Property.XMLEntityTypes.CHILD_ELEMENT != 0 and prop.groupNameInXML != None:
+                    names.append(prop.groupNameInXML)
+                if prop.xmlEntityType & Property.XMLEntityTypes.INNER_TEXT != 0:
+                    names.append(None)
+                for name in names:
+                    propertiesByXmlName.setdefault(name, []).append(prop)
+            self._xmlDispatchTable = (properties, propertiesByXmlName)
+        return self._xmlDispatchTable
+
+    def checkIntegrity(self, configuration, obj, collectedValues=None, checker=None):
         """
         Checks the integrity of an object wrt this collection of properties.
 
         configuration: Configuration object that contains the object to check.
         obj: Object to check
-        collectedValues: Properties' values. It is a dictionary that indexes list of values with property names as keys.
+        collectedValues: Values of unique properties. It is a dictionary that indexes sets of values with property names as keys.
+        checker: Configuration.IntegrityChecker that collects the problems found. If None, the first problem is raised once the object has been checked.
         """
         if collectedValues == None: collectedValues = {}
+        ownsChecker = checker == None
+        if ownsChecker: checker = Configuration.IntegrityChecker(configuration)
         objects = obj if isinstance(obj, list) else [obj]
         for o in objects:
             if self.ignoreCheckIntegrityCallable(o): continue
-            for group in self.propertyGroups:
-                group.checkObjectIntegrity(configuration, o, collectedValues)
+            try:
+                for group in self.propertyGroups:
+                    group.checkObjectIntegrity(checker, o, collectedValues)
+            except Configuration.IntegrityException as e:
+                # Skip the remaining properties of this object, whose checks
+                # may depend on the faulty one.
+                checker.violations.append(e)
+        if ownsChecker: checker.raiseViolations()
 
     def toXml(self, config, propertyOwner, xmlDoc, xmlElement):
         for prop in self.properties:
@@ -423,18 +555,32 @@ class PyknxService(object):
     def __repr__(self):
         return 'PyknxService(host={host}, port={port})'.format(**vars(self))
 
-# class SMTPService(object):
-    # PROPERTY_DEFINITIONS = PropertyCollection()
-    # PROPERTY_DEFINITIONS.addProperty('host', isMandatory=False, type=str, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE|Property.XMLEntityTypes.CHILD_ELEMENT)
-    # PROPERTY_DEFINITIONS.addProperty('port', isMandatory=False, type=int, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE|Property.XMLEntityTypes.CHILD_ELEMENT)
-    # PROPERTY_DEFINITIONS.addProperty('fromAddress', isMandatory=False, type=str, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE|Property.XMLEntityTypes.CHILD_ELEMENT)
-# 
-    # def __init__(self):
-        # self.host = 'localhost'
-        # self.port = 25
-# 
-    # def __repr__(self):
-        # return 'SMTPService(host={host}, port={port})'.format(**vars(self))
+class SMTPService(object):
+    """ Represents the configuration of the SMTP server that sends emails instead of linknx. """
+    PROPERTY_DEFINITIONS = PropertyCollection()
+    PROPERTY_DEFINITIONS.addProperty('host', isMandatory=False, type=str, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE|Property.XMLEntityTypes.CHILD_ELEMENT)
+    PROPERTY_DEFINITIONS.addProperty('port', isMandatory=False, type=int, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE|Property.XMLEntityTypes.CHILD_ELEMENT)
+    PROPERTY_DEFINITIONS.addProperty('fromAddress', isMandatory=True, type=str, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE|Property.XMLEntityTypes.CHILD_ELEMENT, namesInXML='from')
+    PROPERTY_DEFINITIONS.addProperty('username', isMandatory=False, type=str, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE|Property.XMLEntityTypes.CHILD_ELEMENT, namesInXML='user')
+    PROPERTY_DEFINITIONS.addProperty('password', isMandatory=False, type=str, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE|Property.XMLEntityTypes.CHILD_ELEMENT)
+    PROPERTY_DEFINITIONS.addProperty('startTLS', isMandatory=False, type=bool, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE)
+    PROPERTY_DEFINITIONS.addProperty('sessionCount', isMandatory=False, type=int, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE, namesInXML='sessions')
+    PROPERTY_DEFINITIONS.addProperty('timeout', isMandatory=False, type=float, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE)
+    PROPERTY_DEFINITIONS.addProperty('idleTimeout', isMandatory=False, type=float, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE)
+
+    def __init__(self):
+        self.host = 'localhost'
+        self.port = 25
+        self.fromAddress = None
+        self.username = None # No authentication if None.
+        self.password = None
+        self.startTLS = False
+        self.sessionCount = 2
+        self.timeout = 30.0
+        self.idleTimeout = 60.0 # Idle sessions are reopened after this many seconds.
+
+    def __repr__(self):
+        return 'SMTPService(host={host}, port={port}, fromAddress={fromAddress}, sessionCount={sessionCount})'.format(**vars(self))
 
 class LinknxService(object):
     PROPERTY_DEFINITIONS = PropertyCollection()
@@ -442,11 +588,13 @@ class LinknxService(object):
     portProp = Property('port', type=int, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE|Property.XMLEntityTypes.CHILD_ELEMENT)
     PROPERTY_DEFINITIONS.addPropertyGroup((hostProp, portProp))
     PROPERTY_DEFINITIONS.addProperty('ignoreEmail', isMandatory=False, type=bool, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE)
+    PROPERTY_DEFINITIONS.addProperty('batchActions', isMandatory=False, type=bool, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE)
 
     def __init__(self):
         self.host = '127.0.0.1'
         self.port = 1028
         self.ignoreEmail = False
+        self.batchActions = False # Whether consecutive linknx actions of an event are sent in a single request. Only enable it for a linknx version that runs all actions of a request in order.
 
     @property
     def address(self):
@@ -455,15 +603,132 @@ class LinknxService(object):
     def __repr__(self):
         return 'LinknxService(host={host},port={port})'.format(**vars(self))
 
+class TimersService(object):
+    """ Represents the configuration of the scheduler that drives activation, prealert and alert timers. """
+    class Scheduler(object):
+        HEAP = 'heap'
+        WHEEL = 'wheel'
+
+        @staticmethod
+        def getAll():
+            return [TimersService.Scheduler.HEAP, TimersService.Scheduler.WHEEL]
+
+    def __init__(self):
+        self.scheduler = TimersService.Scheduler.HEAP
+        self.resolution = 0.1 # Duration of a tick of the timer wheel, in seconds.
+        self.callbackThreadCount = 4 # Number of timer callbacks that can run at once.
+
+    def __repr__(self):
+        return 'TimersService(scheduler={scheduler}, resolution={resolution}, callbackThreadCount={callbackThreadCount})'.format(**vars(self))
+
+# Define properties outside class because of a reference to the class itself.
+TimersService.PROPERTY_DEFINITIONS = PropertyCollection()
+TimersService.PROPERTY_DEFINITIONS.addProperty('scheduler', isMandatory=False, type=str, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE, values=TimersService.Scheduler.getAll())
+TimersService.PROPERTY_DEFINITIONS.addProperty('resolution', isMandatory=False, type=float, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE)
+TimersService.PROPERTY_DEFINITIONS.addProperty('callbackThreadCount', isMandatory=False, type=int, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE, namesInXML='callbackThreads')
+
+class ActionsService(object):
+    """ Represents the configuration of the pool of workers that execute the actions of events. """
+    PROPERTY_DEFINITIONS = PropertyCollection()
+    PROPERTY_DEFINITIONS.addProperty('workerCount', isMandatory=False, type=int, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE, namesInXML='workers')
+    PROPERTY_DEFINITIONS.addProperty('queueSize', isMandatory=False, type=int, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE)
+
+    def __init__(self):
+        self.workerCount = 4
+        self.queueSize = 1000 # Maximum number of actions waiting for execution.
+
+    def __repr__(self):
+        return 'ActionsService(workerCount={workerCount}, queueSize={queueSize})'.format(**vars(self))
+
+class OutboxService(object):
+    """ Represents the configuration of the outbox through which actions are delivered. """
+    PROPERTY_DEFINITIONS = PropertyCollection()
+    PROPERTY_DEFINITIONS.addProperty('path', isMandatory=True, type=str, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE)
+    PROPERTY_DEFINITIONS.addProperty('retryDelay', isMandatory=False, type=float, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE)
+    PROPERTY_DEFINITIONS.addProperty('maxRetryDelay', isMandatory=False, type=float, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE)
+    PROPERTY_DEFINITIONS.addProperty('maxAttemptCount', isMandatory=False, type=int, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE, namesInXML='maxAttempts')
+
+    def __init__(self):
+        self.path = None # Journal file.
+        self.retryDelay = 1.0 # In seconds, doubled after each failure.
+        self.maxRetryDelay = 300.0
+        self.maxAttemptCount = None # Retry forever if None.
+
+    def __repr__(self):
+        return 'OutboxService(path={path}, retryDelay={retryDelay}, maxRetryDelay={maxRetryDelay}, maxAttemptCount={maxAttemptCount})'.format(**vars(self))
+
+class UploadService(object):
+    """ Represents the configuration of the FTP server captured files are uploaded to. """
+    PROPERTY_DEFINITIONS = PropertyCollection()
+    PROPERTY_DEFINITIONS.addProperty('host', isMandatory=True, type=str, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE|Property.XMLEntityTypes.CHILD_ELEMENT)
+    PROPERTY_DEFINITIONS.addProperty('port', isMandatory=False, type=int, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE|Property.XMLEntityTypes.CHILD_ELEMENT)
+    PROPERTY_DEFINITIONS.addProperty('username', isMandatory=False, type=str, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE|Property.XMLEntityTypes.CHILD_ELEMENT, namesInXML='user')
+    PROPERTY_DEFINITIONS.addProperty('password', isMandatory=False, type=str, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE|Property.XMLEntityTypes.CHILD_ELEMENT)
+    PROPERTY_DEFINITIONS.addProperty('remoteDirectory', isMandatory=False, type=str, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE, namesInXML='directory')
+    PROPERTY_DEFINITIONS.addProperty('watchedDirectory', isMandatory=False, type=str, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE)
+    PROPERTY_DEFINITIONS.addProperty('deleteUploadedFiles', isMandatory=False, type=bool, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE)
+    PROPERTY_DEFINITIONS.addProperty('pollInterval', isMandatory=False, type=float, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE)
+    PROPERTY_DEFINITIONS.addProperty('maxAttemptCount', isMandatory=False, type=int, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE, namesInXML='maxAttempts')
+    PROPERTY_DEFINITIONS.addProperty('workerCount', isMandatory=False, type=int, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE, namesInXML='workers')
+    PROPERTY_DEFINITIONS.addProperty('queueSize', isMandatory=False, type=int, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE)
+    PROPERTY_DEFINITIONS.addProperty('blockSize', isMandatory=False, type=int, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE)
+    PROPERTY_DEFINITIONS.addProperty('timeout', isMandatory=False, type=float, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE)
+
+    def __init__(self):
+        self.host = None
+        self.port = 21
+        self.username = None # Anonymous login if None.
+        self.password = None
+        self.remoteDirectory = '/'
+        self.watchedDirectory = None # Local directory whose new files are uploaded. None to only upload files queued explicitly.
+        self.deleteUploadedFiles = False
+        self.pollInterval = 1.0 # Delay between two scans of the watched directory and between two retries, in seconds.
+        self.maxAttemptCount = 3
+        self.workerCount = 2
+        self.queueSize = 100 # Oldest files are dropped beyond.
+        self.blockSize = 65536
+        self.timeout = 20.0
+
+    def __repr__(self):
+        return 'UploadService(host={host}, port={port}, remoteDirectory={remoteDirectory}, watchedDirectory={watchedDirectory}, workerCount={workerCount}, queueSize={queueSize})'.format(**vars(self))
+
+class ShellService(object):
+    """ Represents the configuration of the executor that runs shell-cmd actions instead of linknx. """
+    PROPERTY_DEFINITIONS = PropertyCollection()
+    PROPERTY_DEFINITIONS.addProperty('maxRunningCount', isMandatory=False, type=int, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE, namesInXML='maxRunning')
+    PROPERTY_DEFINITIONS.addProperty('queueSize', isMandatory=False, type=int, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE)
+    PROPERTY_DEFINITIONS.addProperty('timeout', isMandatory=False, type=float, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE)
+    PROPERTY_DEFINITIONS.addProperty('killDelay', isMandatory=False, type=float, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE)
+
+    def __init__(self):
+        self.maxRunningCount = 4
+        self.queueSize = 100
+        self.timeout = 60.0 # Commands are terminated after this many seconds...
+        self.killDelay = 5.0 # ...then killed after this many more.
+
+    def __repr__(self):
+        return 'ShellService(maxRunningCount={maxRunningCount}, queueSize={queueSize}, timeout={timeout}, killDelay={killDelay})'.format(**vars(self))
+
 class ServicesRepository(object):
     PROPERTY_DEFINITIONS = PropertyCollection()
     PROPERTY_DEFINITIONS.addProperty('linknx', isMandatory=False, type=LinknxService, xmlEntityType=Property.XMLEntityTypes.CHILD_ELEMENT)
     PROPERTY_DEFINITIONS.addProperty('daemon', isMandatory=False, type=PyknxService, xmlEntityType=Property.XMLEntityTypes.CHILD_ELEMENT)
-    # PROPERTY_DEFINITIONS.addProperty('smtp', isMandatory=False, type=SMTPService, xmlEntityType=Property.XMLEntityTypes.CHILD_ELEMENT)
+    PROPERTY_DEFINITIONS.addProperty('smtp', isMandatory=False, type=SMTPService, xmlEntityType=Property.XMLEntityTypes.CHILD_ELEMENT)
+    PROPERTY_DEFINITIONS.addProperty('timers', isMandatory=False, type=TimersService, xmlEntityType=Property.XMLEntityTypes.CHILD_ELEMENT)
+    PROPERTY_DEFINITIONS.addProperty('actions', isMandatory=False, type=ActionsService, xmlEntityType=Property.XMLEntityTypes.CHILD_ELEMENT)
+    PROPERTY_DEFINITIONS.addProperty('outbox', isMandatory=False, type=OutboxService, xmlEntityType=Property.XMLEntityTypes.CHILD_ELEMENT)
+    PROPERTY_DEFINITIONS.addProperty('upload', isMandatory=False, type=UploadService, xmlEntityType=Property.XMLEntityTypes.CHILD_ELEMENT)
+    PROPERTY_DEFINITIONS.addProperty('shell', isMandatory=False, type=ShellService, xmlEntityType=Property.XMLEntityTypes.CHILD_ELEMENT)
 
     def __init__(self):
         self.linknx = LinknxService()
         self.daemon = PyknxService()
+        self.timers = None # Default scheduler is used if not defined.
+        self.actions = None # Default worker pool is used if not defined.
+        self.outbox = None # Actions are delivered directly if not defined.
+        self.smtp = None # Emails are sent by linknx if not defined.
+        self.upload = None # Files are not uploaded if not defined.
+        self.shell = None # Shell commands are run by linknx if not defined.
 
 class ModeDependentValue(object):
 
@@ -555,13 +820,11 @@ class ModeDependentValue(object):
 
     def inherit(self, other):
         """ Inherits values from another instance for modes that have no specific value in this instance. """
-        logger.reportDebug('{0} inherits from {1}'.format(self, other))
         definedModes = self.getDefinedModes()
         for value in other.values:
             # Do not overwrite the value in this instance!
             if value.modeName in definedModes: continue
             self.values.append(value.copy())
-        logger.reportDebug('That gives {0}'.format(self, other))
 
     def __repr__(self):
         return 'ModeDependentValue({values})'.format(**vars(self))
@@ -633,7 +896,7 @@ ActivationCriterion.PROPERTY_DEFINITIONS = PropertyCollection()
 ActivationCriterion.PROPERTY_DEFINITIONS.addProperty('type', isMandatory=True, type=str, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE, values=ActivationCriterion.Type.getAll())
 isOfSensorType=lambda context: context.object.type==ActivationCriterion.Type.SENSOR
 getSensorNames = lambda configuration, owner: [s.name for s in configuration.sensors]
-ActivationCriterion.PROPERTY_DEFINITIONS.addProperty('sensorName', isMandatory=isOfSensorType, type=str, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE, namesInXML='sensor', values=getSensorNames)
+ActivationCriterion.PROPERTY_DEFINITIONS.addProperty('sensorName', isMandatory=isOfSensorType, type=str, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE, namesInXML='sensor', values=getSensorNames, valuesKey=lambda configuration, owner: None)
 ActivationCriterion.PROPERTY_DEFINITIONS.addProperty('whenTriggered', isMandatory=isOfSensorType, type=bool, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE)
 ActivationCriterion.PROPERTY_DEFINITIONS.addProperty('children', isMandatory=lambda context: context.object.type in (ActivationCriterion.Type.AND, ActivationCriterion.Type.OR), type=ActivationCriterion, xmlEntityType=Property.XMLEntityTypes.CHILD_ELEMENT, namesInXML='activationCriterion', isCollection=True)
 
@@ -658,7 +921,9 @@ class Sensor(object):
     # Generic mandatory properties of various types.
     PROPERTY_DEFINITIONS.addProperty('name', isMandatory=True, type=str, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE, isUnique=True)
     getClassNamesExceptRoot = lambda configuration, owner: [c.name for c in configuration.classes if (not c.isRootType() or owner.name in Sensor.Type.getAll()) and c != owner and not configuration.doesSensorInherit(c, owner)]
-    PROPERTY_DEFINITIONS.addProperty('type', isMandatory=lambda context: not context.object.isRootType(), type=str, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE, values=getClassNamesExceptRoot)
+    # Those names are the same for all sensors that are neither built-in nor inherited.
+    getClassNamesKey = lambda configuration, owner: owner if owner.isClass or owner.name in Sensor.Type.getAll() or configuration.isInheritedFrom(owner.name) else None
+    PROPERTY_DEFINITIONS.addProperty('type', isMandatory=lambda context: not context.object.isRootType(), type=str, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE, values=getClassNamesExceptRoot, valuesKey=getClassNamesKey)
     PROPERTY_DEFINITIONS.addProperty('isClass', isMandatory=True, type=bool, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE)
     isNotClass = lambda context: not context.object.isClass
     PROPERTY_DEFINITIONS.addProperty('alertName', isMandatory=isNotClass, type=str, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE, namesInXML='alert')
@@ -734,7 +999,9 @@ class Action(object):
         Action.PROPERTY_DEFINITIONS.readObjectFromXML(e, xmlElement)
 
         # Store the input XML to be able to send it to linknx when executing the
-        # action.
+        # action. Actions are rendered from DOM elements.
+        if ElementTree.iselement(xmlElement):
+            xmlElement = xml.dom.minidom.parseString(Configuration.renderXml(xmlElement)).documentElement
         e.linknxActionXml = xmlElement
         return e
 
@@ -774,8 +1041,10 @@ class Event(object):
         return 'Event "{type}"'.format(**vars(self))
 
 Event.PROPERTY_DEFINITIONS = PropertyCollection()
-Event.PROPERTY_DEFINITIONS.addProperty('type', isMandatory=True, type=str, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE, values=lambda configuration, owner:type(owner).Type.getAll(), isUnique=True)
+Event.PROPERTY_DEFINITIONS.addProperty('type', isMandatory=True, type=str, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE, values=lambda configuration, owner:type(owner).Type.getAll(), isUnique=True, valuesKey=lambda configuration, owner: type(owner))
 Event.PROPERTY_DEFINITIONS.addProperty('actions', isMandatory=True, type=Action, xmlEntityType=Property.XMLEntityTypes.CHILD_ELEMENT, namesInXML='action', isCollection=True)
+Event.PROPERTY_DEFINITIONS.addProperty('isSynchronous', isMandatory=False, type=bool, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE, namesInXML='synchronous')
+Event.PROPERTY_DEFINITIONS.addProperty('coalescingDelay', isMandatory=False, type=float, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE) # Duration during which subsequent firings are merged into the first one, in seconds.
 
 class ModeEvent(Event):
     class Type:
@@ -791,7 +1060,7 @@ class Mode(object):
     PROPERTY_DEFINITIONS = PropertyCollection()
     PROPERTY_DEFINITIONS.addProperty('name', isMandatory=True, type=str, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE, isUnique=True)
     PROPERTY_DEFINITIONS.addProperty('value', isMandatory=True, type=int, xmlEntityType=Property.XMLEntityTypes.ATTRIBUTE, isUnique=True)
-    PROPERTY_DEFINITIONS.addProperty('sensorNames', isMandatory=False, type=str, xmlEntityType=Property.XMLEntityTypes.CHILD_ELEMENT, namesInXML='sensor', isCollection=True, values=lambda configuration, object: [s.name for s in configuration.sensors])
+    PROPERTY_DEFINITIONS.addProperty('sensorNames', isMandatory=False, type=str, xmlEntityType=Property.XMLEntityTypes.CHILD_ELEMENT, namesInXML='sensor', isCollection=True, values=lambda configuration, object: [s.name for s in configuration.sensors], valuesKey=lambda configuration, object: None)
     PROPERTY_DEFINITIONS.addProperty('events', isMandatory=False, type=ModeEvent, xmlEntityType=Property.XMLEntityTypes.CHILD_ELEMENT, namesInXML='event', isCollection=True)
 
     def __init__(self, name, value):
@@ -905,6 +1174,7 @@ class Configuration(object):
             self._problematicObject = None
             self.xmlContext = None
             self.problematicObject = problematicObject
+            self.violations = [self] # All problems found by the integrity check that raised this exception, this one first.
 
         @property
         def problematicObject(self):
@@ -926,6 +1196,109 @@ class Configuration(object):
                 s += '\nCaused by {0}'.format(self.cause)
             return s
 
+    class IntegrityChecker(object):
+        """
+        State of an integrity check of the configuration.
+
+        Acceptable values of properties are computed once per check and stored as sets. Problems are collected rather than raised, so that a single check reports all of them.
+        """
+        def __init__(self, configuration):
+            self.configuration = configuration
+            self.violations = [] # IntegrityExceptions, in the order they have been found.
+            self._acceptableValues = {} # Frozensets indexed by (property, key).
+
+        def getAcceptableValues(self, property, owner):
+            """ Returns the set of the acceptable values of a property of an object, or None if there is no restriction. """
+            if property.values == None: return None
+            if not callable(property.values):
+                key = (property, None)
+            elif property.valuesKey != None:
+                key = (property, property.valuesKey(self.configuration, owner))
+            else:
+                return frozenset(property.values(self.configuration, owner))
+
+            acceptableValues = self._acceptableValues.get(key)
+            if acceptableValues == None:
+                acceptableValues = frozenset(property.getAcceptablesValues(self.configuration, owner))
+                self._acceptableValues[key] = acceptableValues
+            return acceptableValues
+
+        def raiseViolations(self):
+            """ Raises the first problem found, if any. It lists all of them in its violations member. """
+            if not self.violations: return
+            exception = self.violations[0]
+            exception.violations = self.violations
+            raise exception
+
+    class _SensorList(list):
+        """ List of the sensors and classes of a configuration, that invalidates the index of the configuration whenever it is modified. """
+        def __init__(self, configuration, items=()):
+            list.__init__(self, items)
+            self._configuration = configuration
+
+        def append(self, item): self._configuration.invalidateSensorIndex(); list.append(self, item)
+        def extend(self, items): self._configuration.invalidateSensorIndex(); list.extend(self, items)
+        def insert(self, index, item): self._configuration.invalidateSensorIndex(); list.insert(self, index, item)
+        def remove(self, item): self._configuration.invalidateSensorIndex(); list.remove(self, item)
+        def pop(self, *args): self._configuration.invalidateSensorIndex(); return list.pop(self, *args)
+        def clear(self): self._configuration.invalidateSensorIndex(); list.clear(self)
+        def sort(self, **kwargs): self._configuration.invalidateSensorIndex(); list.sort(self, **kwargs)
+        def reverse(self): self._configuration.invalidateSensorIndex(); list.reverse(self)
+        def __setitem__(self, index, item): self._configuration.invalidateSensorIndex(); list.__setitem__(self, index, item)
+        def __delitem__(self, index): self._configuration.invalidateSensorIndex(); list.__delitem__(self, index)
+        def __iadd__(self, items): self._configuration.invalidateSensorIndex(); return list.__iadd__(self, items)
+        def __imul__(self, count): self._configuration.invalidateSensorIndex(); return list.__imul__(self, count)
+
+    class _SensorIndex(object):
+        """ Sensors and classes of a configuration indexed by name, along with the inheritance chains computed so far. """
+        def __init__(self, sensorsAndClasses):
+            self.byName = {}
+            self.homonyms = {} # Lists of the objects that share a name, indexed by that name.
+            for o in sensorsAndClasses:
+                if o.name in self.byName:
+                    self.homonyms.setdefault(o.name, [self.byName[o.name]]).append(o)
+                else:
+                    self.byName[o.name] = o
+            self.sensors = [o for o in sensorsAndClasses if not o.isClass]
+            self.classes = [o for o in sensorsAndClasses if o.isClass]
+            self._ancestorNamesByClassName = {}
+            self._inheritedNames = None
+
+        def getInheritedNames(self):
+            """ Returns the set of the names classes inherit from, directly or not. """
+            if self._inheritedNames == None:
+                self._inheritedNames = frozenset(name for c in self.classes if not c.isRootType() for name in self.getAncestorNames(c.type))
+            return self._inheritedNames
+
+        def getByName(self, name):
+            if name in self.homonyms:
+                raise Configuration.IntegrityException('Those sensors are homonymous: {0}'.format(self.homonyms[name]))
+            return self.byName.get(name)
+
+        def getAncestorNames(self, className):
+            """
+            Returns the name of a class followed by the names of the classes it inherits from, up to the root class.
+
+            The chain ends with the first name that does not match any class or sensor. It is also cut where it loops on itself.
+            """
+            ancestorNames = self._ancestorNamesByClassName.get(className)
+            if ancestorNames == None:
+                names = []
+                visitedNames = set()
+                name = className
+                while name != None and not name in visitedNames:
+                    knownAncestorNames = self._ancestorNamesByClassName.get(name)
+                    if knownAncestorNames != None:
+                        names.extend(knownAncestorNames)
+                        break
+                    names.append(name)
+                    visitedNames.add(name)
+                    c = self.getByName(name)
+                    name = None if c == None or c.isRootType() else c.type
+                ancestorNames = tuple(names)
+                self._ancestorNamesByClassName[className] = ancestorNames
+            return ancestorNames
+
     PROPERTY_DEFINITIONS = PropertyCollection()
     PROPERTY_DEFINITIONS.addProperty('modesRepository', isMandatory=True, type=ModesRepository, xmlEntityType=Property.XMLEntityTypes.CHILD_ELEMENT, namesInXML='modes')
     PROPERTY_DEFINITIONS.addProperty('alerts', isMandatory=True, type=AlertsRepository, xmlEntityType=Property.XMLEntityTypes.CHILD_ELEMENT)
@@ -948,8 +1321,16 @@ class Configuration(object):
         booleanClass.triggerValue = True
         floatClass = Sensor(Sensor.Type.ROOT, Sensor.Type.FLOAT, True)
         floatClass.isClass = True
+        self._sensorIndex = None
         self.sensorsAndClasses = [rootClass, booleanClass, floatClass]
 
+    def __setattr__(self, name, value):
+        # Lists of sensors are wrapped so that their modifications are noticed.
+        if name == 'sensorsAndClasses':
+            value = Configuration._SensorList(self, value)
+            self.invalidateSensorIndex()
+        object.__setattr__(self, name, value)
+
     @staticmethod
     def parseFile(filename):
         # xsdFilename = os.path.join(os.path.dirname(__file__), 'config.xsd')
@@ -964,17 +1345,45 @@ class Configuration(object):
                 # errIx += 1
                 # logger.reportError('#{ix}@{line}:{col} {message}'.format(ix=errIx, line=err.line, col=err.column, message=err.message))
             # raise
-        doc = xml.dom.minidom.parse(filename)
-        return Configuration.parse(doc)
+        with open(filename, 'rb') as xmlFile:
+            return Configuration.parse(Configuration.parseXml(xmlFile, XmlDocument(filename)))
 
     @staticmethod
     def parseString(string):
-        doc = xml.dom.minidom.parseString(string)
-        return Configuration.parse(doc)
+        return Configuration.parse(Configuration.parseXml(string, XmlDocument('<string>', string)))
+
+    @staticmethod
+    def parseXml(source, document):
+        """
+        Builds the ElementTree of an XML document. Its elements know their XmlSource, so that objects read from them can report it lazily.
+
+        source -- XML string or binary file object to parse.
+        """
+        elementClass = type('_LocatedElement', (_LocatedElement,), {'__slots__' : (), 'document' : document})
+        builder = ElementTree.TreeBuilder(element_factory=elementClass)
+        parser = xml.parsers.expat.ParserCreate()
+        parser.buffer_text = True
+        def startElement(tag, attributes):
+            builder.start(tag, attributes).startIndex = parser.CurrentByteIndex
+        def endElement(tag):
+            builder.end(tag).endIndex = parser.CurrentByteIndex
+        def declareXml(version, encoding, standalone):
+            if document.encoding == None: document.encoding = encoding
+        parser.StartElementHandler = startElement
+        parser.EndElementHandler = endElement
+        parser.CharacterDataHandler = builder.data
+        parser.XmlDeclHandler = declareXml
+        if isinstance(source, (str, bytes)):
+            parser.Parse(source, True)
+        else:
+            parser.ParseFile(source)
+        return builder.close()
 
     @staticmethod
-    def parse(xmlDocument):
-        config = xmlDocument.getElementsByTagName('config')[0]
+    def parse(xmlRoot):
+        """ Builds the configuration described by an ElementTree element that is or contains the <config> element. """
+        config = next(xmlRoot.iter('config'), None)
+        if config == None: raise Configuration.IntegrityException('No <config> element found.')
 
         configuration = Configuration()
 
@@ -1046,18 +1455,42 @@ class Configuration(object):
     @staticmethod
     def getXmlAttribute(xmlElement, attributeName, defaultValue=None, mustBeDefined=False):
         """
-        Returns the value of the given element's attribute or None if element does not have such attribute.
-
-        Unlike the getAttribute method on Element, this method does not return an empty string but None whenever attribute does not exist.
+        Returns the value of the given ElementTree element's attribute or defaultValue if element does not have such attribute.
         """
-        if(xmlElement.hasAttribute(attributeName)):
-            return xmlElement.getAttribute(attributeName)
+        value = xmlElement.get(attributeName)
+        if value != None:
+            return value
         else:
             if mustBeDefined:
-                raise Configuration.IntegrityException('Element {0} misses attribute {1}'.format(xmlElement.tagName, attributeName), xmlContext=xmlElement.toxml() )
+                raise Configuration.IntegrityException('Element {0} misses attribute {1}'.format(xmlElement.tag, attributeName), xmlContext=Configuration.renderXml(xmlElement))
             else:
                 return defaultValue
 
+    @staticmethod
+    def indexChildElements(xmlElement):
+        """ Returns the child elements of an ElementTree element in a dictionary that indexes lists of them by tag. """
+        childrenByTag = {}
+        for child in xmlElement:
+            children = childrenByTag.get(child.tag)
+            if children == None:
+                childrenByTag[child.tag] = [child]
+            else:
+                children.append(child)
+        return childrenByTag
+
+    @staticmethod
+    def renderXml(xmlElement):
+        """ Serializes an ElementTree element, without the text that follows it in its parent. """
+        if xmlElement.tail:
+            xmlElement = copy.copy(xmlElement)
+            xmlElement.tail = None
+        return ElementTree.tostring(xmlElement, encoding='unicode')
+
+    @staticmethod
+    def convertDOMElement(domElement):
+        """ Returns the ElementTree equivalent of a DOM element. """
+        return ElementTree.fromstring(domElement.toxml())
+
     @staticmethod
     def getElementsInConfig(config, sectionName, groupName):
         if not groupName is None:
@@ -1073,28 +1506,42 @@ class Configuration(object):
 
     @staticmethod
     def getTextInElement(elt, mustFind = True):
-        text = None
-        for node in elt.childNodes:
-            if node.nodeType == node.TEXT_NODE:
-                if not text:
-                    text = ''
-                text += node.data
+        """ Returns the text directly contained in an ElementTree element, i.e not the text of its children, or None if it has no text. """
+        texts = [elt.text] if elt.text else []
+        texts += [child.tail for child in elt if child.tail]
+        text = ''.join(texts) if texts else None
 
         if mustFind and not text:
-            raise Exception('Missing text in element {0}'.format(elt.nodeName))
+            raise Exception('Missing text in element {0}'.format(elt.tag))
         return text
 
+    def _getSensorIndex(self):
+        """ Returns the index of sensorsAndClasses, built on first use since the last invalidation. """
+        # The list may also have been replaced without going through
+        # __setattr__, e.g. by property readers that work on vars().
+        if not isinstance(self.sensorsAndClasses, Configuration._SensorList): self.sensorsAndClasses = self.sensorsAndClasses
+        if self._sensorIndex == None:
+            self._sensorIndex = Configuration._SensorIndex(self.sensorsAndClasses)
+        return self._sensorIndex
+
+    def invalidateSensorIndex(self):
+        """ Must be called after one of the items of sensorsAndClasses is renamed or retyped. Modifications of the list itself are noticed automatically. """
+        self._sensorIndex = None
+
+    def _getAncestorNames(self, sensorOrClass):
+        """ Returns the names of the classes a sensor or class inherits from, from its base class to the root class. """
+        if sensorOrClass.isRootType(): return ()
+        return self._getSensorIndex().getAncestorNames(sensorOrClass.type)
+
     def getClassesInheritedBySensor(self, sensor, includesBuiltIns=False):
         s = sensor if type(sensor) == Sensor else self._getSensorOrClassByName(sensor)
-        if s.isRootType():
-            return []
-        else:
-            inheritedClasses = self.getClassesInheritedBySensor(s.type, includesBuiltIns)
-            baseClass = self.getClassByName(s.type)
-            if baseClass.isBuiltIn and not includesBuiltIns:
-                return inheritedClasses
-            else:
-                return [baseClass] + inheritedClasses
+        inheritedClasses = []
+        for className in self._getAncestorNames(s):
+            baseClass = self.getClassByName(className)
+            if baseClass == None: break
+            if includesBuiltIns or not baseClass.isBuiltIn:
+                inheritedClasses.append(baseClass)
+        return inheritedClasses
 
     def doesSensorInherit(self, sensor, classs):
         if isinstance(sensor, Sensor):
@@ -1109,30 +1556,35 @@ class Configuration(object):
         else:
             className = classs
 
-        if s.isRootType():
-            return False
-        elif s.type == className:
-            return True
-        else:
-            return self.doesSensorInherit(s.type, className)
+        return className in self._getAncestorNames(s)
+
+    def isInheritedFrom(self, name):
+        """ Tells whether at least one class inherits from the sensor or class of the given name. """
+        return name in self._getSensorIndex().getInheritedNames()
 
     def checkIntegrity(self):
         """
         Checks that the configuration described by this object is full of integrity.
 
-        An exception is raised if a problem is detected. Otherwise, it is safe to assume that configuration is well defined.
+        An exception is raised if a problem is detected. Otherwise, it is safe to assume that configuration is well defined. If several problems are detected, the exception is the first one and lists all of them in its violations member.
         """
         Configuration.PROPERTY_DEFINITIONS.checkIntegrity(self, self)
 
+    def getIntegrityViolations(self):
+        """ Checks the integrity of the configuration and returns the list of the problems detected, as IntegrityExceptions. """
+        checker = Configuration.IntegrityChecker(self)
+        Configuration.PROPERTY_DEFINITIONS.checkIntegrity(self, self, checker=checker)
+        return checker.violations
+
     @property
     def sensors(self):
         if not self.sensorsAndClasses: return []
-        return [s for s in self.sensorsAndClasses if not s.isClass]
+        return list(self._getSensorIndex().sensors)
 
     @property
     def classes(self):
         if not self.sensorsAndClasses: return []
-        return [s for s in self.sensorsAndClasses if s.isClass]
+        return list(self._getSensorIndex().classes)
 
     @property
     def sensorsAndClassesWithoutBuiltIns(self):
@@ -1146,10 +1598,11 @@ class Configuration(object):
         # homewatcher). This should not crash.
         if sensorOrClass == None: return None
 
-        if not sensorOrClass.isBuiltIn:
-            return self.getBuiltInRootClass(self.getClassByName(sensorOrClass.type))
-        else:
-            return sensorOrClass
+        if sensorOrClass.isBuiltIn: return sensorOrClass
+        for className in self._getAncestorNames(sensorOrClass):
+            baseClass = self.getClassByName(className)
+            if baseClass == None or baseClass.isBuiltIn: return baseClass
+        return None
 
     def getModeByName(self, modeName):
         modes = [m for m in self.modesRepository.modes if m.name == modeName]
@@ -1158,13 +1611,34 @@ class Configuration(object):
         else:
             raise Exception('No mode {0}.'.format(modeName))
 
+    def getReferencedObjectIds(self):
+        """ Returns the set of identifiers of the linknx objects that are referenced by modes, alerts and sensors. Sensors are expected to be resolved. """
+        objectIds = {self.modesRepository.objectId}
+        for alert in self.alerts:
+            objectIds.update((alert.persistenceObjectId, alert.inhibitionObjectId))
+        for sensor in self.sensors:
+            objectIds.update((sensor.enabledObjectId, sensor.watchedObjectId, sensor.persistenceObjectId))
+        objectIds.discard(None)
+        return objectIds
+
+    def getNotifiedObjectIds(self):
+        """ Returns the set of identifiers of the linknx objects whose changes are notified to the daemon, i.e those hwconf installs a callback for. Sensors are expected to be resolved. """
+        objectIds = {self.modesRepository.objectId}
+        for alert in self.alerts:
+            objectIds.update((alert.persistenceObjectId, alert.inhibitionObjectId))
+        for sensor in self.sensors:
+            objectIds.update((sensor.enabledObjectId, sensor.watchedObjectId, sensor.persistenceObjectId))
+        objectIds.discard(None)
+        return objectIds
+
     def resolve(self, checkIntegrityWhenDone=True):
         resolvedSensors = []
+        templates = {} # Members of the classes merged with those of their ancestors, indexed by class name.
         for sensor in self.sensorsAndClasses:
             if sensor.isClass:
                 resolvedSensors.append(sensor)
             else:
-                resolvedSensors.append(self._getResolvedSensor(sensor))
+                resolvedSensors.append(self._getResolvedSensor(sensor, templates))
 
         self.sensorsAndClasses = resolvedSensors
 
@@ -1172,39 +1646,17 @@ class Configuration(object):
         # did not lead to weird results.
         if checkIntegrityWhenDone: self.checkIntegrity()
 
-    def _getResolvedSensor(self, sensor):
+    def _getResolvedSensor(self, sensor, templates=None):
         if sensor.isClass: raise Exception('Sensor classes cannot be resolved.')
         resolvedCopy = Sensor(sensor.type, sensor.name, sensor.isBuiltIn)
-        currentClass = sensor
         resolvedCopyVars = vars(resolvedCopy)
 
-        # Recursively assign members from the whole ancestor branch.
-        primitiveTypes = (type(None), str, int, float, bool)
-        customTypes = (ModeDependentValue, ActivationCriterion)
-        while currentClass != None:
-            for k, v in vars(currentClass).items():
-                if k == '_attributes':
-                    newAttributes = v.copy()
-                    newAttributes.update(resolvedCopy._attributes)
-                    resolvedCopy._attributes = newAttributes
-                    continue
-
-                doesMemberExist = not(currentClass == sensor or not k in resolvedCopyVars or resolvedCopyVars[k] is None)
-                if isinstance(v, primitiveTypes):
-                    if not doesMemberExist:
-                        resolvedCopyVars[k] = v
-                elif isinstance(v, customTypes):
-                    if not doesMemberExist:
-                        resolvedCopyVars[k] = v.copy()
-                    else:
-                        resolvedCopyVars[k].inherit(v)
-                else:
-                    raise Exception('Unsupported member {0}={1}, type={2}'.format(k, v, type(v)))
-
-            if not currentClass.isRootType():
-                currentClass = self.getClassByName(currentClass.type)
-            else:
-                currentClass = None
+        # Take the members of the sensor, then complete them with those of its
+        # class, which already include those of the whole ancestor branch.
+        Configuration._mergeMembers(resolvedCopyVars, vars(sensor), isInherited=False)
+        if not sensor.isRootType():
+            template = self._getClassTemplate(sensor.type, {} if templates == None else templates)
+            if template != None: Configuration._mergeMembers(resolvedCopyVars, template, isInherited=True)
 
         # # Replace the base class by the first class that still exists in the
         # # resolved configuration: this is the first builtin class. In case
@@ -1218,6 +1670,57 @@ class Configuration(object):
         self.resolveObject(resolvedCopy, {})
         return resolvedCopy
 
+    def _getClassTemplate(self, className, templates):
+        """
+        Returns the members of a class merged with those of the classes it inherits from, or None if there is no such class.
+
+        Templates are memoized in the templates dictionary. Those of the ancestors that are missing are computed first, from the root down, so that each class is flattened only once.
+        """
+        pendingClasses = []
+        template = None
+        for name in self._getSensorIndex().getAncestorNames(className):
+            template = templates.get(name)
+            if template != None: break
+            c = self.getClassByName(name)
+            if c == None: break
+            pendingClasses.append(c)
+
+        for c in reversed(pendingClasses):
+            members = {}
+            Configuration._mergeMembers(members, vars(c), isInherited=False)
+            if template != None: Configuration._mergeMembers(members, template, isInherited=True)
+            templates[c.name] = template = members
+        return templates.get(className)
+
+    @staticmethod
+    def _mergeMembers(members, sourceMembers, isInherited):
+        """
+        Merges the members of a sensor or class into those of the sensor being resolved, both given as dictionaries.
+
+        isInherited -- False if sourceMembers belong to the sensor itself, in which case they replace the current members. True if they are inherited: they only define the members that are not defined yet and complete mode-dependent values.
+        """
+        # Sources are immutable, hence shared like primitive values.
+        primitiveTypes = (type(None), str, int, float, bool, XmlSource)
+        customTypes = (ModeDependentValue, ActivationCriterion)
+        for k, v in sourceMembers.items():
+            if k == '_attributes':
+                newAttributes = v.copy()
+                newAttributes.update(members.get(k, {}))
+                members[k] = newAttributes
+                continue
+
+            doesMemberExist = isInherited and members.get(k) is not None
+            if isinstance(v, primitiveTypes):
+                if not doesMemberExist:
+                    members[k] = v
+            elif isinstance(v, customTypes):
+                if not doesMemberExist:
+                    members[k] = v.copy()
+                else:
+                    members[k].inherit(v)
+            else:
+                raise Exception('Unsupported member {0}={1}, type={2}'.format(k, v, type(v)))
+
     def getClassByName(self, name):
         c = self._getSensorOrClassByName(name)
         if c == None or not c.isClass: return None
@@ -1233,13 +1736,7 @@ class Configuration(object):
         # passed, this query must return None even if the configuration is
         # badly defined.
         if name == None: return None
-        byNames = [o for o in self.sensorsAndClasses if o.name == name]
-        if len(byNames) == 0:
-            return None
-        elif len(byNames) > 1:
-            raise Configuration.IntegrityException('Those sensors are homonymous: {0}'.format(byNames))
-        else:
-            return byNames[0]
+        return self._getSensorIndex().getByName(name)
 
     @staticmethod
     def resolveObject(obj, attributes):
@@ -67,7 +67,8 @@ class Configurator(pyknx.configurator.Configurator):
         else:
             return super().callbackAttributeName
 
-    def addCallbackForObject(self, objectId, callbackName, callbackDestination):
+    def addCallbackForObject(self, objectId, callbackName, callbackDestination, isOverriding=True):
+        """ Installs a callback for an object. If isOverriding is False, the callback is not installed for objects that already have one. """
         if objectId == None or objectId == '':
             logger.reportWarning('{0} is not defined, skipping callback.'.format(callbackDestination))
             return
@@ -81,6 +82,7 @@ class Configurator(pyknx.configurator.Configurator):
                 if found:
                     raise Exception('Two objects with id {id} found.'.format(id=objectId))
                 found = True
+                if not isOverriding and objectXmlConfig.hasAttribute(callbackAttributeName): continue
                 objectXmlConfig.setAttribute(callbackAttributeName, callbackName)
                 logger.reportInfo('Added callback {0} for {1}'.format(callbackName, objectId))
         if not found:
@@ -107,4 +109,11 @@ class Configurator(pyknx.configurator.Configurator):
         # Add callbacks for modes.
         self.addCallbackForObject(self._homewatcherConfig.modesRepository.objectId, 'onModeObjectChanged', 'Mode object')
 
+        # Keep the daemon's object cache up to date for the other objects of
+        # sensors. Objects that already have a callback are left as is, since
+        # every callback updates the cache.
+        for sensor in self._homewatcherConfig.sensors:
+            if sensor.enabledObjectId != None: self.addCallbackForObject(sensor.enabledObjectId, 'onCachedObjectChanged', 'Enabled object for {0}'.format(sensor), isOverriding=False)
+            if sensor.persistenceObjectId != None: self.addCallbackForObject(sensor.persistenceObjectId, 'onCachedObjectChanged', 'Persistence for {0}'.format(sensor), isOverriding=False)
+
         pyknx.configurator.Configurator.generateConfig(self)
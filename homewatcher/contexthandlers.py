@@ -26,13 +26,39 @@ from pyknx import logger
 
 class ContextHandler(object):
     __contextHandlerName__ = None
+    isMemoizable = True # Whether the result only depends on the parameters of the handler and on the state of the context. Handlers that depend on anything else (such as time) should set it to False.
 
     def __init__(self, xmlConfig):
         self.xmlConfig = xmlConfig
+        self.parameters = tuple(sorted(xmlConfig.attributes.items())) # Hashable summary of the XML attributes of the handler.
 
     def analyzeContext(self, context):
         pass
 
+class RenderContext(object):
+    """
+    Memoizes the results of context handlers while the state they analyze is known not to change.
+
+    Results are indexed by handler type, handler parameters and context object, so that several strings that use the same placeholders in the same context analyze it only once. A render context must not outlive the state it memoizes: a new one is made for each firing of events.
+    """
+    def __init__(self):
+        self._results = {}
+        self.hitCount = 0
+        self.missCount = 0
+
+    def analyze(self, handler, context):
+        if not handler.isMemoizable: return handler.analyzeContext(context)
+
+        key = (type(handler), handler.parameters, context)
+        result = self._results.get(key)
+        if result == None:
+            result = handler.analyzeContext(context)
+            self._results[key] = result
+            self.missCount += 1
+        else:
+            self.hitCount += 1
+        return result
+
 class ContextHandlerFactory(object):
     _INSTANCE = None
 
@@ -54,3 +80,34 @@ class ContextHandlerFactory(object):
            raise Exception('No context handler named {0} is registered.'.format(handlerName)) 
         handler = self._handlerDefinitions[handlerName](handlerXMLConfig)
         return handler
+
+class ParameterizableString(object):
+    """
+    Parameterizable string of the configuration, compiled into a sequence of literal chunks and context handlers.
+
+    Handlers are instanciated once, when the string is compiled. Rendering the string in a given context only has to analyze that context with each handler.
+    """
+    def __init__(self, parameterizedStringXml):
+        self._chunks = [] # Literal strings and context handlers, in order of appearance.
+        for childNode in parameterizedStringXml.childNodes:
+            if childNode.nodeType == childNode.ELEMENT_NODE:
+                tagName = childNode.tagName
+                if tagName == 'br':
+                    self._appendLiteral('\n')
+                elif tagName == 'context':
+                    self._chunks.append(ContextHandlerFactory.getInstance().makeHandler(childNode))
+            elif childNode.nodeType == childNode.TEXT_NODE:
+                self._appendLiteral(childNode.data)
+
+    def _appendLiteral(self, text):
+        if self._chunks and isinstance(self._chunks[-1], str):
+            self._chunks[-1] += text
+        else:
+            self._chunks.append(text)
+
+    def render(self, context, renderContext=None):
+        """ Renders the string. Handler results are memoized in renderContext, if specified. """
+        if renderContext == None:
+            return ''.join([chunk if isinstance(chunk, str) else chunk.analyzeContext(context) for chunk in self._chunks])
+        else:
+            return ''.join([chunk if isinstance(chunk, str) else renderContext.analyze(chunk, context) for chunk in self._chunks])
@@ -0,0 +1,157 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2014-2017 Cyrille Defranoux
+#
+# This file is part of Homewatcher.
+#
+# Homewatcher is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Homewatcher is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Homewatcher. If not, see <http://www.gnu.org/licenses/>.
+#
+# For any question, feature requests or bug reports, feel free to contact me at:
+# knx at aminate dot net
+
+from homewatcher import ensurepyknx
+
+from pyknx import logger
+import collections
+import threading
+import time
+
+class ActionExecutor(object):
+    """
+    Executes jobs on a pool of worker threads.
+
+    Jobs are submitted to named queues. Jobs of a same queue are executed one at a time, in submission order, whereas jobs of distinct queues may run concurrently. The total number of pending jobs is bounded: submitting a job when the limit is reached blocks until a worker has made room for it.
+    """
+    class Job(object):
+        def __init__(self, function, description):
+            self.function = function
+            self.description = description
+            self.submitTime = time.monotonic()
+            self.exception = None
+            self._isDone = threading.Event()
+
+        def run(self):
+            try:
+                self.function()
+            except Exception as e:
+                self.exception = e
+                logger.reportException('Action "{0}" failed.'.format(self.description))
+            finally:
+                self._isDone.set()
+
+        def wait(self):
+            """ Waits for the job to be executed. Raises the exception the job may have raised. """
+            self._isDone.wait()
+            if self.exception is not None: raise self.exception
+
+        def __repr__(self):
+            return self.description
+
+    def __init__(self, workerCount=4, maxPendingJobCount=1000):
+        self.workerCount = workerCount
+        self.maxPendingJobCount = maxPendingJobCount
+        self._condition = threading.Condition(threading.Lock())
+        self._pendingJobsByQueue = {} # Pending jobs of each queue, in submission order. Only queues with pending jobs are present.
+        self._readyQueueNames = collections.deque() # Queues that have pending jobs and no running job.
+        self._workers = []
+        self._isStopped = False
+        self.pendingJobCount = 0 # Jobs submitted but not terminated yet.
+
+        # Statistics.
+        self.peakPendingJobCount = 0
+        self.executedJobCount = 0
+        self.failedJobCount = 0
+        self.totalLatency = 0.0 # Sum of the durations jobs waited before being started.
+        self.maxLatency = 0.0
+
+    @property
+    def averageLatency(self):
+        return self.totalLatency / self.executedJobCount if self.executedJobCount else 0.0
+
+    def submit(self, queueName, function, description):
+        """ Queues function for execution after the jobs previously submitted to the same queue. Returns the job, which can be waited for. """
+        job = ActionExecutor.Job(function, description)
+        with self._condition:
+            if self._isStopped:
+                # Late jobs (during termination for instance) are executed
+                # immediately rather than lost.
+                isExecutedNow = True
+            else:
+                isExecutedNow = False
+                if self.pendingJobCount >= self.maxPendingJobCount:
+                    logger.reportWarning('Action queue is full ({0} pending jobs), waiting for room to execute "{1}".'.format(self.pendingJobCount, description))
+                    while self.pendingJobCount >= self.maxPendingJobCount and not self._isStopped:
+                        self._condition.wait()
+
+                self._ensureWorkersStarted()
+                jobs = self._pendingJobsByQueue.get(queueName)
+                if jobs is None:
+                    jobs = collections.deque()
+                    self._pendingJobsByQueue[queueName] = jobs
+                    self._readyQueueNames.append(queueName)
+                jobs.append(job)
+                self.pendingJobCount += 1
+                self.peakPendingJobCount = max(self.peakPendingJobCount, self.pendingJobCount)
+                self._condition.notify_all()
+
+        if isExecutedNow: job.run()
+        return job
+
+    def stop(self, timeout=None):
+        """ Waits for pending jobs to be executed, at most timeout seconds, then stops workers. """
+        with self._condition:
+            self._condition.wait_for(lambda: self.pendingJobCount == 0, timeout)
+            if self.pendingJobCount:
+                logger.reportWarning('{0} actions have not been executed before termination.'.format(self.pendingJobCount))
+            self._isStopped = True
+            self._condition.notify_all()
+
+    def _ensureWorkersStarted(self):
+        while len(self._workers) < self.workerCount:
+            worker = threading.Thread(target=self._run, name='Action worker #{0}'.format(len(self._workers)))
+            worker.daemon = True
+            self._workers.append(worker)
+            worker.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._readyQueueNames and not self._isStopped:
+                    self._condition.wait()
+                if not self._readyQueueNames: return
+
+                # The queue is not ready anymore until its job is done, so that
+                # its jobs never run concurrently.
+                queueName = self._readyQueueNames.popleft()
+                job = self._pendingJobsByQueue[queueName][0]
+
+            latency = time.monotonic() - job.submitTime
+            job.run()
+
+            with self._condition:
+                jobs = self._pendingJobsByQueue[queueName]
+                jobs.popleft()
+                if jobs:
+                    self._readyQueueNames.append(queueName)
+                else:
+                    del self._pendingJobsByQueue[queueName]
+                self.pendingJobCount -= 1
+                self.executedJobCount += 1
+                if job.exception is not None: self.failedJobCount += 1
+                self.totalLatency += latency
+                self.maxLatency = max(self.maxLatency, latency)
+                self._condition.notify_all()
+
+    def __repr__(self):
+        return 'Action executor ({0} pending, peak {1}, {2} executed, {3} failed, latency avg={4:.1f}ms max={5:.1f}ms)'.format(self.pendingJobCount, self.peakPendingJobCount, self.executedJobCount, self.failedJobCount, self.averageLatency * 1e3, self.maxLatency * 1e3)
@@ -54,8 +54,9 @@ def endUserScript(context):
 
 def onModeObjectChanged(context):
     global alarmDaemon
-    logger.reportDebug('Alarm mode changed to ' + str(context.object.value))
-    alarmDaemon.onModeValueChanged(context.object.value)
+    value = context.object.value
+    logger.reportDebug('Alarm mode changed to ' + str(value))
+    alarmDaemon.onModeValueChanged(value)
 
 def onWatchedObjectChanged(context):
     global alarmDaemon
@@ -73,6 +74,14 @@ def onAlertInhibited(context):
     global alarmDaemon
     alarmDaemon.onAlertInhibited(context.objectId)
 
+def onAlertInhibitionObjectChanged(context):
+    # This is the callback name installed by the configurator.
+    onAlertInhibited(context)
+
+def onCachedObjectChanged(context):
+    global alarmDaemon
+    alarmDaemon.onCachedObjectChanged(context.objectId, context.object.value)
+
 def onTemperatureChanged(context):
     global alarmDaemon
     sensor = alarmDaemon.findSensorByTemperatureObjectId(context.objectId)
@@ -0,0 +1,220 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2014-2017 Cyrille Defranoux
+#
+# This file is part of Homewatcher.
+#
+# Homewatcher is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Homewatcher is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Homewatcher. If not, see <http://www.gnu.org/licenses/>.
+#
+# For any question, feature requests or bug reports, feel free to contact me at:
+# knx at aminate dot net
+
+from homewatcher import ensurepyknx
+
+from pyknx import logger
+from email.mime.text import MIMEText
+from email.header import Header
+from email.utils import COMMASPACE, formatdate
+import collections
+import smtplib
+import threading
+import time
+import xml.dom.minidom
+
+class Email(object):
+    def __init__(self, toAddresses, subject, text):
+        self.toAddresses = toAddresses
+        self.subject = subject
+        self.text = text
+        self.exception = None
+        self._isDone = False
+
+    @staticmethod
+    def fromActionXml(actionXml):
+        """ Makes an email from the XML of a send-email action, as rendered for linknx. """
+        actionNode = xml.dom.minidom.parseString(actionXml).documentElement
+        toAddresses = [address.strip() for address in actionNode.getAttribute('to').split(',') if address.strip()]
+        text = ''.join([node.data for node in actionNode.childNodes if node.nodeType in (node.TEXT_NODE, node.CDATA_SECTION_NODE)])
+        return Email(toAddresses, actionNode.getAttribute('subject'), text)
+
+    def toMIME(self, fromAddress):
+        message = MIMEText(_text=self.text, _charset='utf-8')
+        message['From'] = fromAddress
+        message['To'] = COMMASPACE.join(self.toAddresses)
+        message['Date'] = formatdate(localtime=True)
+        message['Subject'] = Header(' '.join(self.subject.split()), 'utf-8') # Line breaks are not allowed in headers.
+        return message.as_string()
+
+    def __repr__(self):
+        return 'Email to {0} with subject "{1}"'.format(COMMASPACE.join(self.toAddresses), self.subject)
+
+class SMTPMailer(object):
+    """
+    Sends emails to an SMTP server over a small pool of persistent sessions.
+
+    The thread that gets hold of a session sends all queued emails one after the other on it, including those of the threads waiting for a session. Sessions that are idle for too long or dropped by the server are reopened.
+    """
+    class _Session(object):
+        def __init__(self, index):
+            self.index = index
+            self.smtp = None # Opened lazily.
+            self.lastUseTime = None
+
+    def __init__(self, host, port, fromAddress, username=None, password=None, startTLS=False, sessionCount=1, timeout=30.0, idleTimeout=60.0):
+        """
+        sessionCount -- Maximum number of concurrent sessions to the server.
+        idleTimeout -- Duration after which an unused session is reopened, in seconds.
+        """
+        self.host = host
+        self.port = port
+        self.fromAddress = fromAddress
+        self.username = username
+        self.password = password
+        self.startTLS = startTLS
+        self.timeout = timeout
+        self.idleTimeout = idleTimeout
+        self._condition = threading.Condition(threading.Lock())
+        self._pendingEmails = collections.deque()
+        self.sessionCount = sessionCount
+        self._idleSessions = [SMTPMailer._Session(i) for i in range(sessionCount)]
+        self._isClosed = False
+
+        # Statistics.
+        self.sentEmailCount = 0
+        self.failedEmailCount = 0
+        self.connectionCount = 0
+        self.reconnectionCount = 0
+
+    def sendAction(self, actionXml):
+        """ Sends the email described by the XML of a send-email action. """
+        self.send(Email.fromActionXml(actionXml))
+
+    def send(self, email):
+        """ Sends an email. Returns once it has been accepted by the server, raises an exception if it could not be sent. """
+        with self._condition:
+            if self._isClosed: raise Exception('Mailer is closed, cannot send {0}.'.format(email))
+            email.exception = None
+            email._isDone = False
+            self._pendingEmails.append(email)
+            while True:
+                # Another thread may have sent this email on our behalf.
+                while not email._isDone and not self._idleSessions:
+                    self._condition.wait()
+                if email._isDone: break
+                session = self._idleSessions.pop()
+                self._condition.release()
+                try:
+                    self._sendPendingEmails(session)
+                finally:
+                    self._condition.acquire()
+                    self._idleSessions.append(session)
+                    self._condition.notify_all()
+
+        if email.exception is not None: raise email.exception
+
+    def _sendPendingEmails(self, session):
+        while True:
+            with self._condition:
+                if not self._pendingEmails: return
+                email = self._pendingEmails.popleft()
+
+            try:
+                self._sendOnSession(session, email)
+                logger.reportInfo('{0} sent.'.format(email))
+            except Exception as e:
+                email.exception = e
+
+            with self._condition:
+                if email.exception is None:
+                    self.sentEmailCount += 1
+                else:
+                    self.failedEmailCount += 1
+                email._isDone = True
+                self._condition.notify_all()
+
+    def _sendOnSession(self, session, email):
+        message = email.toMIME(self.fromAddress)
+        isReused = session.smtp != None
+        if isReused and time.monotonic() - session.lastUseTime > self.idleTimeout:
+            self._closeSession(session)
+            isReused = False
+        if session.smtp == None: self._openSession(session)
+
+        try:
+            self._sendMessage(session, email, message)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            if not isReused: raise
+
+            # The server has dropped the session since it was last used.
+            logger.reportInfo('SMTP session #{0} has been closed by {1}, reconnecting.'.format(session.index, self.host))
+            with self._condition:
+                self.reconnectionCount += 1
+            self._openSession(session)
+            self._sendMessage(session, email, message)
+
+    def _sendMessage(self, session, email, message):
+        try:
+            refusedRecipients = session.smtp.sendmail(self.fromAddress, email.toAddresses, message)
+        except smtplib.SMTPRecipientsRefused:
+            # The server has reset the transaction, session is still usable.
+            session.lastUseTime = time.monotonic()
+            raise
+        except:
+            # The session is in an unknown state, do not reuse it.
+            session.smtp.close()
+            session.smtp = None
+            raise
+        session.lastUseTime = time.monotonic()
+        if refusedRecipients:
+            logger.reportWarning('{0} has been refused for {1}.'.format(email, ', '.join(refusedRecipients)))
+
+    def _openSession(self, session):
+        smtp = smtplib.SMTP(host=self.host, port=self.port, timeout=self.timeout)
+        try:
+            if self.startTLS:
+                smtp.starttls()
+            if self.username != None:
+                smtp.login(self.username, self.password)
+        except:
+            smtp.close()
+            raise
+        session.smtp = smtp
+        session.lastUseTime = time.monotonic()
+        with self._condition:
+            self.connectionCount += 1
+        logger.reportDebug('SMTP session #{0} to {1}:{2} is open.'.format(session.index, self.host, self.port))
+
+    def _closeSession(self, session):
+        if session.smtp == None: return
+        try:
+            session.smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            session.smtp.close()
+        session.smtp = None
+
+    def close(self):
+        """ Waits for emails being sent and closes the sessions. """
+        with self._condition:
+            self._isClosed = True
+            sessions = []
+            while True:
+                sessions += self._idleSessions
+                self._idleSessions = []
+                if len(sessions) == self.sessionCount: break
+                self._condition.wait()
+        for session in sessions:
+            self._closeSession(session)
+
+    def __repr__(self):
+        return 'SMTP mailer ({0} sent, {1} failed, {2} connections, {3} reconnections)'.format(self.sentEmailCount, self.failedEmailCount, self.connectionCount, self.reconnectionCount)
@@ -0,0 +1,156 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2014-2017 Cyrille Defranoux
+#
+# This file is part of Homewatcher.
+#
+# Homewatcher is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Homewatcher is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Homewatcher. If not, see <http://www.gnu.org/licenses/>.
+#
+# For any question, feature requests or bug reports, feel free to contact me at:
+# knx at aminate dot net
+
+from homewatcher import ensurepyknx
+
+from pyknx import logger
+import threading
+
+class CachedObject(object):
+    """
+    Wraps a linknx object so that its value is read from the shadow cache whenever possible.
+
+    Writes go through to linknx and update the cache. Any other attribute is forwarded to the linknx object.
+    """
+    def __init__(self, cache, linknxObject):
+        self._cache = cache
+        self._linknxObject = linknxObject
+
+    @property
+    def id(self):
+        return self._linknxObject.id
+
+    @property
+    def linknxObject(self):
+        return self._linknxObject
+
+    @property
+    def value(self):
+        return self._cache.getValue(self)
+
+    @value.setter
+    def value(self, objValue):
+        self._cache.setValue(self, objValue)
+
+    def __getattr__(self, name):
+        return getattr(self._linknxObject, name)
+
+    def __repr__(self):
+        return self.id
+
+    def __str__(self):
+        return self.id
+
+class ObjectCache(object):
+    """
+    In-process shadow of the values of the linknx objects Homewatcher relies on.
+
+    Only the objects whose changes are notified by linknx are shadowed. Callers are responsible for calling notifyObjectChanged from these notifications, along with the new value when they know it. Other objects are always read from linknx.
+    """
+    PREFETCH_CHUNK_SIZE = 500 # Maximum number of objects read in a single request.
+
+    def __init__(self, linknx, notifiedObjectIds):
+        self.linknx = linknx
+        self.notifiedObjectIds = frozenset(notifiedObjectIds)
+        self._lock = threading.RLock()
+        self._objects = {} # Cached objects indexed by id.
+        self._values = {} # Last known values indexed by object id.
+        self._generations = {} # Incremented each time an object's value is invalidated, so that a read that overlaps an invalidation does not store an obsolete value.
+        self.hitCount = 0
+        self.missCount = 0
+        self.uncachedReadCount = 0 # Reads of objects that are not notified.
+
+    def getObject(self, objectId):
+        """ Get the cached object of given identifier. Returns None if objectId is None. """
+        if objectId is None: return None
+
+        with self._lock:
+            obj = self._objects.get(objectId)
+            if obj is None:
+                obj = CachedObject(self, self.linknx.getObject(objectId))
+                self._objects[objectId] = obj
+            return obj
+
+    def prefetch(self, objectIds):
+        """ Reads the values of the given objects from linknx in as few requests as possible and stores them in the cache. Objects that are not notified are skipped. """
+        objectIds = sorted(self.notifiedObjectIds.intersection(objectIds))
+        for chunkStart in range(0, len(objectIds), ObjectCache.PREFETCH_CHUNK_SIZE):
+            chunk = objectIds[chunkStart:chunkStart + ObjectCache.PREFETCH_CHUNK_SIZE]
+            with self._lock:
+                generations = {objectId : self._generations.get(objectId, 0) for objectId in chunk}
+            values = self.linknx.getObjects(objectIds=chunk).getValues()
+            with self._lock:
+                for objectId, value in values.items():
+                    self._storeValue(objectId, value, generations[objectId])
+        logger.reportDebug('Prefetched values of {0} objects.'.format(len(objectIds)))
+
+    def getValue(self, obj):
+        objectId = obj.id
+        if not objectId in self.notifiedObjectIds:
+            with self._lock:
+                self.uncachedReadCount += 1
+            return obj.linknxObject.value
+
+        with self._lock:
+            if objectId in self._values:
+                self.hitCount += 1
+                return self._values[objectId]
+            self.missCount += 1
+            generation = self._generations.get(objectId, 0)
+
+        # Read from linknx outside the lock so that a slow round trip does not
+        # block readers of other objects.
+        value = obj.linknxObject.value
+        with self._lock:
+            self._storeValue(objectId, value, generation)
+        return value
+
+    def setValue(self, obj, objValue):
+        linknxObject = obj.linknxObject
+        linknxObject.value = objValue
+        if not obj.id in self.notifiedObjectIds: return
+
+        # Store the value as it would be read back from linknx.
+        value = linknxObject.convertStringToValue(linknxObject.convertValueToString(objValue))
+        with self._lock:
+            generation = self._generations.get(obj.id, 0) + 1
+            self._generations[obj.id] = generation
+            self._storeValue(obj.id, value, generation)
+
+    def notifyObjectChanged(self, objectId, value=None):
+        """ Notifies the cache that the value of an object has changed in linknx. If the new value is not given, the next read of the object is served by linknx. """
+        with self._lock:
+            generation = self._generations.get(objectId, 0) + 1
+            self._generations[objectId] = generation
+            if value != None and objectId in self.notifiedObjectIds:
+                self._storeValue(objectId, value, generation)
+            else:
+                self._values.pop(objectId, None)
+
+    def _storeValue(self, objectId, value, generation):
+        # Discard the value if the object has been invalidated since the value
+        # was read.
+        if self._generations.get(objectId, 0) != generation: return
+        self._values[objectId] = value
+
+    def __repr__(self):
+        return 'Object cache ({0} values, {1} hits, {2} misses, {3} uncached reads)'.format(len(self._values), self.hitCount, self.missCount, self.uncachedReadCount)
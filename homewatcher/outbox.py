@@ -0,0 +1,289 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2014-2017 Cyrille Defranoux
+#
+# This file is part of Homewatcher.
+#
+# Homewatcher is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Homewatcher is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Homewatcher. If not, see <http://www.gnu.org/licenses/>.
+#
+# For any question, feature requests or bug reports, feel free to contact me at:
+# knx at aminate dot net
+
+from homewatcher import ensurepyknx
+
+from pyknx import logger
+from homewatcher import timer
+import collections
+import json
+import os
+import threading
+import uuid
+
+class Outbox(object):
+    """
+    Durable queue of the actions to deliver.
+
+    Messages are synced to a journal before being delivered by the action executor. Messages of a queue are delivered one after the other: only the first one is submitted to the executor, and it is resubmitted by a retry timer when its delivery fails. Messages left in the journal are delivered again on startup, so a message may be delivered twice after a crash but is never lost.
+    """
+    COMPACTION_SIZE = 1024 * 1024 # Size of the journal above which it is truncated as soon as no message is pending.
+
+    class _Write(object):
+        """ Records appended to the journal at once. """
+        def __init__(self, records):
+            self.records = records
+            self.isSynced = False
+            self.error = None # Exception raised while writing the records.
+
+    class Message(object):
+        def __init__(self, key, queueName, target, payload, description):
+            self.key = key # Identifies the message in the journal, and prevents it from being delivered twice in a run.
+            self.queueName = queueName
+            self.target = target
+            self.payload = payload
+            self.description = description
+            self.attemptCount = 0
+            self._isAttempted = threading.Event() # Set after the first attempt, or when the outbox is closed before it.
+
+        def wait(self):
+            """ Waits for the first delivery attempt of the message. Failed attempts are retried in the background. """
+            self._isAttempted.wait()
+
+        def toJSON(self):
+            return {'key' : self.key, 'queue' : self.queueName, 'target' : self.target, 'payload' : self.payload, 'description' : self.description}
+
+        def __repr__(self):
+            return self.description
+
+    def __init__(self, path, deliver, actionExecutor, timerScheduler, retryDelay=1.0, maxRetryDelay=300.0, maxAttemptCount=None):
+        """
+        path -- Path to the journal file.
+        deliver -- Function called with the target and payload of a message. Raises an exception on failure.
+        maxAttemptCount -- Number of failed attempts after which a message is dropped. None to retry forever.
+        """
+        self.path = path
+        self.deliver = deliver
+        self.actionExecutor = actionExecutor
+        self.timerScheduler = timerScheduler
+        self.retryDelay = retryDelay
+        self.maxRetryDelay = maxRetryDelay
+        self.maxAttemptCount = maxAttemptCount
+        self._condition = threading.Condition(threading.Lock())
+        self._undeliveredMessages = {} # Messages posted and not delivered yet, indexed by key.
+        self._messagesByQueue = {} # Undelivered messages of each queue in delivery order, the first one being submitted or waiting for a retry. Only queues with messages are present.
+        self._retryTimers = set()
+        self._pendingWrites = [] # Writes waiting for the writer thread.
+        self._file = None
+        self._isFileBroken = False # Whether the last write may have left a partial record.
+        self._writer = None
+        self._isClosed = False
+
+        # Statistics.
+        self.deliveredMessageCount = 0
+        self.retryCount = 0
+        self.droppedMessageCount = 0
+        self.syncCount = 0
+
+    def open(self):
+        """ Opens the journal and submits the messages it still contains for delivery. Returns the number of such messages. """
+        undeliveredMessages = self._readJournal()
+
+        # Compact the journal so that it only contains undelivered messages.
+        compactedPath = self.path + '.tmp'
+        with open(compactedPath, 'w') as compactedFile:
+            for message in undeliveredMessages:
+                compactedFile.write(json.dumps(message.toJSON()) + '\n')
+            compactedFile.flush()
+            os.fsync(compactedFile.fileno())
+        os.replace(compactedPath, self.path)
+
+        self._file = open(self.path, 'a')
+        self._writer = threading.Thread(target=self._run, name='Outbox writer')
+        self._writer.daemon = True
+        self._writer.start()
+
+        if undeliveredMessages:
+            logger.reportWarning('{0} actions from a previous run have not been delivered, delivering them now.'.format(len(undeliveredMessages)))
+        with self._condition:
+            for message in undeliveredMessages:
+                self._undeliveredMessages[message.key] = message
+            firstMessages = [message for message in undeliveredMessages if self._enqueue(message)]
+        for message in firstMessages:
+            self._submit(message)
+        return len(undeliveredMessages)
+
+    def _readJournal(self):
+        messages = {}
+        if not os.path.exists(self.path): return []
+
+        with open(self.path, 'r') as journal:
+            for line in journal:
+                if not line.strip(): continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # The last record may have been partially written.
+                    logger.reportWarning('Ignoring corrupted record in {0}: {1}'.format(self.path, line))
+                    continue
+                if record.get('done'):
+                    messages.pop(record['key'], None)
+                elif not record['key'] in messages:
+                    messages[record['key']] = Outbox.Message(record['key'], record['queue'], record['target'], record['payload'], record['description'])
+        return list(messages.values())
+
+    def post(self, queueName, items):
+        """
+        Makes messages durable, then queues them for delivery in the given executor queue. Returns the messages, which can be waited for.
+
+        items -- Tuples (target, payload, description).
+        Raises OSError if the journal could not be written, in which case no message is delivered.
+        """
+        messages = [Outbox.Message(uuid.uuid4().hex, queueName, target, payload, description) for target, payload, description in items]
+        with self._condition:
+            if self._isClosed: raise Exception('Outbox is closed, cannot post {0}.'.format(messages))
+            for message in messages:
+                self._undeliveredMessages[message.key] = message
+            write = self._appendRecords([message.toJSON() for message in messages])
+            self._condition.wait_for(lambda: write.isSynced or write.error != None)
+            if write.error != None:
+                for message in messages:
+                    del self._undeliveredMessages[message.key]
+                raise OSError('Could not write {0} to outbox journal {1}: {2}'.format(messages, self.path, write.error))
+            firstMessages = [message for message in messages if self._enqueue(message)]
+        for message in firstMessages:
+            self._submit(message)
+        return messages
+
+    def _appendRecords(self, records):
+        write = Outbox._Write(records)
+        self._pendingWrites.append(write)
+        self._condition.notify_all()
+        return write
+
+    def _enqueue(self, message):
+        """ Appends a message to its queue. Returns whether it is the first one, in which case it must be submitted. The lock must be held. """
+        messages = self._messagesByQueue.get(message.queueName)
+        if messages == None:
+            messages = collections.deque()
+            self._messagesByQueue[message.queueName] = messages
+        messages.append(message)
+        return len(messages) == 1
+
+    def _submit(self, message):
+        self.actionExecutor.submit(message.queueName, lambda: self._deliver(message), message.description)
+
+    def _deliver(self, message):
+        message.attemptCount += 1
+        nextMessage = None
+        try:
+            self.deliver(message.target, message.payload)
+            nextMessage = self._markDelivered(message, isDropped=False)
+        except Exception:
+            logger.reportException('Delivery of "{0}" failed (attempt #{1}).'.format(message, message.attemptCount))
+            if self.maxAttemptCount != None and message.attemptCount >= self.maxAttemptCount:
+                logger.reportError('Giving up "{0}" after {1} attempts.'.format(message, message.attemptCount))
+                nextMessage = self._markDelivered(message, isDropped=True)
+            else:
+                self._scheduleRetry(message)
+        finally:
+            message._isAttempted.set()
+
+        if nextMessage != None: self._submit(nextMessage)
+
+    def _scheduleRetry(self, message):
+        # The next messages of the queue wait for this one, but no worker is
+        # held meanwhile.
+        delay = min(self.retryDelay * 2 ** (message.attemptCount - 1), self.maxRetryDelay)
+        logger.reportInfo('"{0}" will be retried in {1} seconds.'.format(message, delay))
+        retryTimer = timer.Timer(None, delay, 'Retry timer for {0}'.format(message), onTimeoutReached=lambda t: self._retry(message, t), scheduler=self.timerScheduler)
+        with self._condition:
+            if self._isClosed: return # Message is kept in the journal for next run.
+            self._retryTimers.add(retryTimer)
+        retryTimer.start()
+
+    def _retry(self, message, retryTimer):
+        with self._condition:
+            self._retryTimers.discard(retryTimer)
+            if self._isClosed: return
+            self.retryCount += 1
+        self._submit(message)
+
+    def _markDelivered(self, message, isDropped):
+        """ Removes a message from the outbox once delivered or dropped. Returns the next message of its queue, which must be submitted. """
+        with self._condition:
+            if self._undeliveredMessages.pop(message.key, None) == None: return None
+            if isDropped:
+                self.droppedMessageCount += 1
+            else:
+                self.deliveredMessageCount += 1
+            if not self._isClosed: self._appendRecords([{'key' : message.key, 'done' : True}])
+
+            messages = self._messagesByQueue[message.queueName]
+            messages.popleft()
+            if not messages:
+                del self._messagesByQueue[message.queueName]
+                return None
+            return messages[0] if not self._isClosed else None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pendingWrites and not self._isClosed:
+                    self._condition.wait()
+                if not self._pendingWrites: return
+                writes = self._pendingWrites
+                self._pendingWrites = []
+
+            error = None
+            try:
+                # Terminate a record that a failed write may have left partial.
+                lines = ['\n'] if self._isFileBroken else []
+                lines += [json.dumps(record) + '\n' for write in writes for record in write.records]
+                self._isFileBroken = True
+                self._file.write(''.join(lines))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._isFileBroken = False
+            except Exception as e:
+                logger.reportException('Could not write to outbox journal {0}.'.format(self.path))
+                error = e
+
+            with self._condition:
+                self.syncCount += 1
+                for write in writes:
+                    write.isSynced = error == None
+                    write.error = error
+                if not self._undeliveredMessages and not self._pendingWrites and not self._isFileBroken and self._file.tell() > Outbox.COMPACTION_SIZE:
+                    self._file.truncate(0)
+                    self._file.seek(0)
+                self._condition.notify_all()
+
+    def close(self):
+        """ Writes pending records and closes the journal. Undelivered messages remain in the journal for the next run. """
+        with self._condition:
+            self._isClosed = True
+            retryTimers = self._retryTimers
+            self._retryTimers = set()
+            for message in self._undeliveredMessages.values():
+                message._isAttempted.set()
+            self._condition.notify_all()
+        for retryTimer in retryTimers:
+            retryTimer.stop()
+        if self._writer != None:
+            self._writer.join()
+            self._file.close()
+        if self._undeliveredMessages:
+            logger.reportWarning('{0} actions have not been delivered yet. They will be on next start.'.format(len(self._undeliveredMessages)))
+
+    def __repr__(self):
+        return 'Outbox ({0} undelivered, {1} delivered, {2} retries, {3} dropped, {4} syncs)'.format(len(self._undeliveredMessages), self.deliveredMessageCount, self.retryCount, self.droppedMessageCount, self.syncCount)
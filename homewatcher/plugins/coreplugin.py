@@ -14,19 +14,11 @@ class SensorListContextHandler(homewatcher.contexthandlers.ContextHandler):
             self.format = formatAttribute
 
     def formatSensorList(self, sensors):
-        message = ''
-        sensorNames = [str(s) for s in sensors]
-        sensorNames.sort()
-        for sensor in sensorNames:
-            if self.format == 'inline':
-                if message:
-                    message += ','
-                message += sensor
-            elif self.format == 'bulleted':
-                if message:
-                    message += '\n'
-                message += '-{0}'.format(sensor)
-        return message
+        sensorNames = sorted([str(s) for s in sensors])
+        if self.format == 'inline':
+            return ','.join(sensorNames)
+        else:
+            return '\n'.join(['-{0}'.format(sensor) for sensor in sensorNames])
 
 class SensorsStatusContextHandler(SensorListContextHandler):
     __contextHandlerName__ = 'alert.sensors-status'
@@ -64,6 +56,28 @@ class EnabledSensorsContextHandler(SensorListContextHandler):
         enabledSensors = [s for s in context.daemon.sensors if s.isEnabled or (self.includesPending and s.isActivationPending())]
         return self.formatSensorList(enabledSensors)
 
+class JoinedSensorsContextHandler(SensorListContextHandler):
+    __contextHandlerName__ = 'alert.joined-sensors'
+    def __init__(self, xmlConfig):
+        SensorListContextHandler.__init__(self, xmlConfig)
+
+    def analyzeContext(self, context):
+        if isinstance(context, homewatcher.alarm.Alert):
+            return self.formatSensorList(context.joinedSensors)
+        else:
+            return ''
+
+class LeftSensorsContextHandler(SensorListContextHandler):
+    __contextHandlerName__ = 'alert.left-sensors'
+    def __init__(self, xmlConfig):
+        SensorListContextHandler.__init__(self, xmlConfig)
+
+    def analyzeContext(self, context):
+        if isinstance(context, homewatcher.alarm.Alert):
+            return self.formatSensorList(context.leftSensors)
+        else:
+            return ''
+
 class CurrentModeContextHandler(homewatcher.contexthandlers.ContextHandler):
     __contextHandlerName__ = 'mode.current'
     def __init__(self, xmlConfig):
@@ -93,5 +107,7 @@ class CorePlugin(homewatcher.plugin.Plugin):
         contextHandlerFactory = homewatcher.contexthandlers.ContextHandlerFactory.getInstance()
         contextHandlerFactory.registerHandler(SensorsStatusContextHandler)
         contextHandlerFactory.registerHandler(EnabledSensorsContextHandler)
+        contextHandlerFactory.registerHandler(JoinedSensorsContextHandler)
+        contextHandlerFactory.registerHandler(LeftSensorsContextHandler)
         contextHandlerFactory.registerHandler(CurrentModeContextHandler)
         contextHandlerFactory.registerHandler(AlertNameContextHandler)
@@ -0,0 +1,229 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2014-2017 Cyrille Defranoux
+#
+# This file is part of Homewatcher.
+#
+# Homewatcher is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Homewatcher is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Homewatcher. If not, see <http://www.gnu.org/licenses/>.
+#
+# For any question, feature requests or bug reports, feel free to contact me at:
+# knx at aminate dot net
+
+from homewatcher import ensurepyknx
+
+from pyknx import logger
+import os
+import selectors
+import threading
+
+class ProcessPump(object):
+    """
+    Logs the output of child processes and reaps them, from a single thread.
+
+    The pipes of all processes are multiplexed with a selector and split into lines, which are cut if too long. Terminations are watched through pidfds where supported (Linux) and polled otherwise.
+    """
+    READ_SIZE = 4096
+    POLL_INTERVAL = 0.1 # Delay between two checks of the processes that have no pidfd, in seconds.
+
+    class _Stream(object):
+        def __init__(self, child, name, pipe):
+            self.child = child
+            self.name = name
+            self.pipe = pipe
+            self.buffer = b''
+
+    class _Child(object):
+        def __init__(self, process, name, onLine, onTerminated):
+            self.process = process
+            self.name = name
+            self.onLine = onLine
+            self.onTerminated = onTerminated
+            self.openStreams = []
+            self.pidfd = None
+
+    def __init__(self, maxLineLength=4096):
+        self.maxLineLength = maxLineLength
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._children = set()
+        self._polledChildren = set() # Children whose termination cannot be notified through a pidfd.
+        self._wakeupReader, self._wakeupWriter = os.pipe()
+        os.set_blocking(self._wakeupReader, False)
+        os.set_blocking(self._wakeupWriter, False)
+        self._selector.register(self._wakeupReader, selectors.EVENT_READ, None)
+        self._thread = None
+        self._isStopped = False
+
+        # Statistics.
+        self.registeredProcessCount = 0
+        self.reapedProcessCount = 0
+        self.lineCount = 0
+        self.truncatedLineCount = 0
+
+    @property
+    def processCount(self):
+        """ Number of processes that have not been reaped yet. """
+        with self._lock:
+            return len(self._children)
+
+    def register(self, process, name, onLine=None, onTerminated=None):
+        """
+        Starts pumping the output of a process started with stdout and/or stderr redirected to pipes.
+
+        onLine -- Function called with the name of the stream ('out' or 'err') and each line of output, as a string without line terminator. Lines are logged if None.
+        onTerminated -- Function called with the process once it has been reaped (its returncode is set).
+        These functions are called from the pump thread and must not block.
+        """
+        child = ProcessPump._Child(process, name, onLine, onTerminated)
+        with self._lock:
+            if self._isStopped: raise Exception('Process pump is stopped.')
+            self._children.add(child)
+            self.registeredProcessCount += 1
+            for streamName, pipe in (('out', process.stdout), ('err', process.stderr)):
+                if pipe == None: continue
+                stream = ProcessPump._Stream(child, streamName, pipe)
+                os.set_blocking(pipe.fileno(), False)
+                self._selector.register(pipe.fileno(), selectors.EVENT_READ, stream)
+                child.openStreams.append(stream)
+            if hasattr(os, 'pidfd_open'):
+                try:
+                    child.pidfd = os.pidfd_open(process.pid)
+                    self._selector.register(child.pidfd, selectors.EVENT_READ, child)
+                except OSError:
+                    child.pidfd = None # Process is already reaped or pidfds are not supported by the kernel.
+            if child.pidfd == None: self._polledChildren.add(child)
+            self._ensureStarted()
+        self._wakeUp()
+        return process
+
+    def _ensureStarted(self):
+        if self._thread != None: return
+        self._thread = threading.Thread(target=self._run, name='Process pump')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _wakeUp(self):
+        try:
+            os.write(self._wakeupWriter, b'\0')
+        except BlockingIOError:
+            pass # A wake up is already pending.
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if self._isStopped and not self._children: break
+                polledChildren = list(self._polledChildren)
+            for key, events in self._selector.select(ProcessPump.POLL_INTERVAL if polledChildren else None):
+                if key.data == None:
+                    try:
+                        while os.read(self._wakeupReader, ProcessPump.READ_SIZE): pass
+                    except BlockingIOError:
+                        pass
+                elif isinstance(key.data, ProcessPump._Stream):
+                    # The stream may have been closed while handling a
+                    # previous event of this batch.
+                    if key.data in key.data.child.openStreams: self._read(key.data)
+                elif key.data.pidfd != None:
+                    self._reap(key.data)
+            for child in polledChildren:
+                if child.process.poll() != None: self._reap(child)
+        self._selector.close()
+        os.close(self._wakeupReader)
+        os.close(self._wakeupWriter)
+
+    def _read(self, stream):
+        """ Reads the available output of a stream. Returns whether the stream may have more data available immediately. """
+        try:
+            data = os.read(stream.pipe.fileno(), ProcessPump.READ_SIZE)
+        except BlockingIOError:
+            return False
+        if not data:
+            # End of stream: emit the last line even if it is not terminated.
+            if stream.buffer: self._emitLine(stream, stream.buffer)
+            stream.buffer = b''
+            with self._lock:
+                self._selector.unregister(stream.pipe.fileno())
+            stream.pipe.close()
+            stream.child.openStreams.remove(stream)
+            return False
+
+        lines = (stream.buffer + data).split(b'\n')
+        stream.buffer = lines.pop()
+        for line in lines:
+            while len(line) > self.maxLineLength:
+                line = self._emitTruncatedLine(stream, line)
+            self._emitLine(stream, line)
+        while len(stream.buffer) > self.maxLineLength:
+            stream.buffer = self._emitTruncatedLine(stream, stream.buffer)
+        return len(data) == ProcessPump.READ_SIZE
+
+    def _emitTruncatedLine(self, stream, line):
+        """ Emits the beginning of a line that is too long and returns the rest. """
+        self.truncatedLineCount += 1
+        self._emitLine(stream, line[:self.maxLineLength])
+        return line[self.maxLineLength:]
+
+    def _emitLine(self, stream, line):
+        child = stream.child
+        line = line.decode('utf-8', 'replace').rstrip('\r')
+        self.lineCount += 1
+        try:
+            if child.onLine != None:
+                child.onLine(stream.name, line)
+            else:
+                logger.reportInfo('[{0}.{3} pid={1}] {2}'.format(child.name, child.process.pid, line, stream.name))
+        except Exception:
+            logger.reportException('Error while handling output of {0}.'.format(child.name))
+
+    def _reap(self, child):
+        if child.pidfd != None:
+            with self._lock:
+                self._selector.unregister(child.pidfd)
+            os.close(child.pidfd)
+            child.pidfd = None
+        child.process.wait() # Does not block: the process has exited.
+
+        # Log what the process wrote before exiting. If a grandchild keeps
+        # the streams open, they are pumped until their end as usual.
+        for stream in list(child.openStreams):
+            while self._read(stream): pass
+
+        with self._lock:
+            self._children.discard(child)
+            self._polledChildren.discard(child)
+            self.reapedProcessCount += 1
+        logger.reportDebug('{0} pid={1} terminated with code {2}.'.format(child.name, child.process.pid, child.process.returncode))
+        if child.onTerminated != None:
+            try:
+                child.onTerminated(child.process)
+            except Exception:
+                logger.reportException('Error while handling termination of {0}.'.format(child.name))
+
+    def stop(self, timeout=None):
+        """ Waits for registered processes to terminate, at most timeout seconds, then stops the pump thread. """
+        with self._lock:
+            self._isStopped = True
+            thread = self._thread
+        if thread == None:
+            self._selector.close()
+            os.close(self._wakeupReader)
+            os.close(self._wakeupWriter)
+            return
+        self._wakeUp()
+        thread.join(timeout)
+        if thread.is_alive():
+            logger.reportWarning('{0} processes are still running, their output is not logged anymore.'.format(self.processCount))
+
+    def __repr__(self):
+        return 'Process pump ({0} running, {1} reaped, {2} lines, {3} truncated)'.format(self.processCount, self.reapedProcessCount, self.lineCount, self.truncatedLineCount)
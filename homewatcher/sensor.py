@@ -34,11 +34,16 @@ import ftplib
 # from homewatcher import alarm
 
 class ActivationCriterion(object):
-    """ Represents a criterion that tells if a sensor can be activated. Criterion's logic has to be implemented in method named isValid(self). """
+    """
+    Represents a criterion that tells if a sensor can be activated.
+
+    Criterion's logic has to be implemented in method named _makeEvaluator(self), which returns a callable that takes no argument. The criterion tree is compiled into a single flat evaluator the first time it is evaluated, or explicitly with compile() once all sensors of the daemon are instanciated.
+    """
     def __init__(self, sensor, config):
         self.sensor = sensor
         self.config = config
         self.daemon = sensor.daemon
+        self._evaluator = None
 
     @staticmethod
     def makeNew(forSensor, config):
@@ -51,21 +56,44 @@ class ActivationCriterion(object):
         else:
             raise Exception('Unsupported criterion type "{0}".'.format(config.type))
 
+    def compile(self):
+        """ Compiles this criterion into an evaluator whose references to the watched sensors are bound once and for all. """
+        self._evaluator = self._makeEvaluator()
+
+    def isValid(self):
+        if self._evaluator is None: self.compile()
+        return self._evaluator()
+
+    def _makeEvaluator(self):
+        raise Exception('ActivationCriterion._makeEvaluator is not implemented.')
+
+    def getWatchedSensors(self):
+        """ Returns the set of sensors whose trigger state this criterion depends on. """
+        raise Exception('ActivationCriterion.getWatchedSensors is not implemented.')
+
 class SensorActivationCriterion(ActivationCriterion):
     """ Criterion that allows sensor activation if another sensor is triggered or not. """
     def __init__(self, sensor, config):
         ActivationCriterion.__init__(self, sensor, config)
+        self._watchedSensor = None # Resolved on first use since the watched sensor may not be instanciated yet.
 
     @property
     def watchedSensor(self):
-        return self.daemon.getSensorByName(self.config.sensorName)
+        if self._watchedSensor is None:
+            self._watchedSensor = self.daemon.getSensorByName(self.config.sensorName)
+        return self._watchedSensor
 
     @property
     def shouldBeTriggered(self):
         return self.config.whenTriggered
 
-    def isValid(self):
-        return self.watchedSensor.isTriggered == self.shouldBeTriggered
+    def _makeEvaluator(self):
+        watchedSensor = self.watchedSensor
+        shouldBeTriggered = self.shouldBeTriggered
+        return lambda: watchedSensor.isTriggered == shouldBeTriggered
+
+    def getWatchedSensors(self):
+        return {self.watchedSensor}
 
 class BooleanActivationCriterion(ActivationCriterion):
     def __init__(self, sensor, config):
@@ -78,43 +106,53 @@ class BooleanActivationCriterion(ActivationCriterion):
     def type(self):
         return self.config.type
 
-    def isValid(self):
+    def getWatchedSensors(self):
+        watchedSensors = set()
         for child in self.children:
-            if self.config.type == configuration.ActivationCriterion.Type.AND:
-                if not child.isValid(): return False
-            elif self.config.type == configuration.ActivationCriterion.Type.OR:
-                if child.isValid(): return True
-            else:
-                raise Exception('Unsupported criterion type "{0}".'.format(self.config.type))
+            watchedSensors.update(child.getWatchedSensors())
+        return watchedSensors
 
-        if self.config.type == configuration.ActivationCriterion.Type.AND:
-            return True
-        elif self.config.type == configuration.ActivationCriterion.Type.OR:
-            return False
+    def _getOperandEvaluators(self):
+        """ Returns the evaluators of the operands of this criterion. Nested criteria of the same type are flattened into their parent. """
+        evaluators = []
+        for child in self.children:
+            if isinstance(child, BooleanActivationCriterion) and child.type == self.type:
+                evaluators.extend(child._getOperandEvaluators())
+            else:
+                evaluators.append(child._makeEvaluator())
+        return evaluators
+
+    def _makeEvaluator(self):
+        if self.type == configuration.ActivationCriterion.Type.AND:
+            isAnd = True
+        elif self.type == configuration.ActivationCriterion.Type.OR:
+            isAnd = False
         else:
             raise Exception('Unsupported criterion type "{0}".'.format(self.config.type))
 
-class SubprocessLoggerThread(threading.Thread):
-    def __init__(self, process, readsStdout, name):
-        threading.Thread.__init__(self, name='Logger thread')
-        self.process = process
-        self.readsStdout = readsStdout
-        self.name = name
-
-    def run(self):
-        statusFormat = 'Logger thread for std{0} of {1} PID=<{2}> is {3}.'.format('out' if self.readsStdout else 'err', self.name, self.process.pid, '{0}')
-        logger.reportInfo(statusFormat.format('started'))
-        while self.process.returncode is None:
-            stream = self.process.stdout if self.readsStdout else self.process.stderr
-            line = stream.readline()
-            if line == '':
-                time.sleep(1)
-                continue
-
-            line = line.rstrip('\n')
-            log = '[{0}.{3} pid={1}] {2}'.format(self.name, self.process.pid, line, 'out' if self.readsStdout else 'err')
-            logger.reportInfo(log)
-        logger.reportInfo(statusFormat.format('terminated'))
+        evaluators = tuple(self._getOperandEvaluators())
+        if not evaluators:
+            return lambda: isAnd
+        elif len(evaluators) == 1:
+            return evaluators[0]
+        elif len(evaluators) == 2:
+            first, second = evaluators
+            if isAnd:
+                return lambda: first() and second()
+            else:
+                return lambda: first() or second()
+        elif isAnd:
+            def evaluateAnd():
+                for evaluator in evaluators:
+                    if not evaluator(): return False
+                return True
+            return evaluateAnd
+        else:
+            def evaluateOr():
+                for evaluator in evaluators:
+                    if evaluator(): return True
+                return False
+            return evaluateOr
 
 class Sensor(object):
     def __init__(self, daemon, config):
@@ -127,9 +165,9 @@ class Sensor(object):
         self.linknx = daemon.linknx
         self._isTriggered = None # Is initialized at the end of __init__, once all data members are set.
         self._activationTimer = None
-        self._enabledObject = self.linknx.getObject(config.enabledObjectId)
-        self._watchedObject = self.linknx.getObject(config.watchedObjectId)
-        self._persistenceObject = self.linknx.getObject(config.persistenceObjectId)
+        self._enabledObject = daemon.objectCache.getObject(config.enabledObjectId)
+        self._watchedObject = daemon.objectCache.getObject(config.watchedObjectId)
+        self._persistenceObject = daemon.objectCache.getObject(config.persistenceObjectId)
         self.alert = self._daemon.getAlertByName(config.alertName)
         self.activationCriterion = ActivationCriterion.makeNew(self, config.activationCriterion)
         self._lock = threading.RLock()
@@ -309,12 +347,12 @@ class Sensor(object):
     def makePrealertTimer(self):
         def onPrealertEnded(timer):
             self.alert.notifySensorPrealertExpired(self)
-        return timer.Timer(self, self.getPrealertDuration(), 'Prealert timer', onTimeoutReached=onPrealertEnded, onTerminated=None)
+        return timer.Timer(self, self.getPrealertDuration(), 'Prealert timer', onTimeoutReached=onPrealertEnded, onTerminated=None, scheduler=self.daemon.timerScheduler)
 
     def makeAlertTimer(self):
         def onAlertEnded(timer):
             self.alert.removeSensorFromAlert(self)
-        return timer.Timer(self, self.getAlertDuration(), 'Alert timer', onTimeoutReached=None, onTerminated=onAlertEnded)
+        return timer.Timer(self, self.getAlertDuration(), 'Alert timer', onTimeoutReached=None, onTerminated=onAlertEnded, scheduler=self.daemon.timerScheduler)
 
     def getUpdatedTriggerState(self):
         """
@@ -348,37 +386,62 @@ class Sensor(object):
         if not timer.isCancelled:
             self.isEnabled = True
 
-    def _onActivationTimerIterate(self, timer):
-        if self.activationCriterion != None and not self.activationCriterion.isValid():
-            if not timer.isPaused:
-                logger.reportInfo('Pausing activation timer for {0} because activation criterion is not satisfied.'.format(self))
-            timer.pause()
-        else:
-            if timer.isPaused:
-                # Restart activation delay.
-                logger.reportInfo('Restarting activation timer for {0} because activation criterion is now satisfied.'.format(self))
-                timer.reset()
+    def _onActivationTimerTerminated(self, timer):
+        with self._lock:
+            # The timer may have been replaced in the meantime.
+            if self._activationTimer is timer:
+                self.daemon.unregisterPendingActivation(self)
+
+    def notifyActivationCriterionChanged(self):
+        """
+        Notifies the sensor that one of the sensors its activation criterion depends on has changed its trigger state.
+
+        The activation timer is paused as long as the criterion is not satisfied and restarted as soon as it is.
+        """
+        with self._lock:
+            activationTimer = self._activationTimer
+            if activationTimer is None or self.activationCriterion is None: return
+
+            if not self.activationCriterion.isValid():
+                if not activationTimer.isPaused:
+                    logger.reportInfo('Pausing activation timer for {0} because activation criterion is not satisfied.'.format(self))
+                activationTimer.pause()
+            else:
+                if activationTimer.isPaused:
+                    # Restart activation delay.
+                    logger.reportInfo('Restarting activation timer for {0} because activation criterion is now satisfied.'.format(self))
+                    activationTimer.reset()
 
     def startActivationTimer(self):
         # Already enabled.
         if self.isEnabled: return
 
-        if self.isActivationPending():
-            logger.reportInfo('An activation timer for {0} is already running. Cancel it and start a new one.'.format(self))
-            self._activationTimer.stop()
-        self._activationTimer = timer.Timer(self, self.getActivationDelay(), 'Activation timer', onTimeoutReached=self._onActivationTimerTimeout, onIterate=self._onActivationTimerIterate)
-        self._activationTimer.start()
+        with self._lock:
+            if self.isActivationPending():
+                logger.reportInfo('An activation timer for {0} is already running. Cancel it and start a new one.'.format(self))
+                self._activationTimer.stop()
+            self._activationTimer = timer.Timer(self, self.getActivationDelay(), 'Activation timer', onTimeoutReached=self._onActivationTimerTimeout, onTerminated=self._onActivationTimerTerminated, scheduler=self.daemon.timerScheduler)
+
+            # The activation criterion is evaluated now, then each time one of
+            # the sensors it depends on changes its trigger state.
+            if self.activationCriterion != None:
+                self.daemon.registerPendingActivation(self)
+                self.notifyActivationCriterionChanged()
+            self._activationTimer.start()
 
     def stopActivationTimer(self):
-        if self._activationTimer != None:
-            self._activationTimer.stop()
-            self._activationTimer = None
+        with self._lock:
+            if self._activationTimer != None:
+                self.daemon.unregisterPendingActivation(self)
+                self._activationTimer.stop()
+                self._activationTimer = None
 
     def notifyWatchedObjectChanged(self):
         """ Notifies the sensor that its watched object's value has just changed. """
         newTriggeredState = self.getUpdatedTriggerState() # Depends on the concrete sensor class. Most of them will do nothing as trigger state IS the watched object state. But for FloatSensor for instance, trigger may take an hysteresis into account.
         if self._isTriggered == newTriggeredState: return
         self._isTriggered = newTriggeredState
+        self.daemon.notifySensorTriggerChanged(self)
         if self.isTriggered:
             logger.reportInfo('{0} is triggered.'.format(self.name))
             if self.isEnabled:
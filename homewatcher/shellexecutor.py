@@ -0,0 +1,194 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2014-2017 Cyrille Defranoux
+#
+# This file is part of Homewatcher.
+#
+# Homewatcher is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Homewatcher is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Homewatcher. If not, see <http://www.gnu.org/licenses/>.
+#
+# For any question, feature requests or bug reports, feel free to contact me at:
+# knx at aminate dot net
+
+from homewatcher import ensurepyknx
+
+from pyknx import logger
+from homewatcher import timer
+import collections
+import os
+import signal
+import subprocess
+import threading
+import time
+import xml.dom.minidom
+
+class ShellCommandExecutor(object):
+    """
+    Runs shell commands in child processes of Homewatcher, with a bounded concurrency.
+
+    Commands beyond maxRunningCount wait in a bounded queue. Each one runs in its own process group, which is terminated then killed on timeout. Output is logged by a processpump.ProcessPump.
+    """
+    HISTORY_SIZE = 100 # Number of completed commands whose result is kept.
+
+    class Command(object):
+        def __init__(self, commandLine, description):
+            self.commandLine = commandLine
+            self.description = description
+            self.submitTime = time.monotonic()
+            self.startTime = None
+            self.duration = None
+            self.exitCode = None # Negative if the command has been killed by a signal.
+            self.hasTimedOut = False
+            self.process = None
+            self._timeoutTimer = None
+            self._isDone = threading.Event()
+
+        def wait(self, timeout=None):
+            """ Waits for the command to complete. Returns its exit code, or None if the command is still running. """
+            self._isDone.wait(timeout)
+            return self.exitCode
+
+        def __repr__(self):
+            return self.description
+
+    def __init__(self, processPump, timerScheduler, maxRunningCount=4, maxQueuedCount=100, timeout=60.0, killDelay=5.0):
+        """
+        timeout -- Duration after which a command is terminated, in seconds. None for no timeout.
+        killDelay -- Duration between the termination of a timed out command and its kill, in seconds.
+        """
+        self.processPump = processPump
+        self.timerScheduler = timerScheduler
+        self.maxRunningCount = maxRunningCount
+        self.maxQueuedCount = maxQueuedCount
+        self.timeout = timeout
+        self.killDelay = killDelay
+        self._condition = threading.Condition(threading.Lock())
+        self._queue = collections.deque()
+        self._runningCommands = set()
+        self._isStopped = False
+
+        # Statistics.
+        self.executedCommandCount = 0
+        self.failedCommandCount = 0 # Commands that could not be started or exited with a non-zero code.
+        self.timedOutCommandCount = 0
+        self.peakQueuedCount = 0
+        self.totalDuration = 0.0
+        self.maxDuration = 0.0
+        self.exitCodeCounts = collections.Counter()
+        self.history = collections.deque(maxlen=ShellCommandExecutor.HISTORY_SIZE) # Completed commands, latest last.
+
+    @property
+    def averageDuration(self):
+        return self.totalDuration / self.executedCommandCount if self.executedCommandCount else 0.0
+
+    def runAction(self, actionXml):
+        """ Runs the command of a shell-cmd action, as rendered for linknx. """
+        commandLine = xml.dom.minidom.parseString(actionXml).documentElement.getAttribute('cmd')
+        return self.run(commandLine, 'Shell command "{0}"'.format(commandLine))
+
+    def run(self, commandLine, description):
+        """ Queues a command and returns it. Blocks while the queue is full. """
+        command = ShellCommandExecutor.Command(commandLine, description)
+        with self._condition:
+            if self._isStopped: raise Exception('Shell command executor is stopped, cannot run {0}.'.format(command))
+            if len(self._queue) >= self.maxQueuedCount:
+                logger.reportWarning('Shell command queue is full ({0} commands), waiting for room to run {1}.'.format(len(self._queue), command))
+                self._condition.wait_for(lambda: len(self._queue) < self.maxQueuedCount or self._isStopped)
+                if self._isStopped: raise Exception('Shell command executor has been stopped while waiting for room to run {0}.'.format(command))
+            self._queue.append(command)
+            self.peakQueuedCount = max(self.peakQueuedCount, len(self._queue))
+            commandsToStart = self._popStartableCommands()
+        self._start(commandsToStart)
+        return command
+
+    def _popStartableCommands(self):
+        commands = []
+        while self._queue and len(self._runningCommands) < self.maxRunningCount:
+            command = self._queue.popleft()
+            self._runningCommands.add(command)
+            commands.append(command)
+        if commands: self._condition.notify_all()
+        return commands
+
+    def _start(self, commands):
+        for command in commands:
+            command.startTime = time.monotonic()
+            try:
+                command.process = subprocess.Popen(command.commandLine, shell=True, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+            except Exception:
+                logger.reportException('Could not start {0}.'.format(command))
+                self._complete(command, None)
+                continue
+
+            logger.reportInfo('{0} started (pid={1}).'.format(command, command.process.pid))
+            if self.timeout != None:
+                with self._condition:
+                    command._timeoutTimer = timer.Timer(None, self.timeout, 'Timeout of {0}'.format(command), onTimeoutReached=lambda t, command=command: self._terminate(command), scheduler=self.timerScheduler)
+                    command._timeoutTimer.start()
+            self.processPump.register(command.process, command.description, onTerminated=lambda process, command=command: self._complete(command, process.returncode))
+
+    def _terminate(self, command):
+        with self._condition:
+            # The command may have completed while the timer was firing.
+            if command not in self._runningCommands: return
+            command.hasTimedOut = True
+            command._timeoutTimer = timer.Timer(None, self.killDelay, 'Kill of {0}'.format(command), onTimeoutReached=lambda t: self._signal(command, signal.SIGKILL), scheduler=self.timerScheduler)
+            command._timeoutTimer.start()
+        logger.reportWarning('{0} has not completed within {1} seconds, terminating it.'.format(command, self.timeout))
+        self._signal(command, signal.SIGTERM)
+
+    def _signal(self, command, signalNumber):
+        if command.process.returncode != None: return
+        try:
+            os.killpg(command.process.pid, signalNumber)
+        except ProcessLookupError:
+            pass # Already exited.
+
+    def _complete(self, command, exitCode):
+        """ Records the result of a command and starts the next queued ones. """
+        command.duration = time.monotonic() - command.startTime
+        command.exitCode = exitCode
+        if exitCode == 0:
+            logger.reportInfo('{0} completed in {1:.3f}s.'.format(command, command.duration))
+        else:
+            logger.reportWarning('{0} failed with exit code {1} after {2:.3f}s.'.format(command, exitCode, command.duration))
+
+        with self._condition:
+            self._runningCommands.discard(command)
+            timeoutTimer = command._timeoutTimer
+            command._timeoutTimer = None
+            self.executedCommandCount += 1
+            if exitCode != 0: self.failedCommandCount += 1
+            if command.hasTimedOut: self.timedOutCommandCount += 1
+            self.exitCodeCounts[exitCode] += 1
+            self.totalDuration += command.duration
+            self.maxDuration = max(self.maxDuration, command.duration)
+            self.history.append(command)
+            commandsToStart = self._popStartableCommands()
+            self._condition.notify_all()
+        if timeoutTimer != None: timeoutTimer.stop()
+        command._isDone.set()
+        self._start(commandsToStart)
+
+    def stop(self, timeout=None):
+        """ Waits for commands to complete, at most timeout seconds. Commands still queued afterwards are not run. """
+        with self._condition:
+            self._condition.wait_for(lambda: not self._queue and not self._runningCommands, timeout)
+            if self._queue or self._runningCommands:
+                logger.reportWarning('{0} shell commands have not completed before termination, {1} have not been started.'.format(len(self._runningCommands), len(self._queue)))
+                self._queue.clear()
+            self._isStopped = True
+            self._condition.notify_all()
+
+    def __repr__(self):
+        return 'Shell command executor ({0} running, {1} queued, peak {2}, {3} executed, {4} failed, {5} timed out, duration avg={6:.3f}s max={7:.3f}s, exit codes {8})'.format(len(self._runningCommands), len(self._queue), self.peakQueuedCount, self.executedCommandCount, self.failedCommandCount, self.timedOutCommandCount, self.averageDuration, self.maxDuration, dict(self.exitCodeCounts))
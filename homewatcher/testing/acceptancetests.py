@@ -676,6 +676,19 @@ class AcceptanceTestCase(base.TestCaseBase):
         self.changeAlarmMode('Presence', 'notify@bar.com')
         self.assertEqual(appliedModeObject.value, modeObject.value)
 
+    def testBatchedLinknxActions(self):
+        """ Checks that linknx runs every action of a single request, in order, as required by the batchActions option of the linknx service. """
+        sirenObject = self.linknx.getObject('Siren')
+        appliedModeObject = self.linknx.getObject('AppliedMode')
+        previousModeObject = self.linknx.getObject('PreviousMode')
+        sirenObject.value = False
+
+        self.linknx.executeAction('<action type="set-value" id="AppliedMode" value="3"/><action type="set-value" id="Siren" value="on"/><action type="copy-value" from="AppliedMode" to="PreviousMode"/><action type="set-value" id="Siren" value="off"/>')
+        self.waitDuring(1, 'Let linknx execute the actions.')
+        self.assertEqual(appliedModeObject.value, 3)
+        self.assertEqual(previousModeObject.value, 3)
+        self.assertFalse(sirenObject.value)
+
     def testIssue22NonRegression(self):
         daemon = self.alarmDaemon
 
@@ -700,5 +713,64 @@ class AcceptanceTestCase(base.TestCaseBase):
             self.assertFalse(problematicSensor.isEnabled, '{0} should not be enabled since it is open.'.format(problematicSensor))
         self.waitDuring(4, 'Wait for a while to make sure problematic sensor does not get enabled.', assertions=[assertNotEnabled])
 
+    def testObjectIndices(self):
+        daemon = self.alarmDaemon
+
+        self.assertEqual(daemon.getAlertByPersistenceObjectId('IntrusionPersistence'), daemon.getAlertByName('Intrusion'))
+        self.assertEqual(daemon.getAlertByPersistenceObjectId('FirePersistence'), daemon.getAlertByName('Fire'))
+        self.assertEqual(daemon.getAlertByInhibitionObjectId('IntrusionInhibition'), daemon.getAlertByName('Intrusion'))
+        self.assertRaises(Exception, daemon.getAlertByPersistenceObjectId, 'IntrusionInhibition')
+        self.assertRaises(Exception, daemon.getAlertByInhibitionObjectId, 'FirePersistence')
+        self.assertRaises(Exception, daemon.notifyWatchedObjectChanged, 'Mode')
+
+        # Each alert knows its own sensors, in the order of the configuration.
+        self.assertEqual([s.name for s in daemon.getAlertByName('Fire').sensors], ['BedroomSmokeSensor', 'KitchenSmokeSensor'])
+        self.assertEqual([s.name for s in daemon.getAlertByName('Temperature').sensors], ['OutdoorTemperature'])
+        self.assertEqual(sum(len(alert.sensors) for alert in daemon.alerts), len(daemon.sensors))
+
+    def testObjectCache(self):
+        daemon = self.alarmDaemon
+        cache = daemon.objectCache
+        entranceDoor = daemon.getSensorByName('EntranceDoorOpening')
+
+        # Values of notified objects are prefetched at startup.
+        hitCount, missCount = cache.hitCount, cache.missCount
+        for sensor in daemon.sensors:
+            sensor.watchedObject.value
+        self.assertEqual(cache.hitCount, hitCount + len(daemon.sensors))
+        self.assertEqual(cache.missCount, missCount)
+
+        # Changes of enabled objects are notified along with their value, so
+        # that reading them again does not need linknx.
+        enabledObject = self.linknx.getObject(daemon.configuration.getSensorByName('EntranceDoorOpening').enabledObjectId)
+        wasEnabled = enabledObject.value
+        missCount = cache.missCount
+        enabledObject.value = not wasEnabled
+        self.waitDuring(1, 'Let linknx notify the change.')
+        self.assertEqual(entranceDoor.isEnabled, not wasEnabled)
+        enabledObject.value = wasEnabled
+        self.waitDuring(1, 'Let linknx notify the change.')
+        self.assertEqual(entranceDoor.isEnabled, wasEnabled)
+        self.assertEqual(cache.missCount, missCount)
+        self.assertEqual(cache.uncachedReadCount, 0)
+
+        # Writes go through to linknx.
+        entranceDoor.persistenceObject.value = True
+        self.assertTrue(self.linknx.getObject(entranceDoor.persistenceObject.id).value)
+        self.assertTrue(entranceDoor.persistenceObject.value)
+        entranceDoor.persistenceObject.value = False
+        self.assertFalse(self.linknx.getObject(entranceDoor.persistenceObject.id).value)
+
+        # Changes notified by linknx are read again.
+        entranceDoor.watchedObject.value = True
+        self.waitDuring(1, 'Let linknx notify the change.')
+        self.assertTrue(entranceDoor.isTriggered)
+        self.linknx.getObject(entranceDoor.watchedObjectId).value = False
+        self.waitDuring(1, 'Let linknx notify the change.')
+        missCount = cache.missCount
+        self.assertFalse(entranceDoor.watchedObject.value)
+        self.assertFalse(entranceDoor.isTriggered)
+        self.assertEqual(cache.missCount, missCount)
+
 if __name__ == '__main__':
     unittest.main()
@@ -24,7 +24,7 @@ import sys
 sys.path.append('../')
 from pyknx import logger, linknx, configurator
 from pyknx.communicator import Communicator
-from homewatcher import configuration
+from homewatcher import configuration, contexthandlers, timer, executor
 from homewatcher.testing import base
 import logging
 from homewatcher.sensor import *
@@ -44,12 +44,22 @@ class ActionTestCase(base.TestCaseBase):
     class LinknxMock(object):
         def __init__(self):
             self.actionXml = None
+            self.requestCount = 0
         def executeAction(self, actionXml):
             self.actionXml = actionXml
+            self.requestCount += 1
 
     class DaemonMock(object):
         def __init__(self):
             self.linknx = ActionTestCase.LinknxMock()
+            self.timerScheduler = timer.TimerScheduler()
+            self.actionExecutor = executor.ActionExecutor(workerCount=1)
+            self.outbox = None
+            self.shellExecutor = None
+            self.batchesLinknxActions = False
+            self.emailXml = None
+        def sendEmail(self, actionXml):
+            self.emailXml = actionXml
 
     def setUp(self):
         base.TestCaseBase.setUp(self, linknxConfFile=None, usesCommunicator=False)
@@ -68,7 +78,141 @@ class ActionTestCase(base.TestCaseBase):
         action = ShellCommandAction(daemonMock, actionConfig)
         action.execute(None)
 
-        self.assertEqual('<?xml version="1.0" ?><action cmd="fooCommand &quot;argument1&quot;" type="shell-cmd"/>', daemonMock.linknx.actionXml.toxml())
+        self.assertEqual('<action type="shell-cmd" cmd="fooCommand &quot;argument1&quot;"/>', daemonMock.linknx.actionXml)
+
+    def testSendEmailAction(self):
+        logger.reportInfo('\n\n*********INITIALIZE testSendEmailAction********************')
+
+        # Configure action.
+        actionConfigXml = xdm.parseString('<action type="send-email" to="foo@bar.com">\n\t<subject>Subject &amp; <br/>more</subject>\n\t<body>First line<br/>Second &lt;line&gt;</body>\n</action>')
+        actionConfig = configuration.Action.fromXML(actionConfigXml.getElementsByTagName('action')[0])
+
+        # Mock daemon.
+        daemonMock = ActionTestCase.DaemonMock()
+
+        # Create action and execute it twice, to make sure its template is not
+        # altered.
+        action = SendEmailAction(daemonMock, actionConfig)
+        for i in range(2):
+            action.execute(None)
+
+            # Parameterized parts are spliced into the XML, the body replacing
+            # the inner text of the action.
+            self.assertTrue(daemonMock.emailXml.startswith('<action type="send-email" to="foo@bar.com" subject="Subject &amp; &#10;more">First line\nSecond &lt;line&gt;\n\n---'), daemonMock.emailXml)
+            actionNode = xdm.parseString(daemonMock.emailXml).documentElement
+            self.assertEqual(actionNode.getAttribute('subject'), 'Subject & \nmore')
+            self.assertEqual(len(actionNode.childNodes), 1)
+
+    def testUnknownContextHandler(self):
+        logger.reportInfo('\n\n*********INITIALIZE testUnknownContextHandler********************')
+
+        # Parameterizable strings are compiled when the action is created,
+        # hence before it is ever executed.
+        actionConfigXml = xdm.parseString('<action type="shell-cmd"><cmd>echo <context type="foo.unknown"/></cmd></action>')
+        actionConfig = configuration.Action.fromXML(actionConfigXml.getElementsByTagName('action')[0])
+        with self.assertRaisesRegex(Exception, 'No context handler named foo.unknown is registered.'):
+            ShellCommandAction(ActionTestCase.DaemonMock(), actionConfig)
+
+    class CountingContextHandler(contexthandlers.ContextHandler):
+        __contextHandlerName__ = 'test.counting'
+        analyzeCount = 0
+
+        def analyzeContext(self, context):
+            ActionTestCase.CountingContextHandler.analyzeCount += 1
+            return '{0}:{1}'.format(context, self.xmlConfig.getAttribute('suffix'))
+
+    def testRenderContext(self):
+        logger.reportInfo('\n\n*********INITIALIZE testRenderContext********************')
+        contexthandlers.ContextHandlerFactory.getInstance().registerHandler(ActionTestCase.CountingContextHandler)
+
+        # Configure actions that share some of their placeholders.
+        def makeAction(cmd):
+            actionConfigXml = xdm.parseString('<action type="shell-cmd"><cmd>{0}</cmd></action>'.format(cmd))
+            return ShellCommandAction(daemonMock, configuration.Action.fromXML(actionConfigXml.getElementsByTagName('action')[0]))
+        daemonMock = ActionTestCase.DaemonMock()
+        actions = [makeAction('echo <context type="test.counting" suffix="a"/>'), makeAction('echo <context type="test.counting" suffix="a"/> <context type="test.counting" suffix="b"/>')]
+
+        # Handlers are analyzed once per distinct parameters and context.
+        ActionTestCase.CountingContextHandler.analyzeCount = 0
+        renderContext = contexthandlers.RenderContext()
+        for context in ('foo', 'bar'):
+            for action in actions:
+                action.prepare(context, renderContext)()
+            self.assertEqual(daemonMock.linknx.actionXml, '<action type="shell-cmd" cmd="echo {0}:a {0}:b"/>'.format(context))
+        self.assertEqual(ActionTestCase.CountingContextHandler.analyzeCount, 4)
+        self.assertEqual(renderContext.hitCount, 2)
+
+        # Without render context, nothing is memoized.
+        for action in actions:
+            action.execute('foo')
+        self.assertEqual(ActionTestCase.CountingContextHandler.analyzeCount, 7)
+
+    def testCoalescedEvent(self):
+        logger.reportInfo('\n\n*********INITIALIZE testCoalescedEvent********************')
+        contexthandlers.ContextHandlerFactory.getInstance().registerHandler(ActionTestCase.CountingContextHandler)
+
+        # Configure an event whose firings are coalesced.
+        eventConfig = configuration.AlertEvent()
+        eventConfig.type = configuration.AlertEvent.Type.SENSOR_JOINED
+        actionConfigXml = xdm.parseString('<action type="shell-cmd"><cmd>echo <context type="test.counting" suffix="a"/></cmd></action>')
+        eventConfig.actions = [configuration.Action.fromXML(actionConfigXml.getElementsByTagName('action')[0])]
+        eventConfig.isSynchronous = False
+        eventConfig.coalescingDelay = 0.5
+        daemonMock = ActionTestCase.DaemonMock()
+        eventManager = EventManager(daemonMock, 'Test')
+        eventManager.addEvent(eventConfig)
+
+        # Fire several times within the window: nothing is executed until the
+        # end of the window.
+        ActionTestCase.CountingContextHandler.analyzeCount = 0
+        for context in ('first', 'second', 'third'):
+            eventManager.fireEvent(eventConfig.type, 'Test event', context)
+        self.assertTrue(eventManager.isCoalescing(eventConfig.type))
+        time.sleep(0.2)
+        self.assertIsNone(daemonMock.linknx.actionXml)
+
+        # A single execution occurs at the end of the window.
+        time.sleep(0.6)
+        daemonMock.actionExecutor.stop()
+        self.assertFalse(eventManager.isCoalescing(eventConfig.type))
+        self.assertEqual(daemonMock.linknx.actionXml, '<action type="shell-cmd" cmd="echo first:a"/>')
+        self.assertEqual(ActionTestCase.CountingContextHandler.analyzeCount, 1)
+
+        # Pending events are executed immediately when flushed.
+        daemonMock.linknx.actionXml = None
+        eventManager.fireEvent(eventConfig.type, 'Test event', 'flushed')
+        eventManager.flush()
+        self.assertEqual(daemonMock.linknx.actionXml, '<action type="shell-cmd" cmd="echo flushed:a"/>')
+        time.sleep(0.7)
+        self.assertEqual(ActionTestCase.CountingContextHandler.analyzeCount, 2)
+
+    def testBatchedLinknxActions(self):
+        logger.reportInfo('\n\n*********INITIALIZE testBatchedLinknxActions********************')
+
+        # Configure an event with several actions delegated to linknx, split by
+        # an email.
+        eventConfig = configuration.AlertEvent()
+        eventConfig.type = configuration.AlertEvent.Type.ALERT_ACTIVATED
+        actionsXml = ['<action type="set-value" id="Siren" value="on"/>', '<action type="send-sms" id="+33600000000"><value>Alert!</value></action>', '<action type="send-email" to="foo@bar.com" subject="Alert">Alert!</action>', '<action type="shell-cmd" cmd="echo Alert"/>', '<action type="set-value" id="Light" value="on"/>']
+        eventConfig.actions = [configuration.Action.fromXML(xdm.parseString(actionXml).documentElement) for actionXml in actionsXml]
+        eventConfig.isSynchronous = True
+        eventConfig.coalescingDelay = None
+        daemonMock = ActionTestCase.DaemonMock()
+        eventManager = EventManager(daemonMock, 'Test')
+        eventManager.addEvent(eventConfig)
+
+        # Each action is sent in its own request unless batching is enabled.
+        eventManager.fireEvent(eventConfig.type, 'Test event', None)
+        self.assertEqual(daemonMock.linknx.requestCount, 4)
+        self.assertEqual(daemonMock.linknx.actionXml, '<action type="set-value" id="Light" value="on"/>')
+
+        # Actions before and after the email are sent in one request each.
+        daemonMock.linknx.requestCount = 0
+        daemonMock.batchesLinknxActions = True
+        eventManager.fireEvent(eventConfig.type, 'Test event', None)
+        self.assertEqual(daemonMock.linknx.requestCount, 2)
+        self.assertEqual(daemonMock.linknx.actionXml, '<action type="shell-cmd" cmd="echo Alert"/><action type="set-value" id="Light" value="on"/>')
+        self.assertTrue(daemonMock.emailXml.startswith('<action type="send-email" to="foo@bar.com" subject="Alert">Alert!'), daemonMock.emailXml)
 
 if __name__ == '__main__':
     unittest.main()
@@ -30,6 +30,7 @@ import inspect
 import stat
 import pwd, grp
 import shutil
+import xml.dom.minidom
 
 from pyknx import logger, linknx
 from pyknx.testing import base
@@ -47,16 +48,19 @@ class TestCaseBase(base.WithLinknxTestCase):
             self.test = test
 
         def executeAction(self, actionXml):
-            logger.reportDebug('executeActionMock: {0}'.format(actionXml.toxml()))
-            actionNode = actionXml.getElementsByTagName('action')[0]
-            if actionNode.getAttribute('type') == 'shell-cmd':
-                self.test.assertIsNone(self.test.shellCmdInfo, 'An unconsumed shell command is about to be deleted. It is likely to be an unexpected shell command. Details are {0}'.format(self.test.shellCmdInfo))
-                self.test.shellCmdInfo = {'action' : actionXml, 'date' : time.ctime()}
-                logger.reportInfo('executeAction mock received {0}'.format(self.test.shellCmdInfo))
+            logger.reportDebug('executeActionMock: {0}'.format(actionXml))
+            # Several actions may be batched in a single request.
+            for actionNode in xml.dom.minidom.parseString('<actions>{0}</actions>'.format(actionXml)).getElementsByTagName('action'):
+                if actionNode.getAttribute('type') == 'shell-cmd':
+                    actionDocument = xml.dom.minidom.parseString(actionNode.toxml())
+                    self.test.assertIsNone(self.test.shellCmdInfo, 'An unconsumed shell command is about to be deleted. It is likely to be an unexpected shell command. Details are {0}'.format(self.test.shellCmdInfo))
+                    self.test.shellCmdInfo = {'action' : actionDocument, 'date' : time.ctime()}
+                    logger.reportInfo('executeAction mock received {0}'.format(self.test.shellCmdInfo))
             self.realExecute(actionXml)
 
     def sendEmailMock(self, actionXml):
-        logger.reportDebug('sendEmailMock: {0}'.format(actionXml.toxml()))
+        logger.reportDebug('sendEmailMock: {0}'.format(actionXml))
+        actionXml = xml.dom.minidom.parseString(actionXml)
         self.assertIsNone(self.emailInfo, 'An unconsumed email is about to be deleted. It is likely to be an unexpected email. Details are {0}'.format(self.emailInfo))
         self.emailInfo = {'action' : actionXml, 'date' : time.ctime()}
         logger.reportInfo('sendEmail mock received {0}'.format(self.emailInfo))
@@ -77,9 +81,10 @@ class TestCaseBase(base.WithLinknxTestCase):
         self.assertEqual(actionNode.getAttribute('to'), recipient)
         self.assertEqual(actionNode.getAttribute('subject'), subject)
         if body != None:
-            # Check first child only, so that we do not take the footer which is
-            # not significant enough to deserve testing.
-            self.assertEqual(actionNode.childNodes[0].data, body)
+            # Strip the footer which is not significant enough to deserve
+            # testing.
+            text = actionNode.childNodes[0].data
+            self.assertEqual(text[:text.rfind('\n\n---')], body)
 
         if consumesEmail: self.emailInfo = None
 
@@ -0,0 +1,691 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2014-2017 Cyrille Defranoux
+#
+# This file is part of Homewatcher.
+#
+# Homewatcher is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Homewatcher is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Homewatcher. If not, see <http://www.gnu.org/licenses/>.
+#
+# For any question, feature requests or bug reports, feel free to contact me at:
+# knx at aminate dot net
+
+"""
+Micro-benchmarks for the performance-sensitive parts of Homewatcher.
+
+Unlike unit tests, benchmarks do not assert anything: they print timings that can be compared between revisions. They do
+not require linknx to be running.
+"""
+
+from homewatcher import ensurepyknx
+
+from homewatcher import timer, sensor, configuration, alarm, contexthandlers, executor, outbox, mailer, uploader, processpump, shellexecutor
+from homewatcher.testing import servers
+import argparse
+import collections
+import ftplib
+import gc
+import os
+import random
+import shutil
+import smtplib
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+import xml.dom.minidom
+
+BENCHMARKS = collections.OrderedDict() # Benchmark functions indexed by name.
+
+def benchmark(function):
+    """ Decorator that registers a benchmark function. """
+    BENCHMARKS[function.__name__] = function
+    return function
+
+def measure(function, repeatCount=1):
+    """ Returns the best duration of function over repeatCount calls, in seconds. """
+    bestDuration = None
+    for i in range(repeatCount):
+        startTime = time.perf_counter()
+        function()
+        duration = time.perf_counter() - startTime
+        if bestDuration == None or duration < bestDuration:
+            bestDuration = duration
+    return bestDuration
+
+def report(name, duration, operationCount=None):
+    if operationCount:
+        print('{0:<60} {1:>10.2f} ms {2:>10.2f} us/op'.format(name, duration * 1e3, duration * 1e6 / operationCount))
+    else:
+        print('{0:<60} {1:>10.2f} ms'.format(name, duration * 1e3))
+
+@benchmark
+def timerStartAndCancel(timerCount=10000):
+    """ Starts then cancels many timers that share the same few delays, as when a mode change enables every sensor. """
+    for queueName, makeQueue in (('heap', timer.HeapTimerQueue), ('wheel', timer.TimerWheelQueue)):
+        # Raw queue operations, without the overhead of timers and logging.
+        queue = makeQueue()
+        keys = [object() for i in range(timerCount)]
+        now = time.monotonic()
+        def addAll():
+            for i, key in enumerate(keys): queue.add(key, now + (0, 30, 60)[i % 3] + 1)
+        def removeAll():
+            for key in keys: queue.remove(key)
+        report('Queue {0} deadlines ({1})'.format(timerCount, queueName), measure(addAll), timerCount)
+        report('Unqueue {0} deadlines ({1})'.format(timerCount, queueName), measure(removeAll), timerCount)
+
+        # Whole timers, driven by a running scheduler.
+        scheduler = timer.TimerScheduler(makeQueue())
+        timers = [timer.Timer(None, (0, 30, 60)[i % 3] + 1, 'Benchmark timer', onTimeoutReached=None, scheduler=scheduler) for i in range(timerCount)]
+
+        def startAll():
+            for t in timers: t.start()
+        def cancelAll():
+            for t in timers: t.stop()
+
+        report('Start {0} timers ({1})'.format(timerCount, queueName), measure(startAll), timerCount)
+        report('Cancel {0} timers ({1})'.format(timerCount, queueName), measure(cancelAll), timerCount)
+
+        # Let the scheduler terminate the cancelled timers.
+        while scheduler.pendingTimerCount:
+            time.sleep(0.01)
+
+class BenchmarkDaemon(object):
+    """ Minimal stand-in for alarm.Daemon that only provides what objects under benchmark need. """
+    def __init__(self):
+        self.sensors = {}
+
+    def getSensorByName(self, sensorName):
+        return self.sensors[sensorName]
+
+class BenchmarkSensor(object):
+    def __init__(self, daemon, name):
+        self.daemon = daemon
+        self.name = name
+        self.isTriggered = False
+        daemon.sensors[name] = self
+
+def makeRandomCriterionConfig(sensorNames, depth, childCount):
+    """ Makes a criterion config whose AND and OR operators alternate down to depth. """
+    if depth == 0: return configuration.ActivationCriterion.makeSensorCriterion(random.choice(sensorNames), random.choice((False, True)))
+    criterion = configuration.ActivationCriterion.makeBooleanCriterion(configuration.ActivationCriterion.Type.AND if depth % 2 else configuration.ActivationCriterion.Type.OR)
+    criterion.children = [makeRandomCriterionConfig(sensorNames, depth - 1, childCount) for i in range(childCount)]
+    return criterion
+
+def interpretCriterion(criterion):
+    """ Evaluates a criterion by walking its tree, as Homewatcher did before criteria got compiled. """
+    if isinstance(criterion, sensor.SensorActivationCriterion):
+        return criterion.daemon.getSensorByName(criterion.config.sensorName).isTriggered == criterion.config.whenTriggered
+    for child in criterion.children:
+        if criterion.config.type == configuration.ActivationCriterion.Type.AND:
+            if not interpretCriterion(child): return False
+        elif criterion.config.type == configuration.ActivationCriterion.Type.OR:
+            if interpretCriterion(child): return True
+    return criterion.config.type == configuration.ActivationCriterion.Type.AND
+
+@benchmark
+def activationCriterionEvaluation(sensorCount=1000, criterionCount=100, depth=6, childCount=3, evaluationCount=20):
+    """ Evaluates deep criteria that depend on a random selection of sensors. """
+    random.seed(0)
+    daemon = BenchmarkDaemon()
+    sensors = [BenchmarkSensor(daemon, 'Sensor{0}'.format(i)) for i in range(sensorCount)]
+    sensorNames = [s.name for s in sensors]
+    criteria = [sensor.ActivationCriterion.makeNew(random.choice(sensors), makeRandomCriterionConfig(sensorNames, depth, childCount)) for i in range(criterionCount)]
+
+    def randomizeTriggers():
+        for s in sensors: s.isTriggered = random.random() < 0.5
+    def interpretAll():
+        for i in range(evaluationCount):
+            randomizeTriggers()
+            for criterion in criteria: interpretCriterion(criterion)
+    def evaluateAll():
+        for i in range(evaluationCount):
+            randomizeTriggers()
+            for criterion in criteria: criterion.isValid()
+    def compileAll():
+        for criterion in criteria: criterion.compile()
+
+    # Both approaches must agree.
+    for i in range(evaluationCount):
+        randomizeTriggers()
+        for criterion in criteria:
+            if interpretCriterion(criterion) != criterion.isValid(): raise Exception('Compiled criterion disagrees with interpreted one.')
+
+    operationCount = criterionCount * evaluationCount
+    report('Compile {0} criteria of depth {1}'.format(criterionCount, depth), measure(compileAll), criterionCount)
+    report('Interpret {0} criteria (tree walk)'.format(operationCount), measure(interpretAll, 3), operationCount)
+    report('Evaluate {0} criteria (compiled)'.format(operationCount), measure(evaluateAll, 3), operationCount)
+    report('Randomize triggers only (included above)', measure(randomizeTriggers, 3) * evaluationCount, operationCount)
+
+class BenchmarkAlert(object):
+    def __init__(self):
+        self.persistenceObjectId = None
+        self.inhibitionObjectId = None
+        self.sensors = ()
+
+    def setSensors(self, sensors):
+        self.sensors = tuple(sensors)
+
+class BenchmarkWatchingSensor(object):
+    def __init__(self, watchedObjectId, alert):
+        self.watchedObjectId = watchedObjectId
+        self.alert = alert
+        self.notificationCount = 0
+
+    def notifyWatchedObjectChanged(self):
+        self.notificationCount += 1
+
+def scanSensorsForObject(daemon, objectId):
+    """ Dispatches a change the way Homewatcher did before sensors got indexed by watched object. """
+    relatedSensors = [sensor for sensor in daemon.sensors if sensor.watchedObjectId == objectId]
+    for sensor in relatedSensors:
+        sensor.notifyWatchedObjectChanged()
+
+@benchmark
+def watchedObjectDispatch(sensorCounts=(10, 100, 1000, 10000), notificationCount=10000):
+    """ Dispatches changes of watched objects to the sensors that watch them. """
+    random.seed(0)
+    for sensorCount in sensorCounts:
+        # Bypass Daemon.__init__ that requires linknx.
+        daemon = object.__new__(alarm.Daemon)
+        alert = BenchmarkAlert()
+        daemon._sensors = {'Sensor{0}'.format(i) : BenchmarkWatchingSensor('Object{0}'.format(i), alert) for i in range(sensorCount)}
+        daemon._alerts = {'Alert' : alert}
+        daemon._indexObjects()
+        objectIds = [random.choice(list(daemon._sensors.values())).watchedObjectId for i in range(notificationCount)]
+
+        def scanAll():
+            for objectId in objectIds: scanSensorsForObject(daemon, objectId)
+        def dispatchAll():
+            for objectId in objectIds: daemon.notifyWatchedObjectChanged(objectId)
+
+        report('Dispatch to {0} sensors (linear scan)'.format(sensorCount), measure(scanAll), notificationCount)
+        report('Dispatch to {0} sensors (indexed)'.format(sensorCount), measure(dispatchAll), notificationCount)
+
+def rebuildActionXml(action, context, parameterizedTagName):
+    """ Interprets the parameterizable block of an action the way Homewatcher did before actions got precompiled. """
+    actionXml = xml.dom.minidom.Document()
+    actionXml.appendChild(actionXml.importNode(action.config.linknxActionXml, True))
+    linknxActionXml = xml.dom.minidom.Document()
+    linknxActionXml.appendChild(linknxActionXml.importNode(actionXml.childNodes[0], True))
+    actionXmlNode = linknxActionXml.getElementsByTagName('action')[0]
+    for childNode in actionXmlNode.childNodes:
+        if childNode.nodeType == xml.dom.minidom.Element.ELEMENT_NODE and childNode.tagName == parameterizedTagName:
+            actionXmlNode.setAttribute(parameterizedTagName, action.parseParameterizableString(childNode, context))
+            actionXmlNode.removeChild(childNode)
+    return actionXmlNode.toxml()
+
+@benchmark
+def actionPreparation(fireCount=10000):
+    """ Prepares parameterizable actions as when their event is fired. """
+    actionConfigXml = xml.dom.minidom.parseString('<action type="shell-cmd"><cmd>echo "Alarm!<br/>Intrusion detected by the sensors of the ground floor"</cmd></action>')
+    action = alarm.ShellCommandAction(None, configuration.Action.fromXML(actionConfigXml.documentElement))
+
+    def rebuildAll():
+        for i in range(fireCount): rebuildActionXml(action, None, 'cmd')
+    def prepareAll():
+        for i in range(fireCount): action.prepare(None)
+
+    report('Prepare {0} shell commands (minidom copies)'.format(fireCount), measure(rebuildAll, 3), fireCount)
+    report('Prepare {0} shell commands (precompiled)'.format(fireCount), measure(prepareAll, 3), fireCount)
+
+def scanEventsForType(eventManager, eventType):
+    """ Looks for the events of a type the way Homewatcher did before events got indexed by type. """
+    return [event for event in eventManager.eventConfigs if event.type == eventType]
+
+@benchmark
+def unsubscribedEventFiring(eventTypeCount=6, fireCount=100000):
+    """ Fires alert events that have no action configured, as each alert transition does for most of its events. """
+    allTypes = configuration.AlertEvent.Type.getAll()
+    eventManager = alarm.EventManager(None, 'Benchmark')
+    for eventType in allTypes[:eventTypeCount]:
+        event = configuration.AlertEvent()
+        event.type = eventType
+        event.actions = [configuration.Action.fromXML(xml.dom.minidom.parseString('<action type="set-value" id="Object" value="on"/>').documentElement)]
+        event.isSynchronous = False
+        event.coalescingDelay = None
+        eventManager.addEvent(event)
+    unsubscribedTypes = allTypes[eventTypeCount:]
+    firedTypes = [unsubscribedTypes[i % len(unsubscribedTypes)] for i in range(fireCount)]
+
+    def scanAll():
+        for eventType in firedTypes: scanEventsForType(eventManager, eventType)
+    def fireAll():
+        for eventType in firedTypes: eventManager.fireEvent(eventType, 'Benchmark event', None)
+
+    report('Fire {0} unsubscribed events (linear scan)'.format(fireCount), measure(scanAll, 3), fireCount)
+    report('Fire {0} unsubscribed events (indexed)'.format(fireCount), measure(fireAll, 3), fireCount)
+
+def interpretParameterizableString(parameterizedStringXml, context):
+    """ Renders a parameterizable string the way Homewatcher did before such strings got compiled. """
+    text = ''
+    for childNode in parameterizedStringXml.childNodes:
+        if childNode.nodeType == childNode.ELEMENT_NODE:
+            if childNode.tagName == 'br':
+                text += '\n'
+            elif childNode.tagName == 'context':
+                text += contexthandlers.ContextHandlerFactory.getInstance().makeHandler(childNode).analyzeContext(context)
+        elif childNode.nodeType == childNode.TEXT_NODE:
+            text += childNode.data
+    return text
+
+@benchmark
+def emailBodyRendering(sensorCounts=(100, 500), renderCount=200, actionsPerFiring=4):
+    """ Renders the body of emails that list the sensors of an alert. """
+    bodyXml = xml.dom.minidom.parseString('<body>Alert <context type="alert.name"/>!<br/>Sensors in alert:<br/><context type="alert.sensors-status" inPrealert="false" inPause="false" format="bulleted"/><br/>Sensors in prealert:<br/><context type="alert.sensors-status" inAlert="false" inPause="false" format="inline"/></body>').documentElement
+    for sensorCount in sensorCounts:
+        # Bypass Alert.__init__ that requires a daemon.
+        alert = object.__new__(alarm.Alert)
+        alert._config = configuration.Alert()
+        alert._config.name = 'Intrusion'
+        alert._sensorsInAlert = set('Sensor{0}'.format(i) for i in range(0, sensorCount, 2))
+        alert._sensorsInPrealert = set('Sensor{0}'.format(i) for i in range(1, sensorCount, 2))
+        body = contexthandlers.ParameterizableString(bodyXml)
+        if body.render(alert) != interpretParameterizableString(bodyXml, alert): raise Exception('Compiled string disagrees with interpreted one.')
+
+        def interpretAll():
+            for i in range(renderCount): interpretParameterizableString(bodyXml, alert)
+        def renderAll():
+            for i in range(renderCount): body.render(alert)
+        def renderMemoizedAll():
+            # Several actions of the same firing use the same placeholders.
+            for i in range(renderCount // actionsPerFiring):
+                renderContext = contexthandlers.RenderContext()
+                for j in range(actionsPerFiring): body.render(alert, renderContext)
+
+        report('Render {0} bodies listing {1} sensors (interpreted)'.format(renderCount, sensorCount), measure(interpretAll, 3), renderCount)
+        report('Render {0} bodies listing {1} sensors (compiled)'.format(renderCount, sensorCount), measure(renderAll, 3), renderCount)
+        report('Render {0} bodies listing {1} sensors ({2} per render context)'.format(renderCount, sensorCount, actionsPerFiring), measure(renderMemoizedAll, 3), renderCount)
+
+def makeSyntheticConfigXml(sensorCount):
+    """ Makes the XML of a configuration with sensorCount opening sensors split into two alerts, all of them involved in the Away mode. """
+    sensors = ['<sensor name="Opening{0}" type="{1}" location="Room{0}"/>'.format(i, 'IntrusionSensor' if i % 2 else 'TamperSensor') for i in range(sensorCount)]
+    sensorNames = ['<sensor>Opening{0}</sensor>'.format(i) for i in range(sensorCount)]
+    return """<?xml version="1.0" ?>
+<config>
+    <services>
+        <linknx host="localhost" port="1030" ignoreEmail="true"/>
+    </services>
+    <modes objectId="Mode">
+        <mode name="Presence" value="1"/>
+        <mode name="Away" value="2">{sensorNames}</mode>
+    </modes>
+    <alerts>
+        <alert name="Intrusion" persistenceObjectId="IntrusionPersistence" inhibitionObjectId="IntrusionInhibition"/>
+        <alert name="Tamper" persistenceObjectId="TamperPersistence"/>
+    </alerts>
+    <sensors>
+        <sensor isClass="true" name="OpeningSensor" type="boolean" watchedObjectId="OpeningTrigger{{location}}" enabledObjectId="OpeningEnabled{{location}}" persistenceObjectId="OpeningPersistence{{location}}" activationDelay="1" prealertDuration="2" alertDuration="2"/>
+        <sensor isClass="true" name="IntrusionSensor" type="OpeningSensor" alert="Intrusion"/>
+        <sensor isClass="true" name="TamperSensor" type="OpeningSensor" alert="Tamper"/>
+        {sensors}
+    </sensors>
+</config>""".format(sensors='\n        '.join(sensors), sensorNames=''.join(sensorNames))
+
+class BenchmarkLinknxObject(object):
+    def __init__(self, linknx, id):
+        self.linknx = linknx
+        self.id = id
+        self._value = 1 if id == 'Mode' else False
+
+    @property
+    def value(self):
+        return self.linknx.getObjects(objectIds=(self.id,)).getValues()[self.id]
+
+    @value.setter
+    def value(self, objValue):
+        self.linknx.simulateRoundTrip()
+        self._value = objValue
+
+    def convertValueToString(self, objValue):
+        return str(objValue)
+
+    def convertStringToValue(self, valueString):
+        return valueString == 'True' if valueString in ('True', 'False') else int(valueString)
+
+class BenchmarkLinknxObjectCollection(list):
+    def __init__(self, linknx, objects):
+        list.__init__(self, objects)
+        self.linknx = linknx
+
+    def getValues(self):
+        self.linknx.simulateRoundTrip()
+        return {o.id : o._value for o in self}
+
+class BenchmarkLinknx(object):
+    """ Stand-in for pyknx.linknx.Linknx that simulates the latency of each request. """
+    def __init__(self, roundTripDuration):
+        self.roundTripDuration = roundTripDuration
+        self.roundTripCount = 0
+        self._objects = {}
+
+    def simulateRoundTrip(self):
+        self.roundTripCount += 1
+        time.sleep(self.roundTripDuration)
+
+    def getObject(self, id):
+        if id is None: return None
+        obj = self._objects.get(id)
+        if obj is None:
+            obj = BenchmarkLinknxObject(self, id)
+            self._objects[id] = obj
+        return obj
+
+    def getObjects(self, objectIds):
+        return BenchmarkLinknxObjectCollection(self, [self.getObject(id) for id in objectIds])
+
+    def executeAction(self, actionXml):
+        self.simulateRoundTrip()
+
+class BenchmarkCommunicator(object):
+    def __init__(self, linknx):
+        self.linknx = linknx
+
+class UnprefetchedDaemon(alarm.Daemon):
+    """ Daemon that reads objects one by one, as Homewatcher did before values got prefetched. """
+    def _prefetchObjectValues(self):
+        pass
+
+@benchmark
+def daemonStartup(sensorCount=2000, roundTripDuration=0.0005):
+    """ Starts a daemon on a large configuration with a linknx stub that simulates request latency. """
+    configXml = makeSyntheticConfigXml(sensorCount)
+    for label, daemonClass in (('one object at a time', UnprefetchedDaemon), ('prefetched', alarm.Daemon)):
+        linknx = BenchmarkLinknx(roundTripDuration)
+        config = configuration.Configuration.parseString(configXml)
+        config.resolve()
+        daemons = []
+        report('Start daemon with {0} sensors ({1})'.format(sensorCount, label), measure(lambda: daemons.append(daemonClass(BenchmarkCommunicator(linknx), config))), sensorCount)
+        print('    {0} requests to linknx'.format(linknx.roundTripCount))
+        roundTripCount = linknx.roundTripCount
+        report('Read enabled state of {0} sensors ({1})'.format(sensorCount, label), measure(lambda: [sensor.isEnabled for sensor in daemons[0].sensors]), sensorCount)
+        print('    {0} requests to linknx'.format(linknx.roundTripCount - roundTripCount))
+        daemons[0].terminate()
+
+@benchmark
+def outboxPosting(threadCount=8, postCount=100):
+    """ Posts actions to the outbox from several threads, as when several alerts fire at once. """
+    journalPath = tempfile.mkstemp(suffix='.journal')[1]
+    try:
+        actionExecutor = executor.ActionExecutor()
+        postbox = outbox.Outbox(journalPath, lambda target, payload: None, actionExecutor, timer.TimerScheduler())
+        postbox.open()
+        def postAll():
+            def postMany(threadIndex):
+                for i in range(postCount): postbox.post('Queue {0}'.format(threadIndex), [('linknx', '<action type="set-value" id="Siren" value="on"/>', 'Action {0}'.format(i))])
+            posters = [threading.Thread(target=postMany, args=(i,)) for i in range(threadCount)]
+            for poster in posters: poster.start()
+            for poster in posters: poster.join()
+        report('Post {0} actions from {1} threads'.format(threadCount * postCount, threadCount), measure(postAll), threadCount * postCount)
+        actionExecutor.stop()
+        postbox.close()
+        print('    {0}'.format(postbox))
+    finally:
+        os.remove(journalPath)
+
+def sendEmailOverNewConnection(host, port, fromAddress, email):
+    """ Former way of sending emails natively: one SMTP connection per email. """
+    smtp = smtplib.SMTP(host=host, port=port)
+    smtp.sendmail(fromAddress, email.toAddresses, email.toMIME(fromAddress))
+    smtp.quit()
+
+@benchmark
+def emailBurst(threadCount=4, emailCount=50):
+    """ Sends a burst of emails from several action workers, as when several alerts fire at once. """
+    server = servers.SMTPServerStub().start()
+    try:
+        emails = [mailer.Email(['alert@foo.com'], 'Alert {0}'.format(i), 'Sensors in alert:\n - Opening{0}'.format(i)) for i in range(emailCount)]
+        def sendAll(send):
+            def sendMany(threadIndex):
+                for email in emails[threadIndex::threadCount]: send(email)
+            senders = [threading.Thread(target=sendMany, args=(i,)) for i in range(threadCount)]
+            for sender in senders: sender.start()
+            for sender in senders: sender.join()
+        report('Send {0} emails from {1} threads (one connection each)'.format(emailCount, threadCount), measure(lambda: sendAll(lambda email: sendEmailOverNewConnection('127.0.0.1', server.port, 'homewatcher@foo.com', email)), 3), emailCount)
+        smtpMailer = mailer.SMTPMailer('127.0.0.1', server.port, 'homewatcher@foo.com', sessionCount=2)
+        report('Send {0} emails from {1} threads (pooled sessions)'.format(emailCount, threadCount), measure(lambda: sendAll(smtpMailer.send), 3), emailCount)
+        smtpMailer.close()
+        print('    {0}'.format(smtpMailer))
+    finally:
+        server.stop()
+
+def uploadOverNewConnection(host, port, path):
+    """ Former way of uploading captures: one thread, with a connection per batch of files. """
+    connection = ftplib.FTP()
+    connection.connect(host=host, port=port)
+    connection.login()
+    with open(path, 'rb') as localFile:
+        connection.storbinary('STOR {0}'.format(os.path.basename(path)), localFile)
+    connection.quit()
+
+@benchmark
+def snapshotUpload(fileCount=40, fileSize=256 * 1024, serverDelay=0.005):
+    """ Uploads a burst of camera snapshots to a server that takes a few milliseconds to store each file. """
+    server = servers.FTPServerStub(delay=serverDelay).start()
+    localDirectory = tempfile.mkdtemp()
+    try:
+        paths = []
+        for i in range(fileCount):
+            paths.append(os.path.join(localDirectory, 'snapshot{0}.jpg'.format(i)))
+            with open(paths[-1], 'wb') as f: f.write(os.urandom(fileSize))
+        report('Upload {0} files of {1} kB (sequential, new connection)'.format(fileCount, fileSize // 1024), measure(lambda: [uploadOverNewConnection('127.0.0.1', server.port, path) for path in paths]), fileCount)
+        ftpUploader = uploader.FTPUploader('127.0.0.1', server.port, workerCount=4)
+        ftpUploader.start()
+        def uploadAll():
+            for path in paths: ftpUploader.enqueue(path)
+            with ftpUploader._condition:
+                ftpUploader._condition.wait_for(lambda: not ftpUploader._queue and ftpUploader._activeUploadCount == 0)
+        report('Upload {0} files of {1} kB (4 workers, kept connections)'.format(fileCount, fileSize // 1024), measure(uploadAll), fileCount)
+        ftpUploader.stop()
+        print('    {0}'.format(ftpUploader))
+    finally:
+        server.stop()
+        shutil.rmtree(localDirectory)
+
+def pumpWithThreadsPerStream(processes):
+    """ Former way of logging the output of children: one thread per stream, that reads lines until the end of the stream. """
+    lineCounts = []
+    def readLines(stream):
+        lineCounts.append(len([line for line in iter(stream.readline, b'')]))
+    threads = [threading.Thread(target=readLines, args=(stream,)) for process in processes for stream in (process.stdout, process.stderr)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    for process in processes: process.wait()
+    return len(threads)
+
+def pumpWithSelector(processes):
+    pump = processpump.ProcessPump()
+    for i, process in enumerate(processes): pump.register(process, 'Process {0}'.format(i), onLine=lambda streamName, line: None)
+    pump.stop()
+    return 1
+
+@benchmark
+def processOutputPumping(processCount=50, lineCount=200):
+    """ Collects the output of many short-lived children, as when a burst of events runs shell commands. """
+    command = 'i=0; while [ $i -lt {0} ]; do echo "line $i"; echo "error $i" >&2; i=$((i+1)); done'.format(lineCount)
+    for label, pump in (('thread per stream', pumpWithThreadsPerStream), ('single selector thread', pumpWithSelector)):
+        threadCounts = []
+        def runAll():
+            processes = [subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE) for i in range(processCount)]
+            threadCounts.append(pump(processes))
+        report('Pump output of {0} processes ({1})'.format(processCount, label), measure(runAll, 3), processCount)
+        print('    {0} threads'.format(threadCounts[0]))
+
+@benchmark
+def shellCommandBurst(commandCount=200, maxRunningCounts=(4, 16)):
+    """ Runs a burst of short shell commands, as when many events run a notification script at once. """
+    command = 'echo "Alert in $HOME" > /dev/null'
+    def forkAll():
+        # Former behaviour of linknx: one process per command, without limit.
+        processes = [subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE) for i in range(commandCount)]
+        for process in processes: process.communicate()
+    report('Run {0} commands (unbounded)'.format(commandCount), measure(forkAll, 3), commandCount)
+    for maxRunningCount in maxRunningCounts:
+        pump = processpump.ProcessPump()
+        shellExecutor = shellexecutor.ShellCommandExecutor(pump, timer.TimerScheduler(), maxRunningCount=maxRunningCount, maxQueuedCount=commandCount)
+        def runAll():
+            commands = [shellExecutor.run(command, 'Command {0}'.format(i)) for i in range(commandCount)]
+            for c in commands: c.wait()
+        report('Run {0} commands (at most {1} at a time)'.format(commandCount, maxRunningCount), measure(runAll, 3), commandCount)
+        shellExecutor.stop()
+        pump.stop()
+        print('    {0}'.format(shellExecutor))
+
+class LinknxStubDaemon(object):
+    def __init__(self, linknx):
+        self.linknx = linknx
+        self.timerScheduler = timer.TimerScheduler()
+        self.actionExecutor = executor.ActionExecutor()
+        self.outbox = None
+        self.shellExecutor = None
+        self.batchesLinknxActions = False
+
+    def sendEmail(self, actionXml):
+        pass
+
+@benchmark
+def linknxActionBatching(eventCount=100):
+    """ Fires events made of several linknx actions at a stub linknx server, as when an alert is activated. """
+    from pyknx import linknx
+    server = servers.LinknxServerStub().start()
+    try:
+        eventConfig = configuration.AlertEvent()
+        eventConfig.type = configuration.AlertEvent.Type.ALERT_ACTIVATED
+        actionsXml = ['<action type="set-value" id="Siren{0}" value="on"/>'.format(i) for i in range(4)] + ['<action type="send-sms" id="+33600000000" value="Alert!"/>']
+        eventConfig.actions = [configuration.Action.fromXML(xml.dom.minidom.parseString(actionXml).documentElement) for actionXml in actionsXml]
+        eventConfig.isSynchronous = False
+        eventConfig.coalescingDelay = None
+        daemon = LinknxStubDaemon(linknx.Linknx('127.0.0.1', server.port))
+        eventManager = alarm.EventManager(daemon, 'Benchmark')
+        eventManager.addEvent(eventConfig)
+
+        def fireAll():
+            actionCount = server.actionCount + eventCount * len(actionsXml)
+            for i in range(eventCount): eventManager.fireEvent(eventConfig.type, 'Benchmark event', None)
+            server.waitForActions(actionCount)
+        for label, batchesLinknxActions in (('one request per action', False), ('batched', True)):
+            daemon.batchesLinknxActions = batchesLinknxActions
+            requestCount = server.requestCount
+            report('Fire {0} events of {1} linknx actions ({2})'.format(eventCount, len(actionsXml), label), measure(fireAll), eventCount)
+            print('    {0} requests to linknx'.format(server.requestCount - requestCount))
+        daemon.actionExecutor.stop()
+    finally:
+        server.stop()
+
+@benchmark
+def configurationLoading(sensorCounts=(1000, 10000, 50000)):
+    """ Loads synthetic configuration files of increasing size, as hwdaemon, hwconf and hwresolve do on startup. """
+    directory = tempfile.mkdtemp()
+    try:
+        for sensorCount in sensorCounts:
+            filename = os.path.join(directory, 'config{0}.xml'.format(sensorCount))
+            with open(filename, 'w') as configFile:
+                configFile.write(makeSyntheticConfigXml(sensorCount))
+
+            # Building a DOM tree was only the first step of the former loader.
+            report('Build DOM tree of {0} sensors (minidom)'.format(sensorCount), measure(lambda: xml.dom.minidom.parse(filename), 3), sensorCount)
+            report('Load configuration of {0} sensors'.format(sensorCount), measure(lambda: configuration.Configuration.parseFile(filename), 3), sensorCount)
+
+            # Memory held by the loaded configuration, and at most during loading.
+            gc.collect()
+            tracemalloc.start()
+            config = configuration.Configuration.parseFile(filename)
+            gc.collect()
+            retainedSize, peakSize = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print('    {0:.1f} MB retained, {1:.1f} MB peak'.format(retainedSize / 1e6, peakSize / 1e6))
+            del config
+    finally:
+        shutil.rmtree(directory)
+
+@benchmark
+def sensorLookup(sensorCount=10000, lookupCount=10000):
+    """ Looks sensors up by name and checks their inheritance, as integrity checks do for every sensor. """
+    random.seed(0)
+    config = configuration.Configuration.parseString(makeSyntheticConfigXml(sensorCount))
+    names = ['Opening{0}'.format(random.randrange(sensorCount)) for i in range(lookupCount)]
+    sensors = [config.getSensorByName(name) for name in names]
+
+    scanCount = lookupCount // 100 # Scans are too slow to do them all.
+    def scanAll():
+        # Former way: a scan of all sensors and classes per lookup.
+        for name in names[:scanCount]: [o for o in config.sensorsAndClasses if o.name == name]
+    def lookUpAll():
+        for name in names: config.getSensorByName(name)
+    def checkInheritanceOfAll():
+        for s in sensors: config.doesSensorInherit(s, configuration.Sensor.Type.FLOAT)
+    report('Look {0} sensors up among {1} (scan)'.format(scanCount, sensorCount), measure(scanAll), scanCount)
+    report('Look {0} sensors up among {1}'.format(lookupCount, sensorCount), measure(lookUpAll, 3), lookupCount)
+    report('Check inheritance of {0} sensors'.format(lookupCount), measure(checkInheritanceOfAll, 3), lookupCount)
+
+def makeDeepHierarchyConfigXml(sensorCount, depth):
+    """ Makes the XML of a configuration whose sensors inherit from a chain of depth classes. Each class refines the activation delay for a mode of its own. """
+    classes = ['<sensor isClass="true" name="Level0" type="boolean" watchedObjectId="Trigger{location}" enabledObjectId="Enabled{location}" alert="Intrusion" prealertDuration="2" alertDuration="2" triggerValue="true"><activationDelay><value>0</value></activationDelay></sensor>']
+    classes += ['<sensor isClass="true" name="Level{0}" type="Level{1}" level{0}="{0}"><activationDelay><value mode="Mode{0}">{0}</value></activationDelay></sensor>'.format(i, i - 1) for i in range(1, depth)]
+    sensors = ['<sensor name="Sensor{0}" type="Level{1}" location="Room{0}"><activationDelay><value mode="Mode{2}">1</value></activationDelay></sensor>'.format(i, depth - 1 - i % 3, i % depth) for i in range(sensorCount)]
+    return """<?xml version="1.0" ?>
+<config>
+    <modes objectId="Mode"/>
+    <alerts>
+        <alert name="Intrusion" persistenceObjectId="IntrusionPersistence"/>
+    </alerts>
+    <sensors>
+        {classes}
+        {sensors}
+    </sensors>
+</config>""".format(classes='\n        '.join(classes), sensors='\n        '.join(sensors))
+
+def resolveByWalkingAncestors(config, sensor):
+    """ Former way of resolving a sensor: merges the members of each of its ancestors in turn. """
+    resolvedCopy = configuration.Sensor(sensor.type, sensor.name, sensor.isBuiltIn)
+    currentClass = sensor
+    while currentClass != None:
+        configuration.Configuration._mergeMembers(vars(resolvedCopy), vars(currentClass), isInherited=currentClass is not sensor)
+        currentClass = None if currentClass.isRootType() else config.getClassByName(currentClass.type)
+    config.resolveObject(resolvedCopy, {})
+    return resolvedCopy
+
+@benchmark
+def classResolution(sensorCount=2000, depths=(3, 10, 30)):
+    """ Resolves sensors that inherit from deep class hierarchies, as hwdaemon and hwresolve do on startup. """
+    for depth in depths:
+        xmlConfig = makeDeepHierarchyConfigXml(sensorCount, depth)
+        config = configuration.Configuration.parseString(xmlConfig)
+        report('Resolve {0} sensors, {1} levels (ancestor walk)'.format(sensorCount, depth), measure(lambda: [resolveByWalkingAncestors(config, s) for s in config.sensors]), sensorCount)
+        configs = [configuration.Configuration.parseString(xmlConfig) for i in range(3)] # Resolution replaces sensors.
+        report('Resolve {0} sensors, {1} levels'.format(sensorCount, depth), measure(lambda: configs.pop().resolve(checkIntegrityWhenDone=False), 3), sensorCount)
+
+class UncachedIntegrityChecker(configuration.Configuration.IntegrityChecker):
+    """ Former way of checking integrity: acceptable values are listed again for each object. """
+    def getAcceptableValues(self, property, owner):
+        return property.getAcceptablesValues(self.configuration, owner)
+
+@benchmark
+def integrityCheck(sensorCounts=(1000, 5000, 10000)):
+    """ Checks the integrity of resolved configurations whose sensors are all involved in a mode, as hwdaemon does on startup. """
+    for sensorCount in sensorCounts:
+        config = configuration.Configuration.parseString(makeSyntheticConfigXml(sensorCount))
+        config.resolve(checkIntegrityWhenDone=False)
+        if sensorCount <= 5000: # Too slow beyond.
+            report('Check {0} sensors (acceptable values listed per object)'.format(sensorCount), measure(lambda: configuration.Configuration.PROPERTY_DEFINITIONS.checkIntegrity(config, config, checker=UncachedIntegrityChecker(config))), sensorCount)
+        report('Check {0} sensors'.format(sensorCount), measure(config.checkIntegrity, 3), sensorCount)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('benchmarks', help='name of a benchmark to run. All benchmarks are run if none is specified.', metavar='BENCHMARK', nargs='*', choices=[[]] + list(BENCHMARKS.keys()))
+    args = parser.parse_args()
+
+    for name in args.benchmarks or BENCHMARKS.keys():
+        print('*** {0}'.format(name))
+        BENCHMARKS[name]()
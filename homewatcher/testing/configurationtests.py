@@ -38,6 +38,8 @@ import inspect
 import stat
 import pwd, grp
 import shutil
+import xml.dom.minidom
+from xml.etree import ElementTree
 
 class ConfigurationTestCase(base.TestCaseBase):
     def checkConfigFails(self, configStr, exceptionMessage, resolvesConfig=False, configGetter = lambda config: config):
@@ -121,6 +123,125 @@ class ConfigurationTestCase(base.TestCaseBase):
         checkInheritance('c2', ['c3'])
         checkInheritance('c3', [])
 
+    def testSensorIndex(self):
+        config = configuration.Configuration.parseString("""<config><sensors>
+                <sensor name="s1" type="c1"/>
+                <sensor isClass="true" name="c1" type="boolean"/>
+                <sensor isClass="true" name="loop1" type="loop2"/>
+                <sensor isClass="true" name="loop2" type="loop1"/>
+                </sensors></config>""")
+        s1 = config.getSensorByName('s1')
+        self.assertTrue(config.doesSensorInherit(s1, 'c1'))
+        self.assertEqual(config.getBuiltInRootClass(s1).name, 'boolean')
+
+        # Cyclic inheritance must not hang.
+        self.assertTrue(config.doesSensorInherit('loop1', 'loop2'))
+        self.assertFalse(config.doesSensorInherit('loop1', 'root'))
+
+        # Index follows changes of the list of sensors by itself.
+        s2 = configuration.Sensor('c2', 's2', False)
+        c2 = configuration.Sensor('float', 'c2', False)
+        c2.isClass = True
+        config.sensorsAndClasses.extend([s2, c2])
+        self.assertIs(config.getSensorByName('s2'), s2)
+        self.assertTrue(config.doesSensorInherit(s2, 'float'))
+        self.assertEqual([s.name for s in config.sensors], ['s1', 's2'])
+        config.sensorsAndClasses = [s for s in config.sensorsAndClasses if s != c2]
+        self.assertIsNone(config.getClassByName('c2'))
+        self.assertFalse(config.doesSensorInherit(s2, 'float'))
+        config.sensorsAndClasses += [c2]
+        self.assertIs(config.getClassByName('c2'), c2)
+        del config.sensorsAndClasses[-1]
+        self.assertIsNone(config.getClassByName('c2'))
+        vars(config)['sensorsAndClasses'] = config.sensorsAndClasses + [c2]
+        self.assertIs(config.getClassByName('c2'), c2)
+
+        # Renaming an item requires an explicit invalidation.
+        s2.name = 's3'
+        config.invalidateSensorIndex()
+        self.assertIsNone(config.getSensorByName('s2'))
+        self.assertIs(config.getSensorByName('s3'), s2)
+
+        config.sensorsAndClasses.append(configuration.Sensor('boolean', 's1', False))
+        self.assertRaises(configuration.Configuration.IntegrityException, config.getSensorByName, 's1')
+
+    def testXmlReading(self):
+        """ Checks that objects are read the same way from ElementTree and DOM elements. """
+        sensorXml = """<sensor name="s1" type="boolean" location="Kitchen" alert="Intrusion">
+                <activationDelay>
+                    <value mode="Away">3</value>
+                    <value>1.5</value>
+                </activationDelay>
+                <description>Kitchen <!-- comment -->window</description>
+            </sensor>"""
+        etSensor = configuration.Sensor.fromXML(ElementTree.fromstring(sensorXml))
+        domSensor = configuration.Sensor.fromXML(xml.dom.minidom.parseString(sensorXml).documentElement)
+        for s in (etSensor, domSensor):
+            self.assertEqual(s.name, 's1')
+            self.assertEqual(s.alertName, 'Intrusion')
+            self.assertEqual([(v.modeName, v.value) for v in s.activationDelay.values], [('Away', 3.0), (None, 1.5)])
+            self.assertEqual(s.description, 'Kitchen window')
+            self.assertIsNone(s.prealertDuration)
+
+        # Actions are rendered to linknx from DOM elements, whatever they are
+        # read from.
+        config = configuration.Configuration.parseString("""<config><alerts><alert name="Intrusion">
+                <event type="activated"><action type="set-value" id="Siren" value="on"/>
+                </event></alert></alerts></config>""")
+        action = config.alerts.alerts[0].events[0].actions[0]
+        self.assertEqual(action.type, 'set-value')
+        self.assertEqual(action.linknxActionXml.toxml(), '<action type="set-value" id="Siren" value="on"/>')
+
+    def testXmlContext(self):
+        """ Checks that integrity problems report the XML of the problematic object and its location. """
+        config = configuration.Configuration.parseString("""<config>
+            <sensors>
+                <sensor name="s1" type="boolean" comment="&lt;not&gt; a 'tag'" persistenceObjectId="p"/>
+                <sensor name="s2" type="boolean" persistenceObjectId="p">
+                    <activationDelay><value>1</value></activationDelay>
+                </sensor>
+            </sensors></config>""")
+        with self.assertRaises(configuration.Configuration.IntegrityException) as context:
+            configuration.Sensor.PROPERTY_DEFINITIONS.checkIntegrity(config, config.sensors)
+        self.assertTrue(str(context.exception).endswith("""XML context: <sensor name="s1" type="boolean" comment="&lt;not&gt; a 'tag'" persistenceObjectId="p"/> (line 3, column 17 of <string>)"""), context.exception)
+        self.assertEqual(str(config.getSensorByName('s2').xmlSource), """<sensor name="s2" type="boolean" persistenceObjectId="p">
+                    <activationDelay><value>1</value></activationDelay>
+                </sensor> (line 4, column 17 of <string>)""")
+        self.assertEqual(str(config.getSensorByName('s2').activationDelay.values[0].xmlSource), '<value>1</value> (line 5, column 38 of <string>)')
+
+    def testAllViolationsReported(self):
+        config = configuration.Configuration.parseString("""<config>
+            <modes objectId="Mode">
+                <mode name="Away" value="1"><sensor>Unknown</sensor></mode>
+            </modes>
+            <alerts>
+                <alert name="Intrusion" persistenceObjectId="IntrusionPersistence"/>
+            </alerts>
+            <sensors>
+                <sensor name="s1" type="boolean" alert="Intrusion" enabledObjectId="Enabled" watchedObjectId="Trigger1" activationDelay="1" prealertDuration="1" alertDuration="1" triggerValue="true">
+                    <activationCriterion type="sensor" sensor="s3" whenTriggered="false"/>
+                </sensor>
+                <sensor name="s2" type="UndefinedClass" alert="Intrusion" enabledObjectId="Enabled" watchedObjectId="Trigger2" activationDelay="1" prealertDuration="1" alertDuration="1" triggerValue="true">
+                    <activationCriterion type="sensor" sensor="s1" whenTriggered="false"/>
+                </sensor>
+            </sensors></config>""")
+        violations = config.getIntegrityViolations()
+        self.assertEqual([(v.args[0].split(':')[0], v.problematicObject) for v in violations], [
+            ('Property sensorNames (cf. the "sensor" element in XML) is invalid', config.getModeByName('Away')),
+            ('Property sensorName (cf. the "sensor" attribute in XML) is invalid', config.getSensorByName('s1').activationCriterion),
+            ('Property type (cf. the "type" attribute in XML) is invalid', config.getSensorByName('s2'))])
+
+        # The first problem is raised, along with all the others.
+        with self.assertRaises(configuration.Configuration.IntegrityException) as context:
+            config.checkIntegrity()
+        self.assertEqual(context.exception.args[0], "Property sensorNames (cf. the \"sensor\" element in XML) is invalid: A value in ['s1', 's2'] is expected, Unknown found.")
+        self.assertEqual([v.args for v in context.exception.violations], [v.args for v in violations])
+
+        # Values of unique properties are tracked once the sensor type is fixed.
+        config.getSensorByName('s2').type = 'boolean'
+        violations = config.getIntegrityViolations()
+        self.assertEqual([v.args[0] for v in violations[2:]], ['Property enabledObjectId (cf. the "enabledObjectId" attribute in XML) is invalid: Value Enabled is already assigned to another object.'])
+
     def testServicesIntegrityChecks(self):
         """ Exercises Configuration.checkIntegrity """
         # Test services repository is not mandatory.
@@ -147,15 +268,108 @@ class ConfigurationTestCase(base.TestCaseBase):
         configuration.ServicesRepository.PROPERTY_DEFINITIONS.checkIntegrity(config, config.servicesRepository)
         self.assertEqual(config.servicesRepository.linknx.host, 'mylinknxhost')
         self.assertEqual(config.servicesRepository.linknx.port, 1028)
+        self.assertFalse(config.servicesRepository.linknx.batchActions)
         config = configuration.Configuration.parseString("""
         <config>
             <services>
-                <linknx port="1030"/>
+                <linknx port="1030" batchActions="true"/>
             </services>
         </config>""")
         configuration.ServicesRepository.PROPERTY_DEFINITIONS.checkIntegrity(config, config.servicesRepository)
         self.assertEqual(config.servicesRepository.linknx.host, '127.0.0.1')
         self.assertEqual(config.servicesRepository.linknx.port, 1030)
+        self.assertTrue(config.servicesRepository.linknx.batchActions)
+
+        # Test timers service.
+        self.assertIsNone(config.servicesRepository.timers)
+        config = configuration.Configuration.parseString("""
+        <config>
+            <services>
+                <timers scheduler="wheel" resolution="0.05" callbackThreads="2"/>
+            </services>
+        </config>""")
+        configuration.ServicesRepository.PROPERTY_DEFINITIONS.checkIntegrity(config, config.servicesRepository)
+        self.assertEqual(config.servicesRepository.timers.scheduler, configuration.TimersService.Scheduler.WHEEL)
+        self.assertEqual(config.servicesRepository.timers.resolution, 0.05)
+        self.assertEqual(config.servicesRepository.timers.callbackThreadCount, 2)
+        self.checkConfigFails("""
+        <config>
+            <services>
+                <timers scheduler="list"/>
+            </services>
+        </config>""", 'Property scheduler (cf. the "scheduler" attribute in XML) is invalid: A value in [\'heap\', \'wheel\'] is expected, list found.', configGetter=lambda config: config.servicesRepository)
+
+        # Test actions service.
+        self.assertIsNone(config.servicesRepository.actions)
+        config = configuration.Configuration.parseString("""
+        <config>
+            <services>
+                <actions workers="2"/>
+            </services>
+        </config>""")
+        configuration.ServicesRepository.PROPERTY_DEFINITIONS.checkIntegrity(config, config.servicesRepository)
+        self.assertEqual(config.servicesRepository.actions.workerCount, 2)
+        self.assertEqual(config.servicesRepository.actions.queueSize, 1000)
+
+        # Test outbox service.
+        self.assertIsNone(config.servicesRepository.outbox)
+        config = configuration.Configuration.parseString("""
+        <config>
+            <services>
+                <outbox path="/tmp/outbox.journal" maxAttempts="5"/>
+            </services>
+        </config>""")
+        configuration.ServicesRepository.PROPERTY_DEFINITIONS.checkIntegrity(config, config.servicesRepository)
+        self.assertEqual(config.servicesRepository.outbox.path, '/tmp/outbox.journal')
+        self.assertEqual(config.servicesRepository.outbox.retryDelay, 1.0)
+        self.assertEqual(config.servicesRepository.outbox.maxAttemptCount, 5)
+
+        # Test SMTP service.
+        self.assertIsNone(config.servicesRepository.smtp)
+        config = configuration.Configuration.parseString("""
+        <config>
+            <services>
+                <smtp host="mail.foo.com" from="homewatcher@foo.com" sessions="3" startTLS="true"/>
+            </services>
+        </config>""")
+        configuration.ServicesRepository.PROPERTY_DEFINITIONS.checkIntegrity(config, config.servicesRepository)
+        self.assertEqual(config.servicesRepository.smtp.host, 'mail.foo.com')
+        self.assertEqual(config.servicesRepository.smtp.port, 25)
+        self.assertEqual(config.servicesRepository.smtp.fromAddress, 'homewatcher@foo.com')
+        self.assertEqual(config.servicesRepository.smtp.sessionCount, 3)
+        self.assertTrue(config.servicesRepository.smtp.startTLS)
+        self.assertIsNone(config.servicesRepository.smtp.username)
+
+        # Test upload service.
+        self.assertIsNone(config.servicesRepository.upload)
+        config = configuration.Configuration.parseString("""
+        <config>
+            <services>
+                <upload host="ftp.foo.com" directory="/captures" watchedDirectory="/var/lib/motion" deleteUploadedFiles="true" queueSize="20"/>
+            </services>
+        </config>""")
+        configuration.ServicesRepository.PROPERTY_DEFINITIONS.checkIntegrity(config, config.servicesRepository)
+        self.assertEqual(config.servicesRepository.upload.host, 'ftp.foo.com')
+        self.assertEqual(config.servicesRepository.upload.port, 21)
+        self.assertEqual(config.servicesRepository.upload.remoteDirectory, '/captures')
+        self.assertEqual(config.servicesRepository.upload.watchedDirectory, '/var/lib/motion')
+        self.assertTrue(config.servicesRepository.upload.deleteUploadedFiles)
+        self.assertEqual(config.servicesRepository.upload.maxAttemptCount, 3)
+        self.assertEqual(config.servicesRepository.upload.queueSize, 20)
+        self.assertEqual(config.servicesRepository.upload.workerCount, 2)
+
+        # Test shell service.
+        self.assertIsNone(config.servicesRepository.shell)
+        config = configuration.Configuration.parseString("""
+        <config>
+            <services>
+                <shell maxRunning="2" timeout="30"/>
+            </services>
+        </config>""")
+        configuration.ServicesRepository.PROPERTY_DEFINITIONS.checkIntegrity(config, config.servicesRepository)
+        self.assertEqual(config.servicesRepository.shell.maxRunningCount, 2)
+        self.assertEqual(config.servicesRepository.shell.timeout, 30.0)
+        self.assertEqual(config.servicesRepository.shell.killDelay, 5.0)
 
     def testAlertIntegrityChecks(self):
         """ Exercises Configuration.checkIntegrity """
@@ -595,5 +809,53 @@ class ConfigurationTestCase(base.TestCaseBase):
         self.assertEqual(resolvedEntranceSensor.activationCriterion.sensorName, resolvedEntranceSensor.name)
         self.assertEqual(resolvedEntranceSensor.prealertDuration.getForMode('Away'), 6)
 
+        # All objects the daemon relies on are known once sensors are resolved.
+        self.assertEqual(config.getReferencedObjectIds(), {'Mode', 'IntrusionPersistence', 'OpeningTriggerEntrance', 'EntranceEnabled', 'OpeningTriggerLivingRoom', 'LivingRoomEnabled'})
+
+        # hwconf installs a callback for each of them.
+        self.assertEqual(config.getNotifiedObjectIds(), config.getReferencedObjectIds())
+
+    def testMultiLevelInheritance(self):
+        configStr = """
+        <config>
+            <sensors>
+                <sensor isClass="true" type="boolean" name="Level0" watchedObjectId="Trigger{location}" level="0" activationDelay="1"/>
+                <sensor isClass="true" type="Level0" name="Level1" enabledObjectId="{location}Enabled" level="1">
+                    <activationDelay>
+                        <value mode="Away">2</value>
+                    </activationDelay>
+                </sensor>
+                <sensor isClass="true" type="Level1" name="Level2" level="2">
+                    <activationDelay>
+                        <value mode="Night">3</value>
+                        <value mode="Away">4</value>
+                    </activationDelay>
+                </sensor>
+                <sensor type="Level2" name="Sensor1" location="Kitchen">
+                    <activationDelay>
+                        <value mode="Night">5</value>
+                    </activationDelay>
+                </sensor>
+                <sensor type="Level2" name="Sensor2" location="Hall" level="sensor"/>
+                <sensor type="Level1" name="Sensor3" location="Garage"/>
+            </sensors>
+        </config>"""
+        config = configuration.Configuration.parseString(configStr)
+        config.resolve(checkIntegrityWhenDone=False)
+
+        sensor1, sensor2, sensor3 = [config.getSensorByName('Sensor{0}'.format(i)) for i in range(1, 4)]
+        self.assertEqual(sensor1.watchedObjectId, 'TriggerKitchen')
+        self.assertEqual(sensor2.enabledObjectId, 'HallEnabled')
+        self.assertEqual(sensor1.attributes['level'], '2')
+        self.assertEqual(sensor2.attributes['level'], 'sensor')
+        self.assertEqual(sensor3.attributes['level'], '1')
+        self.assertEqual([(v.modeName, v.value) for v in sensor1.activationDelay.values], [('Night', 5), ('Away', 4), (None, 1)])
+        self.assertEqual([(v.modeName, v.value) for v in sensor2.activationDelay.values], [('Night', 3), ('Away', 4), (None, 1)])
+        self.assertEqual([(v.modeName, v.value) for v in sensor3.activationDelay.values], [('Away', 2), (None, 1)])
+
+        # Sensors do not share resolved members with each other nor with classes.
+        self.assertIsNot(sensor1.activationDelay, sensor2.activationDelay)
+        self.assertEqual(len(config.getClassByName('Level2').activationDelay.values), 2)
+
 if __name__ == '__main__':
     unittest.main()
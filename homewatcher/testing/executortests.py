@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2014-2017 Cyrille Defranoux
+#
+# This file is part of Homewatcher.
+#
+# Homewatcher is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Homewatcher is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Homewatcher. If not, see <http://www.gnu.org/licenses/>.
+#
+# For any question, feature requests or bug reports, feel free to contact me at:
+# knx at aminate dot net
+
+import sys
+from pyknx import logger
+from pyknx.testing import base
+from homewatcher.executor import ActionExecutor
+import unittest
+import time
+import threading
+
+class ActionExecutorTestCase(base.TestCaseBase):
+    def testOrderingPerQueue(self):
+        executor = ActionExecutor(workerCount=4)
+        executedJobs = {'A' : [], 'B' : []}
+        def makeJob(queueName, index):
+            def job():
+                time.sleep(0.001)
+                executedJobs[queueName].append(index)
+            return job
+
+        jobs = []
+        for i in range(50):
+            for queueName in executedJobs.keys():
+                jobs.append(executor.submit(queueName, makeJob(queueName, i), 'Job {0} of {1}'.format(i, queueName)))
+        for job in jobs:
+            job.wait()
+
+        self.assertEqual(executedJobs['A'], list(range(50)))
+        self.assertEqual(executedJobs['B'], list(range(50)))
+        self.assertEqual(executor.executedJobCount, 100)
+        self.assertEqual(executor.pendingJobCount, 0)
+        executor.stop()
+
+    def testQueuesRunConcurrently(self):
+        executor = ActionExecutor(workerCount=2)
+        slowJobRelease = threading.Event()
+
+        # A blocked queue must not delay other queues.
+        slowJob = executor.submit('Slow', slowJobRelease.wait, 'Slow job')
+        fastJob = executor.submit('Fast', lambda: None, 'Fast job')
+        self.waitDuring(0.5, 'Let fast job execute.')
+        self.assertEqual(executor.executedJobCount, 1)
+        self.assertEqual(executor.pendingJobCount, 1)
+        slowJobRelease.set()
+        slowJob.wait()
+        executor.stop()
+        self.assertEqual(executor.executedJobCount, 2)
+
+    def testBoundedQueueAndFailures(self):
+        executor = ActionExecutor(workerCount=1, maxPendingJobCount=2)
+        jobRelease = threading.Event()
+        executor.submit('Queue', jobRelease.wait, 'Blocking job')
+        executor.submit('Queue', lambda: None, 'Second job')
+
+        # Queue is full: the next submission has to wait.
+        submitter = threading.Thread(target=lambda: executor.submit('Queue', lambda: 1/0, 'Failing job'))
+        submitter.start()
+        self.waitDuring(0.5, 'Make sure submission is blocked.')
+        self.assertTrue(submitter.is_alive())
+        self.assertEqual(executor.peakPendingJobCount, 2)
+        jobRelease.set()
+        submitter.join(2)
+        self.assertFalse(submitter.is_alive())
+
+        # Failures are reported to waiters.
+        failingJob = executor.submit('Queue', lambda: 1/0, 'Another failing job')
+        self.assertRaises(ZeroDivisionError, failingJob.wait)
+        executor.stop()
+        self.assertEqual(executor.executedJobCount, 4)
+        self.assertEqual(executor.failedJobCount, 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2014-2017 Cyrille Defranoux
+#
+# This file is part of Homewatcher.
+#
+# Homewatcher is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Homewatcher is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Homewatcher. If not, see <http://www.gnu.org/licenses/>.
+#
+# For any question, feature requests or bug reports, feel free to contact me at:
+# knx at aminate dot net
+
+import sys
+from pyknx import logger
+from pyknx.testing import base
+from homewatcher import configuration
+from homewatcher.alarm import SendEmailAction
+from homewatcher.mailer import SMTPMailer, Email
+from homewatcher.testing.servers import SMTPServerStub
+import email.header
+import smtplib
+import unittest
+import threading
+import xml.dom.minidom as xdm
+
+class MailerTestCase(base.TestCaseBase):
+    def setUp(self):
+        base.TestCaseBase.setUp(self)
+        self.server = SMTPServerStub().start()
+
+    def tearDown(self):
+        self.server.stop()
+        base.TestCaseBase.tearDown(self)
+
+    @staticmethod
+    def decodeSubject(message):
+        return str(email.header.make_header(email.header.decode_header(message['Subject'])))
+
+    def makeMailer(self, **kwargs):
+        return SMTPMailer('127.0.0.1', self.server.port, 'homewatcher@foo.com', **kwargs)
+
+    def testSendAction(self):
+        # Render an email action the way the daemon does.
+        class DaemonMock(object):
+            def __init__(self):
+                self.emailXml = None
+            def sendEmail(self, actionXml):
+                self.emailXml = actionXml
+        actionConfigXml = xdm.parseString('<action type="send-email" to="foo@bar.com, baz@bar.com">\n\t<subject>Alert <br/>&amp; more</subject>\n\t<body>First line<br/>Second &lt;line&gt;</body>\n</action>')
+        actionConfig = configuration.Action.fromXML(actionConfigXml.getElementsByTagName('action')[0])
+        daemonMock = DaemonMock()
+        SendEmailAction(daemonMock, actionConfig).execute(None)
+
+        mailer = self.makeMailer()
+        mailer.sendAction(daemonMock.emailXml)
+        mailer.close()
+
+        self.assertEqual(len(self.server.messages), 1)
+        recipients, message = self.server.messages[0]
+        self.assertEqual(recipients, ['foo@bar.com', 'baz@bar.com'])
+        self.assertEqual(message['From'], 'homewatcher@foo.com')
+        self.assertEqual(MailerTestCase.decodeSubject(message), 'Alert & more')
+        body = message.get_payload(decode=True).decode('utf-8')
+        self.assertTrue(body.startswith('First line\nSecond <line>\n\n---'), body)
+        self.assertIn('This email was sent by Homewatcher', body)
+
+    def testSessionReuse(self):
+        mailer = self.makeMailer(sessionCount=2)
+        for i in range(5):
+            mailer.send(Email(['foo@bar.com'], 'Subject {0}'.format(i), 'Text'))
+        self.assertEqual(self.server.connectionCount, 1)
+
+        # Concurrent senders share the few available sessions.
+        senders = [threading.Thread(target=lambda i=i: mailer.send(Email(['foo@bar.com'], 'Concurrent {0}'.format(i), 'Text'))) for i in range(20)]
+        for sender in senders: sender.start()
+        for sender in senders: sender.join()
+        mailer.close()
+        self.assertEqual(len(self.server.messages), 25)
+        self.assertLessEqual(self.server.connectionCount, 2)
+        self.assertEqual(mailer.sentEmailCount, 25)
+
+    def testReconnection(self):
+        self.server.maxMessagesPerConnection = 2
+        mailer = self.makeMailer()
+        for i in range(5):
+            mailer.send(Email(['foo@bar.com'], 'Subject {0}'.format(i), 'Text'))
+        mailer.close()
+        self.assertEqual([MailerTestCase.decodeSubject(message) for recipients, message in self.server.messages], ['Subject {0}'.format(i) for i in range(5)])
+        self.assertEqual(mailer.connectionCount, 3)
+        self.assertEqual(mailer.reconnectionCount, 2)
+
+    def testFailures(self):
+        mailer = self.makeMailer()
+
+        # Refused recipients do not break the session.
+        self.server.refusedRecipients.add('nobody@bar.com')
+        self.assertRaises(smtplib.SMTPRecipientsRefused, mailer.send, Email(['nobody@bar.com'], 'Refused', 'Text'))
+        mailer.send(Email(['nobody@bar.com', 'foo@bar.com'], 'Partly refused', 'Text'))
+        self.assertEqual(mailer.connectionCount, 1)
+
+        # Other errors leave the session in an unknown state, it is reopened.
+        self.server.failingMessageCount = 1
+        self.assertRaises(smtplib.SMTPDataError, mailer.send, Email(['foo@bar.com'], 'Failing', 'Text'))
+        mailer.send(Email(['foo@bar.com'], 'Next', 'Text'))
+        mailer.close()
+        self.assertEqual([MailerTestCase.decodeSubject(message) for recipients, message in self.server.messages], ['Partly refused', 'Next'])
+        self.assertEqual(mailer.connectionCount, 2)
+        self.assertEqual(mailer.reconnectionCount, 0)
+        self.assertEqual(mailer.failedEmailCount, 2)
+
+    def testUnreachableServer(self):
+        mailer = SMTPMailer('127.0.0.1', self.server.port, 'homewatcher@foo.com')
+        self.server.stop()
+        self.assertRaises(OSError, mailer.send, Email(['foo@bar.com'], 'Subject', 'Text'))
+        self.assertEqual(mailer.failedEmailCount, 1)
+        self.server = SMTPServerStub().start()
+
+if __name__ == '__main__':
+    unittest.main()
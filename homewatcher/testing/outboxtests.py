@@ -0,0 +1,177 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2014-2017 Cyrille Defranoux
+#
+# This file is part of Homewatcher.
+#
+# Homewatcher is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Homewatcher is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Homewatcher. If not, see <http://www.gnu.org/licenses/>.
+#
+# For any question, feature requests or bug reports, feel free to contact me at:
+# knx at aminate dot net
+
+import sys
+from pyknx import logger
+from pyknx.testing import base
+from homewatcher.executor import ActionExecutor
+from homewatcher.outbox import Outbox
+from homewatcher.timer import TimerScheduler
+import unittest
+import os
+import tempfile
+import threading
+
+class OutboxTestCase(base.TestCaseBase):
+    class TargetMock(object):
+        def __init__(self, failureCount=0):
+            self.failureCount = failureCount # Number of deliveries that fail before the target starts working.
+            self.attempts = []
+            self.deliveries = []
+
+        def deliver(self, target, payload):
+            self.attempts.append(payload)
+            if len(self.attempts) <= self.failureCount:
+                raise Exception('Target is not available.')
+            self.deliveries.append((target, payload))
+
+    def setUp(self):
+        base.TestCaseBase.setUp(self)
+        self.journalPath = tempfile.mkstemp(suffix='.journal')[1]
+        self.executor = ActionExecutor(workerCount=2)
+        self.timerScheduler = TimerScheduler()
+
+    def tearDown(self):
+        self.executor.stop()
+        os.remove(self.journalPath)
+        base.TestCaseBase.tearDown(self)
+
+    def makeOutbox(self, target, **kwargs):
+        outbox = Outbox(self.journalPath, target.deliver, self.executor, self.timerScheduler, **kwargs)
+        outbox.open()
+        return outbox
+
+    def testDeliveryWithRetries(self):
+        target = OutboxTestCase.TargetMock(failureCount=2)
+        outbox = self.makeOutbox(target, retryDelay=0.1)
+        messages = outbox.post('Queue', [('linknx', '<action id="1"/>', 'First action'), ('email', '<action id="2"/>', 'Second action')])
+        for message in messages:
+            message.wait()
+
+        # Both initial attempts failed, they are retried with a backoff.
+        self.waitDuring(0.5, 'Let failed actions be retried.')
+        self.assertEqual(sorted(target.deliveries), [('email', '<action id="2"/>'), ('linknx', '<action id="1"/>')])
+        self.assertEqual(outbox.retryCount, 2)
+        self.assertEqual(outbox.deliveredMessageCount, 2)
+        outbox.close()
+
+        # Journal does not contain any undelivered message anymore.
+        outbox = Outbox(self.journalPath, target.deliver, self.executor, self.timerScheduler)
+        self.assertEqual(outbox.open(), 0)
+        outbox.close()
+
+    def testUndeliveredMessagesSurviveRestart(self):
+        target = OutboxTestCase.TargetMock(failureCount=1)
+        outbox = self.makeOutbox(target, retryDelay=60)
+        outbox.post('Queue', [('linknx', '<action id="1"/>', 'Action')])[0].wait()
+        outbox.close() # Closing cancels the retry.
+        self.assertEqual(outbox.timerScheduler.pendingTimerCount, 0)
+        self.assertEqual(target.deliveries, [])
+
+        # Restarting delivers the message again.
+        outbox = Outbox(self.journalPath, target.deliver, self.executor, self.timerScheduler)
+        self.assertEqual(outbox.open(), 1)
+        self.waitDuring(0.2, 'Let message be delivered.')
+        self.assertEqual(target.deliveries, [('linknx', '<action id="1"/>')])
+        outbox.close()
+
+    def testMaxAttempts(self):
+        target = OutboxTestCase.TargetMock(failureCount=100)
+        outbox = self.makeOutbox(target, retryDelay=0.05, maxAttemptCount=3)
+        outbox.post('Queue', [('linknx', '<action id="1"/>', 'Action')])
+        self.waitDuring(0.5, 'Let message be retried.')
+        self.assertEqual(len(target.attempts), 3)
+        self.assertEqual(outbox.droppedMessageCount, 1)
+        outbox.close()
+
+    def testRetriesPreserveOrder(self):
+        target = OutboxTestCase.TargetMock(failureCount=2)
+        outbox = self.makeOutbox(target, retryDelay=0.05)
+        outbox.post('Queue', [('linknx', '<action id="1"/>', 'First action')])
+        outbox.post('Queue', [('linknx', '<action id="2"/>', 'Second action')])
+        outbox.post('Queue', [('linknx', '<action id="3"/>', 'Third action')])[0].wait()
+
+        # Next actions of the queue wait for the failing one.
+        self.assertEqual([payload for target, payload in target.deliveries], ['<action id="1"/>', '<action id="2"/>', '<action id="3"/>'])
+        self.assertEqual(target.attempts[:3], ['<action id="1"/>'] * 3)
+        outbox.close()
+
+    def testRetryDoesNotHoldWorker(self):
+        self.executor = ActionExecutor(workerCount=1)
+        target = OutboxTestCase.TargetMock(failureCount=1)
+        outbox = self.makeOutbox(target, retryDelay=0.5)
+        outbox.post('Failing queue', [('linknx', '<action id="1"/>', 'Failing action')])[0].wait()
+
+        # The only worker delivers the actions of other queues while the failed
+        # one waits for its retry.
+        outbox.post('Other queue', [('linknx', '<action id="2"/>', 'Other action')])[0].wait()
+        self.assertEqual(target.deliveries, [('linknx', '<action id="2"/>')])
+        self.waitDuring(0.7, 'Let failed action be retried.')
+        self.assertEqual(target.deliveries, [('linknx', '<action id="2"/>'), ('linknx', '<action id="1"/>')])
+        outbox.close()
+
+    def testJournalFailure(self):
+        class FailingFile(object):
+            def __init__(self, file):
+                self.file = file
+                self.isFailing = True
+
+            def write(self, data):
+                if self.isFailing: raise OSError('Disk is full.')
+                self.file.write(data)
+
+            def __getattr__(self, name):
+                return getattr(self.file, name)
+
+        target = OutboxTestCase.TargetMock()
+        outbox = self.makeOutbox(target)
+        outbox._file = FailingFile(outbox._file)
+        self.assertRaises(OSError, outbox.post, 'Queue', [('linknx', '<action id="1"/>', 'Lost action')])
+
+        # Next posts work again once the journal can be written.
+        outbox._file.isFailing = False
+        outbox.post('Queue', [('linknx', '<action id="2"/>', 'Action')])[0].wait()
+        self.assertEqual(target.deliveries, [('linknx', '<action id="2"/>')])
+        self.executor.stop()
+        outbox.close()
+        outbox = Outbox(self.journalPath, target.deliver, self.executor, self.timerScheduler)
+        self.assertEqual(outbox.open(), 0)
+        outbox.close()
+
+    def testGroupCommit(self):
+        target = OutboxTestCase.TargetMock()
+        outbox = self.makeOutbox(target)
+        def postMany(threadIndex):
+            for i in range(50):
+                outbox.post('Queue {0}'.format(threadIndex), [('linknx', '<action/>', 'Action {0}'.format(i))])
+        posters = [threading.Thread(target=postMany, args=(i,)) for i in range(8)]
+        for poster in posters: poster.start()
+        for poster in posters: poster.join()
+        self.executor.stop()
+        outbox.close()
+
+        # Concurrent posts share their syncs.
+        self.assertEqual(len(target.deliveries), 400)
+        self.assertLess(outbox.syncCount, 400 * 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2014-2017 Cyrille Defranoux
+#
+# This file is part of Homewatcher.
+#
+# Homewatcher is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Homewatcher is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Homewatcher. If not, see <http://www.gnu.org/licenses/>.
+#
+# For any question, feature requests or bug reports, feel free to contact me at:
+# knx at aminate dot net
+
+
+import sys
+from pyknx import logger
+from pyknx.testing import base
+from homewatcher import processpump
+from homewatcher.processpump import ProcessPump
+import unittest
+import unittest.mock
+import subprocess
+import threading
+import time
+
+class ProcessPumpTestCase(base.TestCaseBase):
+    def setUp(self):
+        base.TestCaseBase.setUp(self)
+        self.pump = ProcessPump(maxLineLength=16)
+        self.lines = []
+        self.terminatedProcesses = []
+        self.terminated = threading.Event()
+
+    def tearDown(self):
+        self.pump.stop(timeout=5)
+        base.TestCaseBase.tearDown(self)
+
+    def spawn(self, command, name='Command', pipe=subprocess.PIPE):
+        process = subprocess.Popen(command, shell=True, stdout=pipe, stderr=pipe)
+        def onTerminated(process):
+            self.terminatedProcesses.append(process)
+            self.terminated.set()
+        return self.pump.register(process, name, onLine=lambda streamName, line: self.lines.append((name, streamName, line)), onTerminated=onTerminated)
+
+    def testOutput(self):
+        process = self.spawn('echo first; echo error >&2; printf "second"; sleep 0.1; printf " line\\nunterminated"; exit 3')
+        self.assertTrue(self.terminated.wait(5))
+
+        # Partial lines are joined, the last line is emitted even if it is not
+        # terminated.
+        self.assertEqual([line for line in self.lines if line[1] == 'out'], [('Command', 'out', 'first'), ('Command', 'out', 'second line'), ('Command', 'out', 'unterminated')])
+        self.assertEqual([line for line in self.lines if line[1] == 'err'], [('Command', 'err', 'error')])
+        self.assertEqual(self.terminatedProcesses, [process])
+        self.assertEqual(process.returncode, 3)
+        self.assertEqual(self.pump.processCount, 0)
+
+    def testLongLines(self):
+        self.spawn('printf "0123456789012345678901234567890123456789\\nshort\\n"')
+        self.assertTrue(self.terminated.wait(5))
+        self.assertEqual([line[2] for line in self.lines], ['0123456789012345', '6789012345678901', '23456789', 'short'])
+        self.assertEqual(self.pump.truncatedLineCount, 2)
+
+    def testManyProcesses(self):
+        processes = [self.spawn('echo {0}; sleep 0.{0}'.format(i), 'Command {0}'.format(i)) for i in range(10)]
+        deadline = time.monotonic() + 5
+        while len(self.terminatedProcesses) < len(processes) and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        # All processes are served by a single thread.
+        self.assertEqual(sorted(self.lines), sorted([('Command {0}'.format(i), 'out', str(i)) for i in range(10)]))
+        self.assertEqual(set(self.terminatedProcesses), set(processes))
+        self.assertEqual(len([thread for thread in threading.enumerate() if thread.name == 'Process pump']), 1)
+
+    def testProcessClosingItsStreams(self):
+        # The process is reaped even though its streams are closed long before
+        # it exits.
+        process = self.spawn('echo bye; exec >&- 2>&-; sleep 0.3; exit 1')
+        self.assertTrue(self.terminated.wait(5))
+        self.assertEqual(self.lines, [('Command', 'out', 'bye')])
+        self.assertEqual(process.returncode, 1)
+
+    def testWithoutPidfd(self):
+        # Processes are polled when their termination cannot be notified,
+        # whether they have pipes or not.
+        with unittest.mock.patch.object(processpump.os, 'pidfd_open', side_effect=OSError, create=True):
+            silentProcess = self.spawn('sleep 0.2; exit 2', 'Silent', pipe=subprocess.DEVNULL)
+            closingProcess = self.spawn('echo bye; exec >&- 2>&-; sleep 0.2; exit 1', 'Closing')
+        deadline = time.monotonic() + 5
+        while len(self.terminatedProcesses) < 2 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(set(self.terminatedProcesses), {silentProcess, closingProcess})
+        self.assertEqual((silentProcess.returncode, closingProcess.returncode), (2, 1))
+        self.assertEqual(self.lines, [('Closing', 'out', 'bye')])
+        self.assertEqual(self.pump.processCount, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,236 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2014-2017 Cyrille Defranoux
+#
+# This file is part of Homewatcher.
+#
+# Homewatcher is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Homewatcher is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Homewatcher. If not, see <http://www.gnu.org/licenses/>.
+#
+# For any question, feature requests or bug reports, feel free to contact me at:
+# knx at aminate dot net
+
+"""
+Minimal local stand-ins for the network servers Homewatcher talks to. They implement just enough of each protocol for tests and benchmarks.
+"""
+
+import email
+import posixpath
+import socket
+import socketserver
+import threading
+import time
+import xml.dom.minidom
+
+class ServerStub(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, handlerClass):
+        socketserver.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0), handlerClass)
+        self.connectionCount = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='{0} thread'.format(self.__class__.__name__))
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+    def notifyConnected(self):
+        with self._lock:
+            self.connectionCount += 1
+
+class SMTPServerStub(ServerStub):
+    """ SMTP server that stores the messages it receives. """
+    class Handler(socketserver.StreamRequestHandler):
+        def reply(self, line):
+            self.wfile.write((line + '\r\n').encode('ascii'))
+
+        def handle(self):
+            server = self.server
+            server.notifyConnected()
+            self.reply('220 localhost SMTP stub')
+            sender, recipients = None, []
+            messageCount = 0
+            while True:
+                line = self.rfile.readline().decode('utf-8')
+                if not line: return
+                command = line.strip().split(' ')[0].upper()
+                if command in ('EHLO', 'HELO'):
+                    self.reply('250 localhost')
+                elif command == 'MAIL':
+                    sender, recipients = line[line.index(':') + 1:].strip(), []
+                    self.reply('250 OK')
+                elif command == 'RCPT':
+                    recipient = line[line.index(':') + 1:].strip().strip('<>')
+                    if recipient in server.refusedRecipients:
+                        self.reply('550 No such user')
+                    else:
+                        recipients.append(recipient)
+                        self.reply('250 OK')
+                elif command == 'DATA':
+                    self.reply('354 End data with <CR><LF>.<CR><LF>')
+                    lines = []
+                    while True:
+                        line = self.rfile.readline().decode('utf-8')
+                        if line.rstrip('\r\n') == '.': break
+                        lines.append(line[1:] if line.startswith('..') else line)
+                    if server.failingMessageCount > 0:
+                        server.failingMessageCount -= 1
+                        self.reply('451 Local error in processing')
+                        continue
+                    with server._lock:
+                        server.messages.append((recipients, email.message_from_string(''.join(lines))))
+                    self.reply('250 OK')
+                    messageCount += 1
+                    if server.maxMessagesPerConnection != None and messageCount >= server.maxMessagesPerConnection:
+                        # Simulate a server that drops sessions.
+                        return
+                elif command == 'QUIT':
+                    self.reply('221 Bye')
+                    return
+                else:
+                    self.reply('250 OK')
+
+    def __init__(self, maxMessagesPerConnection=None):
+        ServerStub.__init__(self, SMTPServerStub.Handler)
+        self.maxMessagesPerConnection = maxMessagesPerConnection
+        self.refusedRecipients = set()
+        self.failingMessageCount = 0 # Number of next messages that are rejected after their data is sent.
+        self.messages = [] # Tuples (recipients, email.message.Message).
+
+class FTPServerStub(ServerStub):
+    """ FTP server that only supports passive mode and stores the files it receives in memory. """
+    class Handler(socketserver.StreamRequestHandler):
+        def reply(self, line):
+            self.wfile.write((line + '\r\n').encode('utf-8'))
+
+        def resolve(self, path):
+            return posixpath.normpath(posixpath.join(self.currentDirectory, path))
+
+        def handle(self):
+            server = self.server
+            server.notifyConnected()
+            self.currentDirectory = '/'
+            dataListener = None
+            self.reply('220 FTP stub')
+            try:
+                while True:
+                    line = self.rfile.readline().decode('utf-8')
+                    if not line: return
+                    command, sep, argument = line.rstrip('\r\n').partition(' ')
+                    command = command.upper()
+                    if command == 'USER':
+                        self.reply('331 Password required')
+                    elif command == 'PASS':
+                        self.reply('230 Logged in')
+                    elif command == 'PWD':
+                        self.reply('257 "{0}"'.format(self.currentDirectory))
+                    elif command == 'CWD':
+                        directory = self.resolve(argument)
+                        if directory in server.directories:
+                            self.currentDirectory = directory
+                            self.reply('250 OK')
+                        else:
+                            self.reply('550 No such directory')
+                    elif command == 'MKD':
+                        with server._lock:
+                            server.directories.add(self.resolve(argument))
+                        self.reply('257 "{0}" created'.format(self.resolve(argument)))
+                    elif command == 'PASV':
+                        if dataListener != None: dataListener.close()
+                        dataListener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                        dataListener.bind(('127.0.0.1', 0))
+                        dataListener.listen(1)
+                        port = dataListener.getsockname()[1]
+                        self.reply('227 Entering Passive Mode (127,0,0,1,{0},{1})'.format(port >> 8, port & 0xFF))
+                    elif command == 'STOR':
+                        if dataListener == None:
+                            self.reply('425 Use PASV first')
+                            continue
+                        with server._lock:
+                            isFailing = server.failingFileCount > 0
+                            if isFailing: server.failingFileCount -= 1
+                        if isFailing:
+                            self.reply('553 Could not create file')
+                            continue
+                        self.reply('150 Ready')
+                        dataConnection, address = dataListener.accept()
+                        dataListener.close()
+                        dataListener = None
+                        chunks = []
+                        with dataConnection:
+                            while True:
+                                chunk = dataConnection.recv(65536)
+                                if not chunk: break
+                                chunks.append(chunk)
+                        if server.delay: time.sleep(server.delay)
+                        with server._lock:
+                            server.files[self.resolve(argument)] = b''.join(chunks)
+                        self.reply('226 Transfer complete')
+                    elif command == 'QUIT':
+                        self.reply('221 Bye')
+                        return
+                    else:
+                        self.reply('200 OK')
+            finally:
+                if dataListener != None: dataListener.close()
+
+    def __init__(self, delay=0.0):
+        """ delay -- Duration of the processing of each uploaded file by the server, in seconds. """
+        ServerStub.__init__(self, FTPServerStub.Handler)
+        self.delay = delay
+        self.directories = set(['/'])
+        self.files = {} # Content of uploaded files, indexed by absolute path.
+        self.failingFileCount = 0 # Number of next files that are rejected.
+
+class LinknxServerStub(ServerStub):
+    """ Linknx XML server that acknowledges the actions it is requested to execute, without executing them. """
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            server = self.server
+            server.notifyConnected()
+            data = b''
+            while True:
+                chunk = self.request.recv(4096)
+                if not chunk: return
+                data += chunk
+                while b'\x04' in data:
+                    message, data = data.split(b'\x04', 1)
+                    document = xml.dom.minidom.parseString(message.decode('utf-8'))
+                    with server._lock:
+                        server.requestCount += 1
+                        server.actionCount += len(document.getElementsByTagName('action'))
+                        server._condition.notify_all()
+                    self.request.sendall('<{0} status="success"/>\x04'.format(document.documentElement.tagName).encode('utf-8'))
+
+    def __init__(self):
+        ServerStub.__init__(self, LinknxServerStub.Handler)
+        self._condition = threading.Condition(self._lock)
+        self.requestCount = 0
+        self.actionCount = 0 # Number of <action> elements received.
+
+    def waitForActions(self, actionCount, timeout=10):
+        with self._condition:
+            return self._condition.wait_for(lambda: self.actionCount >= actionCount, timeout)
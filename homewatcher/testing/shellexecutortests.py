@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2014-2017 Cyrille Defranoux
+#
+# This file is part of Homewatcher.
+#
+# Homewatcher is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Homewatcher is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Homewatcher. If not, see <http://www.gnu.org/licenses/>.
+#
+# For any question, feature requests or bug reports, feel free to contact me at:
+# knx at aminate dot net
+
+
+import sys
+from pyknx import logger
+from pyknx.testing import base
+from homewatcher import configuration, timer
+from homewatcher.alarm import ShellCommandAction
+from homewatcher.processpump import ProcessPump
+from homewatcher.shellexecutor import ShellCommandExecutor
+import unittest
+import threading
+import time
+import xml.dom.minidom as xdm
+
+class ShellCommandExecutorTestCase(base.TestCaseBase):
+    def setUp(self):
+        base.TestCaseBase.setUp(self)
+        self.pump = ProcessPump()
+        self.scheduler = timer.TimerScheduler()
+
+    def tearDown(self):
+        self.pump.stop(timeout=5)
+        base.TestCaseBase.tearDown(self)
+
+    def testExitCodes(self):
+        executor = ShellCommandExecutor(self.pump, self.scheduler)
+        succeeding = executor.run('echo "success"', 'Succeeding command')
+        failing = executor.run('exit 4', 'Failing command')
+        self.assertEqual(succeeding.wait(5), 0)
+        self.assertEqual(failing.wait(5), 4)
+        executor.stop()
+        self.assertEqual(executor.executedCommandCount, 2)
+        self.assertEqual(executor.failedCommandCount, 1)
+        self.assertEqual(executor.exitCodeCounts, {0 : 1, 4 : 1})
+        self.assertEqual(set(executor.history), set([succeeding, failing]))
+        self.assertGreater(executor.maxDuration, 0)
+
+    def testConcurrencyLimit(self):
+        executor = ShellCommandExecutor(self.pump, self.scheduler, maxRunningCount=2)
+        startTime = time.monotonic()
+        commands = [executor.run('sleep 0.2', 'Command {0}'.format(i)) for i in range(4)]
+
+        # Only two commands run at a time.
+        self.assertEqual(len([command for command in commands if command.process != None]), 2)
+        executor.stop()
+        duration = time.monotonic() - startTime
+        self.assertEqual([command.exitCode for command in commands], [0] * 4)
+        self.assertGreaterEqual(duration, 0.4)
+        self.assertEqual(executor.peakQueuedCount, 2)
+
+    def testTimeout(self):
+        executor = ShellCommandExecutor(self.pump, self.scheduler, timeout=0.2, killDelay=0.2)
+        terminated = executor.run('sleep 10', 'Terminated command')
+        killed = executor.run('trap "" TERM; sleep 10', 'Killed command')
+        self.assertEqual(terminated.wait(5), -15)
+        self.assertEqual(killed.wait(5), -9)
+        self.assertLess(killed.duration, 2)
+        executor.stop()
+        self.assertEqual(executor.timedOutCommandCount, 2)
+
+    def testStopWhileQueueIsFull(self):
+        executor = ShellCommandExecutor(self.pump, self.scheduler, maxRunningCount=1, maxQueuedCount=1)
+        executor.run('sleep 0.3', 'Running command')
+        executor.run('sleep 0.3', 'Queued command')
+        errors = []
+        def runBlocked():
+            try:
+                executor.run('exit 0', 'Blocked command')
+            except Exception as e:
+                errors.append(e)
+        blockedThread = threading.Thread(target=runBlocked)
+        blockedThread.start()
+        self.waitDuring(0.1, 'Let command block on the full queue.')
+
+        # The blocked command is refused rather than queued after the stop.
+        executor.stop(timeout=0)
+        blockedThread.join(5)
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(len(executor._queue), 0)
+
+    def testShellCommandAction(self):
+        class DaemonMock(object):
+            def __init__(self, shellExecutor):
+                self.shellExecutor = shellExecutor
+        executor = ShellCommandExecutor(self.pump, self.scheduler)
+        actionConfigXml = xdm.parseString('<action type="shell-cmd"><cmd>exit 7</cmd></action>')
+        actionConfig = configuration.Action.fromXML(actionConfigXml.getElementsByTagName('action')[0])
+        ShellCommandAction(DaemonMock(executor), actionConfig).execute(None)
+        executor.stop()
+        self.assertEqual(executor.exitCodeCounts, {7 : 1})
+        self.assertEqual(executor.history[0].commandLine, 'exit 7')
+
+if __name__ == '__main__':
+    unittest.main()
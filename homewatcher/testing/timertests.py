@@ -23,9 +23,10 @@
 import sys
 from pyknx import logger
 from pyknx.testing import base
-from homewatcher.timer import Timer
+from homewatcher.timer import Timer, TimerScheduler, HeapTimerQueue, TimerWheelQueue
 import unittest
 import time
+import threading
 
 class TimerTestCase(base.TestCaseBase):
     def testTimer(self):
@@ -109,6 +110,114 @@ class TimerTestCase(base.TestCaseBase):
         self.waitDuring(2.7, 'Wait for timer\'s timeout.', [lambda: self.assertTrue(timer.is_alive())], 0, 0.2)
         self.assertFalse(timer.is_alive())
 
+    def testPauseWithoutOnIterate(self):
+        class TimerStatus:
+            def __init__(self):
+                self.isTimeoutReached = False
+
+            def onTimeout(self, timer):
+                self.isTimeoutReached = True
+
+        # A paused timer without onIterate sleeps until it is explicitly reset.
+        status = TimerStatus()
+        timer = Timer(None, 1, 'Paused test timer', onTimeoutReached=status.onTimeout)
+        timer.pause()
+        timer.start()
+        self.waitDuring(1.5, 'Make sure paused timer does not time out.', assertions=[lambda: self.assertFalse(status.isTimeoutReached)])
+        self.assertTrue(timer.is_alive())
+        timer.reset()
+        self.waitDuring(1.2, 'Wait for timer\'s timeout.', assertions=[lambda: self.assertFalse(status.isTimeoutReached)], assertEndMargin=0.2)
+        self.assertTrue(status.isTimeoutReached)
+        self.assertFalse(timer.is_alive())
+
+    def testTimersShareSchedulerThread(self):
+        class TimerStatus:
+            def __init__(self):
+                self.timeoutCount = 0
+                self.terminationCount = 0
+
+            def onTimeout(self, timer):
+                self.timeoutCount += 1
+
+            def onTerminated(self, timer):
+                self.terminationCount += 1
+
+        status = TimerStatus()
+        timers = [Timer(None, 1, 'Shared test timer #{0}'.format(i), onTimeoutReached=status.onTimeout, onTerminated=status.onTerminated) for i in range(200)]
+        timers[0].start()
+        threadCount = threading.active_count()
+        for timer in timers[1:]:
+            timer.start()
+        self.assertEqual(threading.active_count(), threadCount, 'Timers should not start threads of their own.')
+
+        # Cancelled timers are terminated without reaching their timeout.
+        for timer in timers[:50]:
+            timer.stop()
+        self.waitDuring(1.3, 'Wait for timers\' timeout.')
+        self.assertFalse([t for t in timers if t.is_alive()])
+        self.assertEqual(status.timeoutCount, 150)
+        self.assertEqual(status.terminationCount, 200)
+
+    def testTimerWheelQueue(self):
+        # Deadlines span every level of the wheel. Some are already reached.
+        queue = TimerWheelQueue(resolution=0.01)
+        startTime = queue._currentTick * queue.resolution
+        deadlines = {}
+        for i in range(1000):
+            deadlines[i] = startTime + (i - 10) * 0.37
+            queue.add(i, deadlines[i])
+        for i in range(0, 1000, 3):
+            queue.remove(i)
+            del deadlines[i]
+        self.assertEqual(len(queue), len(deadlines))
+
+        # Timers must expire in the first batch whose time is past their
+        # deadline, at the resolution of the wheel.
+        now = startTime
+        expiredTimers = set()
+        while len(queue):
+            previousTime = now
+            now += 1.3
+            for i in queue.popDueTimers(now):
+                self.assertNotIn(i, expiredTimers)
+                self.assertLessEqual(deadlines[i], now + queue.resolution)
+                if deadlines[i] > startTime: self.assertGreater(deadlines[i], previousTime - queue.resolution)
+                expiredTimers.add(i)
+        self.assertEqual(expiredTimers, set(deadlines.keys()))
+
+    def testTimerWithWheelScheduler(self):
+        class TimerStatus:
+            def __init__(self):
+                self.isTimeoutReached = False
+
+            def onTimeout(self, timer):
+                self.isTimeoutReached = True
+
+        status = TimerStatus()
+        timer = Timer(None, 1, 'Wheel test timer', onTimeoutReached=status.onTimeout, scheduler=TimerScheduler(TimerWheelQueue(resolution=0.1)))
+        timer.start()
+        self.waitDuring(1.2, 'Waiting for test timer to complete', assertions=[lambda: self.assertFalse(status.isTimeoutReached)], assertEndMargin=0.2)
+        self.assertTrue(status.isTimeoutReached)
+        self.assertFalse(timer.is_alive())
+
+    def testBlockingCallback(self):
+        scheduler = TimerScheduler(callbackThreadCount=2)
+        isReleased = threading.Event()
+        timeoutTimes = []
+        blockingTimer = Timer(None, 0.1, 'Blocking test timer', onTimeoutReached=lambda t: isReleased.wait(), scheduler=scheduler)
+        timer = Timer(None, 0.3, 'Test timer', onTimeoutReached=lambda t: timeoutTimes.append(time.monotonic()), scheduler=scheduler)
+        startTime = time.monotonic()
+        blockingTimer.start()
+        timer.start()
+
+        # A blocked callback does not delay the other timers.
+        self.waitDuring(0.5, 'Wait for timers\' timeout.')
+        self.assertEqual(len(timeoutTimes), 1)
+        self.assertLess(timeoutTimes[0] - startTime, 0.45)
+        self.assertTrue(blockingTimer.is_alive())
+        isReleased.set()
+        self.waitDuring(0.1, 'Let blocking timer terminate.')
+        self.assertFalse(blockingTimer.is_alive())
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,160 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2014-2017 Cyrille Defranoux
+#
+# This file is part of Homewatcher.
+#
+# Homewatcher is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Homewatcher is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Homewatcher. If not, see <http://www.gnu.org/licenses/>.
+#
+# For any question, feature requests or bug reports, feel free to contact me at:
+# knx at aminate dot net
+
+import sys
+from pyknx import logger
+from pyknx.testing import base
+from homewatcher.uploader import FTPUploader
+from homewatcher.testing.servers import FTPServerStub
+import unittest
+import os
+import shutil
+import tempfile
+
+class UploaderTestCase(base.TestCaseBase):
+    def setUp(self):
+        base.TestCaseBase.setUp(self)
+        self.server = FTPServerStub().start()
+        self.localDirectory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.localDirectory)
+        base.TestCaseBase.tearDown(self)
+
+    def makeFile(self, name, size):
+        path = os.path.join(self.localDirectory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(bytes([i % 251 for i in range(size)]))
+        return path
+
+    def makeUploader(self, **kwargs):
+        return FTPUploader('127.0.0.1', self.server.port, 'user', 'secret', **kwargs)
+
+    def testUpload(self):
+        uploader = self.makeUploader(remoteDirectory='/captures/alert', workerCount=2, blockSize=1024)
+        uploader.start()
+        paths = [self.makeFile('snapshot{0}.jpg'.format(i), 10000 + i) for i in range(10)]
+        for path in paths:
+            uploader.enqueue(path)
+        uploader.enqueue(paths[0], 'subdir/renamed.jpg')
+        uploader.stop()
+
+        # Files are streamed in several blocks and reassembled by the server.
+        for i, path in enumerate(paths):
+            with open(path, 'rb') as f:
+                self.assertEqual(self.server.files['/captures/alert/snapshot{0}.jpg'.format(i)], f.read())
+        self.assertEqual(len(self.server.files['/captures/alert/subdir/renamed.jpg']), 10000)
+        self.assertEqual(uploader.uploadedFileCount, 11)
+        self.assertEqual(uploader.uploadedByteCount, sum([10000 + i for i in range(10)]) + 10000)
+        self.assertGreater(uploader.throughput, 0)
+
+        # Connections are kept open between files.
+        self.assertLessEqual(self.server.connectionCount, 2)
+
+    def testDeleteUploadedFiles(self):
+        uploader = self.makeUploader(deleteUploadedFiles=True)
+        uploader.start()
+        uploader.enqueue(self.makeFile('snapshot.jpg', 100))
+        uploader.stop()
+        self.assertEqual(list(self.server.files.keys()), ['/snapshot.jpg'])
+        self.assertEqual(os.listdir(self.localDirectory), [])
+
+    def testDropOldestWhenFull(self):
+        uploader = self.makeUploader(workerCount=1, maxQueuedFileCount=2, pollInterval=0.05, maxAttemptCount=1)
+        paths = [self.makeFile('snapshot{0}.jpg'.format(i), 100) for i in range(6)]
+        for path in paths:
+            uploader.enqueue(path)
+        uploader.start()
+        uploader.stop()
+
+        # The first files have been pushed out of the queue by the latest ones.
+        self.assertEqual(sorted(self.server.files.keys()), ['/snapshot4.jpg', '/snapshot5.jpg'])
+        self.assertEqual(uploader.droppedFileCount, 4)
+        self.assertEqual(uploader.abandonedFileCount, 4)
+
+    def testDroppedFilesAreRetried(self):
+        uploader = self.makeUploader(workerCount=1, maxQueuedFileCount=2, pollInterval=0.05, maxAttemptCount=5)
+        paths = [self.makeFile('snapshot{0}.jpg'.format(i), 100) for i in range(6)]
+        for path in paths:
+            uploader.enqueue(path)
+        uploader.start()
+        uploader.stop()
+
+        # Dropped files are queued again once the queue has room for them.
+        self.assertEqual(len(self.server.files), 6)
+        self.assertEqual(uploader.abandonedFileCount, 0)
+
+    def testFailedUploadIsRetried(self):
+        self.server.failingFileCount = 1
+        uploader = self.makeUploader(workerCount=1, pollInterval=0.05)
+        uploader.start()
+        uploader.enqueue(self.makeFile('snapshot.jpg', 100))
+        uploader.stop()
+        self.assertEqual(list(self.server.files.keys()), ['/snapshot.jpg'])
+        self.assertEqual(uploader.failedFileCount, 1)
+        self.assertEqual(uploader.uploadedFileCount, 1)
+
+    def testMissingFile(self):
+        uploader = self.makeUploader(workerCount=1, pollInterval=0.05)
+        uploader.start()
+        uploader.enqueue(os.path.join(self.localDirectory, 'missing.jpg'))
+        uploader.enqueue(self.makeFile('snapshot.jpg', 100))
+        uploader.stop()
+        self.assertEqual(list(self.server.files.keys()), ['/snapshot.jpg'])
+
+        # The missing file is given up after the maximum number of attempts.
+        self.assertEqual(uploader.failedFileCount, 3)
+        self.assertEqual(uploader.abandonedFileCount, 1)
+
+    def testWatchedDirectory(self):
+        self.makeFile('old.jpg', 100)
+        uploader = self.makeUploader(watchedDirectory=self.localDirectory, pollInterval=0.05)
+        uploader.start()
+        self.makeFile('camera1/snapshot.jpg', 100)
+        self.waitDuring(0.5, 'Let watched directory be scanned.')
+        uploader.stop()
+
+        # Files that were already there are not uploaded, and uploaded files
+        # are kept but not uploaded again.
+        self.assertEqual(list(self.server.files.keys()), ['/camera1/snapshot.jpg'])
+        self.assertEqual(uploader.uploadedFileCount, 1)
+        self.assertTrue(os.path.exists(os.path.join(self.localDirectory, 'camera1', 'snapshot.jpg')))
+
+    def testWatchedDirectoryWithDeletion(self):
+        self.makeFile('old.jpg', 100)
+        uploader = self.makeUploader(watchedDirectory=self.localDirectory, pollInterval=0.05, deleteUploadedFiles=True)
+        uploader.start()
+        self.makeFile('camera1/snapshot.jpg', 100)
+        self.waitDuring(0.5, 'Let watched directory be scanned.')
+        uploader.stop()
+
+        # Files left by a previous run have not been uploaded yet, since
+        # uploaded files are removed.
+        self.assertEqual(sorted(self.server.files.keys()), ['/camera1/snapshot.jpg', '/old.jpg'])
+        self.assertEqual(uploader.uploadedFileCount, 2)
+        self.assertEqual(os.listdir(os.path.join(self.localDirectory, 'camera1')), [])
+        self.assertFalse(os.path.exists(os.path.join(self.localDirectory, 'old.jpg')))
+
+if __name__ == '__main__':
+    unittest.main()
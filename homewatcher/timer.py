@@ -27,13 +27,267 @@ import subprocess
 import os
 import threading
 import time
+import heapq
+import itertools
+import collections
 
-class Timer(threading.Thread):
-    def __init__(self, sensor, timeout, name, onTimeoutReached, onIterate = None, onTerminated = None):
-        threading.Thread.__init__(self, name=name + ' (id={0})'.format(id(self)))
+class HeapTimerQueue(object):
+    """ Queue of timer deadlines stored in a binary heap. Obsolete entries are lazily discarded when they reach the top of the heap. """
+    def __init__(self):
+        self._deadlines = [] # Heap of (deadline, sequence number, timer) tuples.
+        self._sequenceNumbers = itertools.count()
+        self._sequenceNumbersByTimer = {} # Sequence number of the only valid entry of each queued timer.
+
+    def __len__(self):
+        return len(self._sequenceNumbersByTimer)
+
+    def add(self, timer, deadline):
+        sequenceNumber = next(self._sequenceNumbers)
+        self._sequenceNumbersByTimer[timer] = sequenceNumber
+        heapq.heappush(self._deadlines, (deadline, sequenceNumber, timer))
+
+    def remove(self, timer):
+        self._sequenceNumbersByTimer.pop(timer, None)
+
+    def getNextDeadline(self):
+        self._discardObsoleteEntries()
+        return self._deadlines[0][0] if self._deadlines else None
+
+    def popDueTimers(self, now):
+        dueTimers = []
+        self._discardObsoleteEntries()
+        while self._deadlines and self._deadlines[0][0] <= now:
+            deadline, sequenceNumber, timer = heapq.heappop(self._deadlines)
+            del self._sequenceNumbersByTimer[timer]
+            dueTimers.append(timer)
+            self._discardObsoleteEntries()
+        return dueTimers
+
+    def _discardObsoleteEntries(self):
+        while self._deadlines and self._sequenceNumbersByTimer.get(self._deadlines[0][2]) != self._deadlines[0][1]:
+            heapq.heappop(self._deadlines)
+
+class TimerWheelQueue(object):
+    """
+    Queue of timer deadlines stored in a hierarchical timer wheel.
+
+    Time is divided into ticks of a fixed resolution. Level 0 has one slot per tick for the next SLOT_COUNT ticks, each
+    upper level has slots that span SLOT_COUNT times more ticks than the level below. Entries of an upper level slot are
+    cascaded to lower levels when the wheel reaches that slot. Insertion and removal are O(1) and all timers of a slot
+    expire together. Deadlines are rounded up to the next tick.
+    """
+    SLOT_COUNT_BITS = 6
+    SLOT_COUNT = 1 << SLOT_COUNT_BITS
+    LEVEL_COUNT = 4
+
+    def __init__(self, resolution=0.1):
+        if resolution <= 0:
+            raise Exception('Timer wheel resolution must be positive, {0} found.'.format(resolution))
+        self.resolution = resolution
+        self._levels = [[set() for i in range(TimerWheelQueue.SLOT_COUNT)] for level in range(TimerWheelQueue.LEVEL_COUNT)]
+        self._overdueTimers = set() # Timers whose deadline was already reached when they were added.
+        self._overflowTimers = set() # Timers whose deadline is beyond the range of the upper level.
+        self._entriesByTimer = {} # Value is a (slot, expiry tick) tuple.
+        self._currentTick = self._getTick(time.monotonic())
+
+    def __len__(self):
+        return len(self._entriesByTimer)
+
+    def _getTick(self, timestamp):
+        return int(timestamp / self.resolution)
+
+    def add(self, timer, deadline):
+        self.remove(timer)
+        expiryTick = self._getTick(deadline)
+        if expiryTick * self.resolution < deadline: expiryTick += 1
+        self._insert(timer, expiryTick)
+
+    def _insert(self, timer, expiryTick):
+        delta = expiryTick - self._currentTick
+        if delta <= 0:
+            slot = self._overdueTimers
+        else:
+            level = (delta.bit_length() - 1) // TimerWheelQueue.SLOT_COUNT_BITS
+            if level < TimerWheelQueue.LEVEL_COUNT:
+                slot = self._levels[level][(expiryTick >> (TimerWheelQueue.SLOT_COUNT_BITS * level)) & (TimerWheelQueue.SLOT_COUNT - 1)]
+            else:
+                slot = self._overflowTimers
+        slot.add(timer)
+        self._entriesByTimer[timer] = (slot, expiryTick)
+
+    def remove(self, timer):
+        entry = self._entriesByTimer.pop(timer, None)
+        if entry != None:
+            entry[0].discard(timer)
+
+    def getNextDeadline(self):
+        if not self._entriesByTimer: return None
+        if self._overdueTimers: return self._currentTick * self.resolution
+
+        # Search for the next occupied slot in the lower level. Otherwise, wake
+        # up at the next cascade.
+        for tick in range(self._currentTick + 1, self._currentTick + TimerWheelQueue.SLOT_COUNT + 1):
+            if self._levels[0][tick & (TimerWheelQueue.SLOT_COUNT - 1)]:
+                return tick * self.resolution
+            if tick & (TimerWheelQueue.SLOT_COUNT - 1) == 0:
+                return tick * self.resolution
+
+    def popDueTimers(self, now):
+        dueTimers = self._popSlot(self._overdueTimers)
+        targetTick = self._getTick(now)
+        if not self._entriesByTimer:
+            self._currentTick = max(self._currentTick, targetTick)
+            return dueTimers
+
+        while self._currentTick < targetTick:
+            self._currentTick += 1
+            self._cascade() # Timers that expire on this very tick are cascaded to the overdue ones.
+            dueTimers.extend(self._popSlot(self._overdueTimers))
+            dueTimers.extend(self._popSlot(self._levels[0][self._currentTick & (TimerWheelQueue.SLOT_COUNT - 1)]))
+        return dueTimers
+
+    def _popSlot(self, slot):
+        timers = list(slot)
+        slot.clear()
+        for timer in timers:
+            del self._entriesByTimer[timer]
+        return timers
+
+    def _cascade(self):
+        """ Moves the entries of the upper level slots that the wheel has just reached to lower levels. """
+        for level in range(1, TimerWheelQueue.LEVEL_COUNT + 1):
+            levelShift = TimerWheelQueue.SLOT_COUNT_BITS * level
+            if self._currentTick & ((1 << levelShift) - 1) != 0: return
+
+            if level < TimerWheelQueue.LEVEL_COUNT:
+                slot = self._levels[level][(self._currentTick >> levelShift) & (TimerWheelQueue.SLOT_COUNT - 1)]
+            else:
+                slot = self._overflowTimers
+            for timer in list(slot):
+                expiryTick = self._entriesByTimer[timer][1]
+                slot.discard(timer)
+                self._insert(timer, expiryTick)
+
+class TimerScheduler(object):
+    """
+    Drives every Timer from a single thread.
+
+    Timers register their next deadline in a queue keyed on time.monotonic(). The scheduler thread sleeps on a condition
+    variable until the earliest deadline is reached or until a timer changes, then hands the timers that are due to a pool
+    of callback threads. Callbacks may thus block (to deliver the actions of an event for instance) without delaying the
+    deadlines of other timers, as long as fewer than callbackThreadCount of them block at once. A timer is never processed
+    by two threads at once.
+    """
+    ITERATION_PERIOD = 0.2 # Delay between two calls to a timer's onIterate callback, in seconds.
+
+    _INSTANCE = None
+
+    def __init__(self, queue=None, callbackThreadCount=4):
+        self._condition = threading.Condition(threading.RLock())
+        self._queue = queue if queue != None else HeapTimerQueue()
+        self._nextWakeUp = None
+        self._thread = None
+        self.callbackThreadCount = callbackThreadCount
+        self._callbackCondition = threading.Condition(threading.Lock()) # Distinct from _condition so that notifying callback threads never wakes up the scheduler thread, and conversely.
+        self._dueTimers = collections.deque() # Timers waiting for a callback thread.
+        self._processingTimers = set() # Timers being processed by a callback thread.
+        self._timersToReprocess = set() # Timers that became due again while being processed.
+
+    @staticmethod
+    def getInstance():
+        if TimerScheduler._INSTANCE == None:
+            TimerScheduler._INSTANCE = TimerScheduler()
+        return TimerScheduler._INSTANCE
+
+    @property
+    def pendingTimerCount(self):
+        with self._condition:
+            return len(self._queue)
+
+    def schedule(self, timer, deadline):
+        """ Asks for timer to be processed at deadline. Any previously scheduled deadline for this timer becomes obsolete. """
+        with self._condition:
+            self._queue.add(timer, deadline)
+            self._ensureThreadStarted()
+
+            # Wake up the scheduler thread only if its next wakeup has to be
+            # brought forward.
+            if self._nextWakeUp is None or deadline < self._nextWakeUp:
+                self._condition.notify()
+
+    def unschedule(self, timer):
+        """ Cancels the deadline previously scheduled for timer, if any. """
+        with self._condition:
+            self._queue.remove(timer)
+
+    def _ensureThreadStarted(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='Timer scheduler')
+            self._thread.daemon = True
+            self._thread.start()
+            for i in range(self.callbackThreadCount):
+                callbackThread = threading.Thread(target=self._runCallbacks, name='Timer callback #{0}'.format(i))
+                callbackThread.daemon = True
+                callbackThread.start()
+
+    def _popDueTimers(self):
+        """ Blocks until at least one timer is due and returns all due timers. Must be called with the condition held. """
+        while True:
+            now = time.monotonic()
+            dueTimers = self._queue.popDueTimers(now)
+            if dueTimers:
+                self._nextWakeUp = None
+                return dueTimers
+
+            self._nextWakeUp = self._queue.getNextDeadline()
+            self._condition.wait(max(0, self._nextWakeUp - now) if self._nextWakeUp != None else None)
+
+    def _run(self):
+        logger.reportDebug('Timer scheduler is started.')
+        while True:
+            with self._condition:
+                dueTimers = self._popDueTimers()
+
+            with self._callbackCondition:
+                self._dueTimers.extend(dueTimers)
+                self._callbackCondition.notify_all()
+
+    def _runCallbacks(self):
+        while True:
+            with self._callbackCondition:
+                while not self._dueTimers:
+                    self._callbackCondition.wait()
+                timer = self._dueTimers.popleft()
+                if timer in self._processingTimers:
+                    # Its current processing may have missed the change that
+                    # made it due.
+                    self._timersToReprocess.add(timer)
+                    continue
+                self._processingTimers.add(timer)
+
+            # Callbacks are run without holding the conditions so that they can
+            # freely start, stop or modify timers.
+            try:
+                timer._process()
+            except Exception as e:
+                logger.reportException('Error while processing {0}.'.format(timer))
+
+            with self._callbackCondition:
+                self._processingTimers.discard(timer)
+                if timer in self._timersToReprocess:
+                    self._timersToReprocess.discard(timer)
+                    self._dueTimers.append(timer)
+                    self._callbackCondition.notify()
+
+class Timer(object):
+    def __init__(self, sensor, timeout, name, onTimeoutReached, onIterate = None, onTerminated = None, scheduler = None):
+        self.name = name + ' (id={0})'.format(id(self))
         self.sensor = sensor
         self.timeout = timeout
-        self.reset()
+        self._scheduler = scheduler if scheduler != None else TimerScheduler.getInstance()
+        self._isStarted = False
+        self.endTime = None
+        self.isPaused = False
         self.isTerminating = False
         self.isCancelled = False
         self.isTerminated = False # Mainly for unit testing.
@@ -41,34 +295,76 @@ class Timer(threading.Thread):
         self.onTimeoutReached = onTimeoutReached
         self.onTerminated = onTerminated
 
-    def run(self):
+    def start(self):
+        if self._isStarted:
+            raise Exception('{0} is already started.'.format(self))
+        logger.reportDebug('Starting {0}'.format(self))
+        self._isStarted = True
+        self._reschedule()
+
+    def is_alive(self):
+        return self._isStarted and not self.isTerminated
+
+    def _reschedule(self):
+        """ Registers the next moment at which this timer has to be processed by the scheduler. """
+        if not self.is_alive(): return
+
+        if self.isTerminating:
+            # Process as soon as possible.
+            deadline = time.monotonic()
+        elif self.isPaused:
+            # A paused timer only needs to wake up to call onIterate, which may
+            # reset it. Otherwise, it waits for an explicit reset.
+            deadline = time.monotonic() + TimerScheduler.ITERATION_PERIOD if self.onIterate is not None else None
+        elif self.endTime is None:
+            deadline = time.monotonic()
+        elif self.onIterate is not None:
+            deadline = min(self.endTime, time.monotonic() + TimerScheduler.ITERATION_PERIOD)
+        else:
+            deadline = self.endTime
+
+        if deadline is None:
+            self._scheduler.unschedule(self)
+        else:
+            self._scheduler.schedule(self, deadline)
+
+    def _process(self):
+        """ Runs a single iteration of this timer. Called by the scheduler thread when the timer is due. """
+        if self.isTerminated: return
+
+        hasTimedOut = False
         try:
-            logger.reportDebug('Starting {0}'.format(self))
-            while not self.isTerminating:
+            if not self.isTerminating:
                 if self.onIterate is not None: self.onIterate(self)
 
                 # Check for termination.
-                if self.isTerminating:
-                    return
-
-                # Main loop.
-                if not self.isPaused:
+                if not self.isTerminating and not self.isPaused:
                     if self.endTime is None: self.extend(starts=True)
-                    if time.time() > self.endTime:
+                    if time.monotonic() >= self.endTime:
                         # Execute delayed job.
                         logger.reportDebug('Timeout reached for {0}.'.format(self))
+                        hasTimedOut = True
                         if callable(self.onTimeoutReached): self.onTimeoutReached(self)
-                        break
-
-                time.sleep(0.2)
+        except:
+            hasTimedOut = True # Terminate the timer, like an exception raised in a thread would.
+            raise
         finally:
-            if self.isTerminating:
-                # Timer has been stopped from outside.
-                logger.reportDebug('{0} is canceled.'.format(self))
+            if hasTimedOut or self.isTerminating:
+                self._terminate()
             else:
-                # Maybe useless but set it for consistency.
-                self.isTerminating = True
+                self._reschedule()
+
+    def _terminate(self):
+        self._scheduler.unschedule(self)
+        if self.isTerminating:
+            # Timer has been stopped from outside.
+            logger.reportDebug('{0} is canceled.'.format(self))
+        else:
+            # Maybe useless but set it for consistency.
+            self.isTerminating = True
+        try:
             if callable(self.onTerminated): self.onTerminated(self)
+        finally:
             logger.reportDebug('{0} is now terminated.'.format(self))
             self.isTerminated = True
             self.isTerminating = False
@@ -76,19 +372,24 @@ class Timer(threading.Thread):
     def forceTimeout(self):
         logger.reportDebug('Forcing timeout of {0}'.format(self))
         self.endTime = 0
+        self._reschedule()
 
     def pause(self):
+        if self.isPaused: return
         self.isPaused = True
+        self._reschedule()
 
     def stop(self):
         if not self.isCancelled:
             self.isCancelled = True
             self.isTerminating = True
             logger.reportDebug('Cancelling {0}.'.format(self))
+            self._reschedule()
 
     def reset(self):
         self.endTime = None
         self.isPaused = False
+        self._reschedule()
 
     def __str__(self):
         return '{0} => {1} id={2}'.format(self.sensor, self.name, id(self))
@@ -97,8 +398,9 @@ class Timer(threading.Thread):
         """ Prolong duration by the timeout amount of time. """
         if self.isTerminating:
             raise Exception('Timer {0} is terminating, it cannot be extended.'.format(self))
-        self.endTime = time.time() + self.timeout
+        self.endTime = time.monotonic() + self.timeout
         if starts:
             logger.reportDebug('{0} started for {1} seconds.'.format(self, self.timeout))
         else:
             logger.reportDebug('{0} is extended by {1} seconds.'.format(self, self.timeout))
+            self._reschedule()
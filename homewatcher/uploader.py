@@ -0,0 +1,293 @@
+#!/usr/bin/python3
+
+# Copyright (C) 2014-2017 Cyrille Defranoux
+#
+# This file is part of Homewatcher.
+#
+# Homewatcher is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Homewatcher is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Homewatcher. If not, see <http://www.gnu.org/licenses/>.
+#
+# For any question, feature requests or bug reports, feel free to contact me at:
+# knx at aminate dot net
+
+from homewatcher import ensurepyknx
+
+from pyknx import logger
+import collections
+import ftplib
+import os
+import posixpath
+import threading
+import time
+
+class FTPUploader(object):
+    """
+    Uploads files (typically camera snapshots taken during an alert) to an FTP server in the background.
+
+    Files are queued explicitly or picked up from a watched directory in which shell commands store their captures. Workers keep their connection open between files and stream them block by block. When the queue is full, the oldest file is dropped. Failed and dropped files are queued again at the next poll, until they have been queued maxAttemptCount times.
+    """
+    class _Upload(object):
+        def __init__(self, path, remotePath):
+            self.path = path
+            self.remotePath = remotePath
+            self.attemptCount = 0 # Number of times the file has been queued.
+
+        def __repr__(self):
+            return self.path
+
+    def __init__(self, host, port=21, username=None, password=None, remoteDirectory='/', workerCount=2, maxQueuedFileCount=100, blockSize=65536, timeout=20.0, watchedDirectory=None, pollInterval=1.0, maxAttemptCount=3, deleteUploadedFiles=False):
+        """
+        remoteDirectory -- Directory of the server in which files are uploaded. Missing directories are created.
+        watchedDirectory -- Local directory whose new files are uploaded automatically, preserving their path relative to it. None to disable.
+        pollInterval -- Delay between two scans of the watched directory and between two retries, in seconds.
+        deleteUploadedFiles -- Whether local files are deleted once uploaded. If so, files that are in the watched directory at startup are uploaded too, since they have not been uploaded by a previous run.
+        """
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.remoteDirectory = remoteDirectory
+        self.workerCount = workerCount
+        self.maxQueuedFileCount = maxQueuedFileCount
+        self.blockSize = blockSize
+        self.timeout = timeout
+        self.watchedDirectory = watchedDirectory
+        self.pollInterval = pollInterval
+        self.maxAttemptCount = maxAttemptCount
+        self.deleteUploadedFiles = deleteUploadedFiles
+        self._condition = threading.Condition(threading.Lock())
+        self._queue = collections.deque()
+        self._failedUploads = [] # Failed or dropped uploads to queue again at the next poll.
+        self._activeUploadCount = 0
+        self._threads = []
+        self._isStopped = False
+
+        # Statistics.
+        self.uploadedFileCount = 0
+        self.uploadedByteCount = 0
+        self.uploadDuration = 0.0 # Cumulated duration of uploads, in seconds.
+        self.failedFileCount = 0 # Failed attempts.
+        self.droppedFileCount = 0
+        self.abandonedFileCount = 0 # Files that were not uploaded after maxAttemptCount attempts.
+        self.connectionCount = 0
+
+    @property
+    def throughput(self):
+        """ Average upload rate of a worker, in bytes per second. """
+        return self.uploadedByteCount / self.uploadDuration if self.uploadDuration else 0.0
+
+    def start(self):
+        for i in range(self.workerCount):
+            self._startThread(self._runWorker, 'FTP upload worker #{0}'.format(i))
+        # Files that are already there have been handled by a previous run,
+        # unless uploaded files are deleted.
+        sizesByPath = {} # Size of files at the last scan, or None once they are queued.
+        if self.watchedDirectory != None and not self.deleteUploadedFiles:
+            sizesByPath = {path : None for path in self._listWatchedFiles()}
+        self._startThread(lambda: self._runMonitor(sizesByPath), 'FTP upload monitor')
+        logger.reportInfo('FTP uploader is ready. Configured for ftp://{0}:{1}{2}'.format(self.host, self.port, self.remoteDirectory))
+
+    def _startThread(self, target, name):
+        thread = threading.Thread(target=target, name=name)
+        thread.daemon = True
+        self._threads.append(thread)
+        thread.start()
+
+    def enqueue(self, path, remotePath=None):
+        """
+        Queues a local file for upload.
+
+        remotePath -- Path of the file on the server, relative to the remote directory. Defaults to the name of the local file.
+        """
+        if remotePath == None: remotePath = os.path.basename(path)
+        with self._condition:
+            if self._isStopped:
+                logger.reportWarning('FTP uploader is stopped, {0} will not be uploaded.'.format(path))
+                return
+            self._enqueue(FTPUploader._Upload(path, remotePath))
+
+    def _enqueue(self, upload):
+        """ Queues an upload. The lock must be held. """
+        if len(self._queue) >= self.maxQueuedFileCount:
+            droppedUpload = self._queue.popleft()
+            self.droppedFileCount += 1
+            logger.reportWarning('FTP upload queue is full, {0} is dropped.'.format(droppedUpload))
+            self._failedUploads.append(droppedUpload)
+        upload.attemptCount += 1
+        self._queue.append(upload)
+        self._condition.notify_all()
+
+    def _retryFailedUploads(self):
+        with self._condition:
+            failedUploads = self._failedUploads
+            self._failedUploads = []
+            for upload in failedUploads:
+                if upload.attemptCount < self.maxAttemptCount:
+                    self._enqueue(upload)
+                else:
+                    self.abandonedFileCount += 1
+                    logger.reportError('{0} could not be uploaded after {1} attempts.'.format(upload, upload.attemptCount))
+            self._condition.notify_all()
+
+    def _runWorker(self):
+        connection = None
+        try:
+            while True:
+                with self._condition:
+                    while not self._queue and not self._isStopped:
+                        self._condition.wait()
+                    if not self._queue: return
+                    upload = self._queue.popleft()
+                    self._activeUploadCount += 1
+
+                try:
+                    connection = self._upload(connection, upload)
+                finally:
+                    with self._condition:
+                        self._activeUploadCount -= 1
+                        self._condition.notify_all()
+        finally:
+            self._closeConnection(connection)
+
+    def _upload(self, connection, upload):
+        """ Uploads a file and returns the connection to use for the next one. """
+        startTime = time.monotonic()
+        try:
+            with open(upload.path, 'rb') as localFile:
+                try:
+                    if connection == None: connection = self._openConnection()
+                    self._store(connection, upload, localFile)
+                except (ftplib.error_temp, EOFError, OSError):
+                    # The server may have closed the connection since the
+                    # previous upload.
+                    self._closeConnection(connection)
+                    connection = self._openConnection()
+                    localFile.seek(0)
+                    self._store(connection, upload, localFile)
+                byteCount = localFile.tell()
+        except Exception:
+            logger.reportException('Could not upload {0} to FTP server.'.format(upload))
+            with self._condition:
+                self.failedFileCount += 1
+                self._failedUploads.append(upload)
+            self._closeConnection(connection)
+            return None
+
+        duration = time.monotonic() - startTime
+        with self._condition:
+            self.uploadedFileCount += 1
+            self.uploadedByteCount += byteCount
+            self.uploadDuration += duration
+        logger.reportDebug('{0} has been sent to remote FTP server ({1} bytes in {2:.3f}s).'.format(upload, byteCount, duration))
+        if self.deleteUploadedFiles:
+            try:
+                os.remove(upload.path)
+            except OSError as e:
+                logger.reportWarning('Could not remove uploaded file {0}: {1}'.format(upload, e))
+        return connection
+
+    def _store(self, connection, upload, localFile):
+        remotePath = posixpath.join(self.remoteDirectory, upload.remotePath)
+        self._cwd(connection, posixpath.dirname(remotePath))
+        connection.storbinary('STOR {0}'.format(posixpath.basename(remotePath)), localFile, self.blockSize)
+
+    def _cwd(self, connection, directory):
+        """ Changes the current directory of the connection, creating missing directories. """
+        try:
+            connection.cwd(directory)
+            return
+        except ftplib.error_perm as e:
+            if not str(e).startswith('550'): raise
+
+        connection.cwd('/')
+        for level in directory.split('/'):
+            if level == '': continue # Happens if directory has a leading '/'
+            try:
+                connection.cwd(level)
+            except ftplib.error_perm:
+                connection.mkd(level)
+                connection.cwd(level)
+        logger.reportInfo('{0} created on FTP server.'.format(directory))
+
+    def _openConnection(self):
+        connection = ftplib.FTP(timeout=self.timeout)
+        try:
+            connection.connect(host=self.host, port=self.port)
+            if self.username != None:
+                connection.login(user=self.username, passwd=self.password)
+            else:
+                connection.login()
+        except:
+            connection.close()
+            raise
+        with self._condition:
+            self.connectionCount += 1
+        return connection
+
+    def _closeConnection(self, connection):
+        if connection == None: return
+        try:
+            connection.quit()
+        except (ftplib.Error, EOFError, OSError):
+            connection.close()
+
+    def _listWatchedFiles(self):
+        for directory, subdirectories, filenames in os.walk(self.watchedDirectory):
+            for filename in filenames:
+                yield os.path.join(directory, filename)
+
+    def _runMonitor(self, sizesByPath):
+        while True:
+            with self._condition:
+                if self._condition.wait_for(lambda: self._isStopped, self.pollInterval): return
+
+            self._retryFailedUploads()
+            if self.watchedDirectory != None:
+                self._scanWatchedDirectory(sizesByPath)
+
+    def _scanWatchedDirectory(self, sizesByPath):
+        presentPaths = set()
+        for path in self._listWatchedFiles():
+            presentPaths.add(path)
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue # Removed in the meantime.
+            previousSize = sizesByPath.get(path, -1)
+            if previousSize == size:
+                # File is not being written anymore.
+                self.enqueue(path, os.path.relpath(path, self.watchedDirectory).replace(os.sep, '/'))
+                sizesByPath[path] = None
+            elif previousSize != None:
+                sizesByPath[path] = size
+
+        # Uploaded files are tracked as long as they are present, so that they
+        # are not uploaded again.
+        for path in set(sizesByPath) - presentPaths:
+            del sizesByPath[path]
+
+    def stop(self, timeout=None):
+        """ Waits for queued and retried files to be uploaded, at most timeout seconds, then stops workers. """
+        with self._condition:
+            self._condition.wait_for(lambda: not self._queue and not self._failedUploads and self._activeUploadCount == 0, timeout)
+            if self._queue or self._failedUploads:
+                logger.reportWarning('{0} files have not been uploaded before termination.'.format(len(self._queue) + len(self._failedUploads)))
+                self._queue.clear()
+                self._failedUploads = []
+            self._isStopped = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def __repr__(self):
+        return 'FTP uploader ({0} queued, {1} uploaded, {2} failed, {3} dropped, {4} abandoned, {5} connections, {6:.1f} kB/s)'.format(len(self._queue), self.uploadedFileCount, self.failedFileCount, self.droppedFileCount, self.abandonedFileCount, self.connectionCount, self.throughput / 1e3)